@@ -0,0 +1,412 @@
+
+# Copyright (c) 2017-2018 Steve Horne
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmarks for tinytags on generated tag forests.
+
+    python benchmark.py                                   # small and medium, JSON to stdout
+    python benchmark.py --scales small --output run.json
+    python benchmark.py --output base.json                # store a baseline
+    python benchmark.py --baseline base.json --threshold 0.2 --threshold select=0.5
+    python benchmark.py --scales small --workers 8        # also Table.cell_eids() on 8 processes
+
+With --baseline, every benchmark whose median time per operation grew by more
+than its threshold is reported as a regression and the exit status is 1.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+from timeit import default_timer
+
+from tinydb.storages import MemoryStorage
+from tinytags import TinyTagsDB, Tag, Data, TagList, Table, TableCell, SQLiteStorage, LogStorage
+
+
+# Forest shapes: roots, depth of each tree, children per tag, data per leaf tag,
+# chance each Data is also in another leaf, tags joined per table and cells saved per table.
+SCALES = {"small": dict(roots=2, depth=3, fanout=3, data=2, overlap=0.5, dims=2, cells=10),
+          "medium": dict(roots=3, depth=3, fanout=6, data=3, overlap=0.5, dims=2, cells=30),
+          "large": dict(roots=4, depth=4, fanout=6, data=3, overlap=0.5, dims=3, cells=60)}
+
+STORAGES = {"json": None,
+            "memory": MemoryStorage,
+            "sqlite": SQLiteStorage,
+            "log": LogStorage}
+
+
+class Forest(object):
+    """
+    A seeded, randomly built forest of tags in db.
+
+    Every tree has depth levels with fanout children per tag. Each leaf gets data
+    new Data, and each Data is also put in another random leaf with chance overlap,
+    so leaves share data. Parents of leaves are joined dims at a time into tables with
+    cells saved tablecells of type datalist.
+    """
+
+    def __init__(self, db, seed=0, roots=2, depth=3, fanout=3, data=2, overlap=0.2, dims=2, cells=10):
+
+        if depth < 2:
+            raise ValueError("depth must be at least 2.")
+
+        self.db = db
+        self.random = random.Random(seed)
+
+        self.roots = []
+        self.tags = []
+        self.parents = []
+        self.leaves = []
+        self.data = []
+        self.tables = []
+        self.cells = []
+
+        with db.batch():
+            for number in range(roots):
+                self._tree("r{0}".format(number), depth, fanout, data)
+            self._overlap(overlap)
+
+        for table in range(max(1, roots)):
+            self._table(dims, cells)
+
+    def _tree(self, name, depth, fanout, data):
+
+        self.db.insert_root(Tag(name))
+        root = self.db.select(name)
+        self.roots.append(name)
+        self.tags.append(name)
+
+        level = [root]
+        for height in range(1, depth):
+            below = []
+            for tag in level:
+                children = [Tag("{0}_{1}".format(tag.name, i)) for i in range(fanout)]
+                tag.insert(*children)
+                below.extend(children)
+
+            self.tags.extend(tag.name for tag in below)
+            if height == depth - 1:
+                self.parents.extend(tag.name for tag in level)
+            level = below
+
+        for leaf in level:
+            leaf.insert(*[Data("{0}_d{1}".format(leaf.name, i), "generated", "http://example.com/{0}/{1}".format(leaf.name, i))
+                          for i in range(data)])
+
+            self.data.extend(leaf.datalist)
+            self.leaves.append(leaf.name)
+
+    def _overlap(self, overlap):
+
+        for eid in self.data:
+            if self.random.random() < overlap:
+                self.db.select(self.random.choice(self.leaves)).insert(Data(eid=eid, db=self.db))
+
+    def _table(self, dims, cells):
+
+        if len(self.parents) < dims:
+            return
+
+        names = self.random.sample(self.parents, dims)
+        table = list(Table(TagList([self.db.select(name) for name in names], "and", db=self.db)).cells())
+
+        for cell in self.random.sample(table, min(cells, len(table))):
+            cell.insert_cell()
+            self.cells.append(cell.eid)
+
+        # Cells made from tag eids get no type, and only datalist cells have "dand".
+        self.db.CELLS.update({"type": "datalist"}, eids=self.cells)
+
+        self.tables.append(names)
+
+    def sample(self, items, count):
+
+        return [self.random.choice(items) for i in range(count)] if items else []
+
+
+def benchmarks(forest, count):
+    """
+    Returns (name, setup) pairs. setup() returns the operation and a list of
+    argument tuples, one per call that is timed.
+    """
+
+    db = forest.db
+    new = iter(xrange(sys.maxint))
+
+    def tags(names):
+        return [(db.select(name),) for name in names]
+
+    def pairs():
+        return [tuple(forest.random.sample(forest.tags, 2)) for i in range(count)]
+
+    def expression(names):
+        return " and ".join(names)
+
+    def cells():
+        return [(TableCell(eid=eid, db=db),) for eid in forest.sample(forest.cells, count)]
+
+    def removable():
+        parents = tags(forest.sample(forest.tags, count))
+        added = []
+        for parent, in parents:
+            tag = Tag("removed{0}".format(next(new)))
+            parent.insert(tag)
+            added.append((tag,))
+        return added
+
+    suite = [("select", lambda: (db.select, [(name,) for name in forest.sample(forest.tags, count)])),
+             ("select_logical", lambda: (lambda a, b: db._select_logical("and", a, b), pairs())),
+             ("select_expression", lambda: (lambda a, b: db.select("{0} or {1}".format(a, b)), pairs())),
+             ("autocomplete", lambda: (db.autocomplete, [(name[:3],) for name in forest.sample(forest.tags, count)])),
+             ("tag_insert", lambda: (lambda parent: parent.insert(Tag("new{0}".format(next(new)))),
+                                     tags(forest.sample(forest.parents, count))))]
+
+    for key in ["", ".", "#", "^", "x", "&", "d"]:
+        suite.append(("tag_get[{0}]".format(key),
+                      lambda key=key: (lambda tag: tag.get(key), tags(forest.sample(forest.tags, count)))))
+
+    for key in ["x", "&"]:
+        suite.append(("taglist_get[{0}]".format(key),
+                      lambda key=key: (lambda names: db.select(expression(names)).get(key),
+                                       [(names,) for names in forest.sample(forest.tables, count)])))
+
+    suite += [("table_join", lambda: (lambda names: list(TagList([db.select(name) for name in names], "and", db=db).join()),
+                                      [(names,) for names in forest.sample(forest.tables, max(1, count // 10))])),
+              ("tablecell_get[dand]", lambda: (lambda cell: cell.get("dand"), cells())),
+              ("roots", lambda: (db.roots, [()] * max(1, count // 10))),
+              ("remove", lambda: (lambda tag: tag.remove(), removable()))]
+
+    return suite
+
+
+def measure(setup, repeat):
+    """
+    Returns statistics of the time per call in seconds over repeat runs.
+    """
+
+    times = []
+    calls = 0
+
+    for run in range(repeat):
+        operation, arguments = setup()
+        if not arguments:
+            continue
+
+        start = default_timer()
+        for args in arguments:
+            operation(*args)
+        times.append((default_timer() - start) / len(arguments))
+        calls += len(arguments)
+
+    if not times:
+        return None
+
+    times.sort()
+
+    return {"min": times[0],
+            "median": times[len(times) // 2],
+            "max": times[-1],
+            "calls": calls}
+
+
+def run_scale(name, shape, storage, seed, repeat, count):
+
+    directory = tempfile.mkdtemp(prefix="tinytags-benchmark-")
+
+    try:
+        if STORAGES[storage] is MemoryStorage:
+            db = TinyTagsDB(storage=MemoryStorage)
+        elif STORAGES[storage] is None:
+            db = TinyTagsDB(os.path.join(directory, "tags.json"))
+        else:
+            db = TinyTagsDB(os.path.join(directory, "tags." + storage), storage=STORAGES[storage])
+
+        start = default_timer()
+        forest = Forest(db, seed, **shape)
+        generated = default_timer() - start
+
+        results = {}
+        for benchmark, setup in benchmarks(forest, count):
+            result = measure(setup, repeat)
+            if result is not None:
+                results[benchmark] = result
+
+        db.close()
+
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    return {"shape": shape,
+            "tags": len(forest.tags),
+            "data": len(forest.data),
+            "cells": len(forest.cells),
+            "generate": generated,
+            "results": results}
+
+
+def run_parallel(workers, width, dims, saved, seed, repeat):
+    """
+    Times Table.cell_eids() over the join of dims tags of width children each,
+    with saved of its cells saved, without workers and on a pool of workers processes.
+    """
+
+    directory = tempfile.mkdtemp(prefix="tinytags-benchmark-")
+    rng = random.Random(seed)
+
+    try:
+        axes = [["p{0}/p{0}_{1}".format(dim, child) for child in range(width)] for dim in range(dims)]
+        source = os.path.join(directory, "tags.json")
+        with open(source, "w") as file:
+            json.dump({"tags": [{"name": "p{0}".format(dim), "tags": [{"name": path.split("/")[1]} for path in axis]}
+                                for dim, axis in enumerate(axes)],
+                       "cells": [[rng.choice(axis) for axis in axes] for cell in range(saved)]}, file)
+
+        db = TinyTagsDB(storage=MemoryStorage, workers=workers)
+        db.import_bulk(source)
+        table = Table(db.select(" and ".join("p{0}".format(dim) for dim in range(dims))), db=db)
+
+        times = {}
+        for mode in ["serial", "parallel"]:
+            db.workers = workers if mode == "parallel" else None
+
+            # The first call starts the pool.
+            eids = table.cell_eids()
+            runs = []
+            for run in range(repeat):
+                start = default_timer()
+                table.cell_eids()
+                runs.append(default_timer() - start)
+            times[mode] = min(runs)
+
+        db.close()
+
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    return {"workers": workers,
+            "rows": len(eids),
+            "saved": len([eid for eid in eids if eid]),
+            "serial": times["serial"],
+            "parallel": times["parallel"],
+            "speedup": times["serial"] / times["parallel"]}
+
+
+def compare(report, baseline, thresholds):
+    """
+    Returns a list of regressions, each (scale, benchmark, baseline median, median, change).
+    thresholds maps benchmark names to the allowed change, with None for the default.
+    """
+
+    regressions = []
+
+    for scale, current in sorted(report["scales"].items()):
+        before = baseline.get("scales", {}).get(scale)
+        if before is None:
+            continue
+
+        for benchmark, result in sorted(current["results"].items()):
+            old = before["results"].get(benchmark)
+            if old is None or old["median"] <= 0:
+                continue
+
+            change = result["median"] / old["median"] - 1
+            if change > thresholds.get(benchmark, thresholds[None]):
+                regressions.append((scale, benchmark, old["median"], result["median"], change))
+
+    return regressions
+
+
+def parse_thresholds(values):
+
+    thresholds = {None: 0.25}
+
+    for value in values or []:
+        if "=" in value:
+            benchmark, value = value.rsplit("=", 1)
+            thresholds[benchmark] = float(value)
+        else:
+            thresholds[None] = float(value)
+
+    return thresholds
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description="Benchmark tinytags on generated tag forests.")
+    parser.add_argument("--scales", nargs="+", default=["small", "medium"], choices=sorted(SCALES),
+                        help="large takes minutes with the default JSON storage")
+    parser.add_argument("--storage", default="json", choices=sorted(STORAGES))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=5, help="runs of each benchmark")
+    parser.add_argument("--count", type=int, default=50, help="calls per run")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    parser.add_argument("--baseline", help="JSON report to compare with")
+    parser.add_argument("--threshold", action="append",
+                        help="allowed slowdown as a fraction, 0.25 by default, or benchmark=fraction")
+    parser.add_argument("--workers", type=int,
+                        help="also time Table.cell_eids() of a wide join serially and on this many processes")
+    parser.add_argument("--width", type=int, default=60, help="children per tag of the join for --workers")
+
+    args = parser.parse_args(argv)
+    thresholds = parse_thresholds(args.threshold)
+
+    report = {"meta": {"python": platform.python_version(),
+                       "platform": platform.platform(),
+                       "storage": args.storage,
+                       "seed": args.seed,
+                       "repeat": args.repeat,
+                       "count": args.count,
+                       "time": time.strftime("%Y-%m-%dT%H:%M:%S")},
+              "scales": {}}
+
+    for scale in args.scales:
+        sys.stderr.write("{0}...\n".format(scale))
+        report["scales"][scale] = run_scale(scale, SCALES[scale], args.storage, args.seed, args.repeat, args.count)
+
+    if args.workers:
+        sys.stderr.write("parallel...\n")
+        report["parallel"] = run_parallel(args.workers, args.width, 3, 5000, args.seed, args.repeat)
+
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(text + "\n")
+    else:
+        print text
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(report, json.load(file), thresholds)
+
+        for scale, benchmark, old, new, change in regressions:
+            sys.stderr.write("REGRESSION {0} {1}: {2:.6f}s -> {3:.6f}s (+{4:.0%})\n".format(scale, benchmark, old, new, change))
+
+        if regressions:
+            return 1
+
+        sys.stderr.write("No regressions against {0}.\n".format(args.baseline))
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
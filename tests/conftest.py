@@ -0,0 +1,64 @@
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+from tinytags import Data, Table, Tag, TagList, TinyTagsDB
+
+
+@pytest.fixture(autouse=True)
+def close_databases():
+
+    # Objects made without db= need a single open database, so leave none behind.
+    yield
+    for db in list(TinyTagsDB.opened):
+        db.close()
+
+
+def write_randomly(db, steps, seed):
+    """
+    Makes steps random writes to db: new roots, tags and data, data added to
+    another tag, renames, removals of data and tags, and tablecells of two roots.
+    The same seed makes the same writes.
+    """
+
+    choose = random.Random(seed)
+
+    for step in range(steps):
+        name = "n{0}_{1}".format(seed, step)
+        tags = sorted(tag.eid for tag in db.TAGS.all())
+        data = sorted(element.eid for element in db.DATA.all())
+        action = choose.choice(["root", "tag", "tag", "data", "data", "link", "unlink", "rename", "remove", "cells"])
+
+        if not tags or action == "root":
+            db.insert_root(Tag(name, db=db))
+            continue
+
+        tag = Tag(eid=choose.choice(tags), db=db)
+        if action == "tag":
+            tag.insert(Tag(name, db=db))
+        elif action == "data":
+            tag.insert(Data(name, "x", "y", db=db))
+        elif action == "link" and data:
+            tag.insert(Data(eid=choose.choice(data), db=db))
+        elif action == "unlink" and data:
+            Data(eid=choose.choice(data), db=db).remove()
+        elif action == "rename":
+            tag.rename(name)
+        elif action == "remove" and choose.random() < 0.3:
+            tag.remove()
+        elif action == "cells":
+            roots = [Tag(eid=eid, db=db) for eid in tags]
+            roots = [root for root in roots if root.parenttype is None and root.taglist]
+            if len(roots) >= 2:
+                for cell in Table(TagList(choose.sample(roots, 2), "and", db=db), db=db).cells():
+                    cell.insert_cell()
+
+
+@pytest.fixture
+def random_writes():
+
+    return write_randomly
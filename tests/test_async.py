@@ -0,0 +1,37 @@
+import pytest
+
+import tinytags
+from tinytags import AsyncTinyTagsDB, Tag
+
+asyncio = tinytags.asyncio
+
+pytestmark = pytest.mark.skipif(asyncio is None or tinytags.ThreadPoolExecutor is None,
+                                reason="needs asyncio, or trollius and futures")
+
+
+def test_a_failing_write_fails_only_its_own_future(tmpdir):
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    db = AsyncTinyTagsDB(str(tmpdir.join("db.json")), loop=loop)
+
+    loop.run_until_complete(db.insert_root(Tag("root")))
+    root = loop.run_until_complete(db.select("root"))
+
+    # Queued together, so they are applied as one burst in one batch.
+    before = [db.insert(root, Tag("before{0}".format(i))) for i in range(5)]
+    bad = db.insert(root, "not a tag")
+    after = [db.insert(root, Tag("after{0}".format(i))) for i in range(5)]
+
+    outcomes = loop.run_until_complete(asyncio.gather(*(before + [bad] + after), return_exceptions=True))
+
+    assert isinstance(outcomes[5], Exception)
+    assert bad.exception() is outcomes[5]
+    assert not any(isinstance(outcome, Exception) for outcome in outcomes[:5] + outcomes[6:])
+
+    names = sorted(tag.name for tag in loop.run_until_complete(db.get(root)))
+    assert names == sorted(["before{0}".format(i) for i in range(5)] + ["after{0}".format(i) for i in range(5)])
+
+    loop.run_until_complete(db.close())
+    asyncio.set_event_loop(None)
+    loop.close()
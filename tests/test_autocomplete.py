@@ -0,0 +1,69 @@
+import pytest
+from tinydb.storages import MemoryStorage
+
+from tinytags import Data, Tag, TinyTagsDB
+
+
+@pytest.fixture
+def db():
+
+    db = TinyTagsDB(storage=MemoryStorage)
+    db.insert_root(Tag("Programming"))
+    db.select("Programming").insert(Tag("python"), Tag("perl"), Tag("php"), Tag("pascal"), Tag("web"))
+    db.select("python").insert(Data("d1", "x", "y"), Data("d2", "x", "y"))
+    yield db
+    db.close()
+
+
+def names(suggestions):
+
+    return [displayname.lstrip(".#") for displayname, children, eid in suggestions]
+
+
+def test_prefix(db):
+
+    assert names(db.autocomplete("p")) == ["pascal", "perl", "php", "Programming", "python"]
+    assert names(db.autocomplete("py", fuzzy=False)) == ["python"]
+    assert names(db.autocomplete("PR", fuzzy=False)) == ["Programming"]
+    assert names(db.autocomplete("xyz", fuzzy=False)) == []
+
+    # Prefix matches come before fuzzy ones.
+    assert names(db.autocomplete("py"))[0] == "python"
+
+    # Every tag whose name starts with the text, and nothing else.
+    for text in ["p", "pe", "ph", "w", "prog"]:
+        expected = sorted(tag["name"] for tag in db.TAGS.all() if tag["name"].lower().startswith(text))
+        assert sorted(names(db.autocomplete(text, limit=100, fuzzy=False))) == expected
+
+
+def test_entries(db):
+
+    suggestions = dict((eid, (displayname, children)) for displayname, children, eid in db.autocomplete("p"))
+    assert suggestions[db.select("python").eid] == ("#python", 2)
+    assert suggestions[db.select("Programming").eid] == (".Programming", 5)
+    assert suggestions[db.select("perl").eid] == ("perl", 0)
+
+
+def test_limit(db):
+
+    assert names(db.autocomplete("p", limit=2)) == ["pascal", "perl"]
+    assert len(db.autocomplete("p", limit=0)) == 0
+    assert len(db.autocomplete("", limit=3)) == 3
+
+    # Typos fill up what prefixes leave.
+    assert names(db.autocomplete("pyhton")) == ["python"]
+    assert names(db.autocomplete("pyhton", fuzzy=False)) == []
+    assert names(db.autocomplete("py", limit=1)) == ["python"]
+
+
+def test_follows_writes(db):
+
+    db.select("web").rename("pwa")
+    assert "pwa" in names(db.autocomplete("p"))
+    assert names(db.autocomplete("we", fuzzy=False)) == []
+
+    db.select("perl").remove()
+    assert "perl" not in names(db.autocomplete("p"))
+
+    db.select("Programming").insert(Tag("prolog"))
+    assert names(db.autocomplete("pro")) == ["Programming", "prolog"]
@@ -0,0 +1,93 @@
+import pytest
+from tinydb.storages import MemoryStorage
+
+from tinytags import Data, SQLiteStorage, Tag, TinyTagsDB
+
+
+@pytest.fixture(params=["memory", "json", "sqlite"])
+def db(request, tmpdir):
+
+    if request.param == "memory":
+        db = TinyTagsDB(storage=MemoryStorage)
+    elif request.param == "json":
+        db = TinyTagsDB(str(tmpdir.join("db.json")))
+    else:
+        db = TinyTagsDB(str(tmpdir.join("db.sqlite")), storage=SQLiteStorage)
+
+    db.insert_root(Tag("animals"))
+    yield db
+    db.close()
+
+
+def test_batch_counts_one_read_and_one_write(db):
+
+    with db.instrument() as stats:
+        with db.batch():
+            db.select("animals").insert(Tag("dog"), Tag("cat"))
+            db.select("dog").insert(Data("d1", "x", "y"))
+
+    # Opening the batch reads storage once and closing it writes once.
+    assert stats.counts[None] == {"read": 1, "write": 1}
+    if not isinstance(db._storage.storage, SQLiteStorage):
+        assert stats.total("read") == 1
+        assert stats.total("write") == 1
+
+
+def test_rollback_restores_storage_and_live_objects(db):
+
+    animals = db.select("animals")
+    animals.insert(Tag("cat"))
+
+    with pytest.raises(ValueError):
+        with db.batch():
+            animals.insert(Tag("dog"), Data("d1", "x", "y"))
+            db.select("cat").insert(Data("d2", "x", "y"))
+            raise ValueError()
+
+    assert len(animals.taglist) == 1
+    assert len(animals.datalist) == 0
+    assert db.select("animals") is animals
+    assert db.select("dog") is None
+    assert db.select("cat").datalist == []
+    assert len(db.TAGS) == 2
+    assert len(db.DATA) == 0
+
+
+def test_batch_copies_only_the_tables_it_uses():
+
+    db = TinyTagsDB(storage=MemoryStorage)
+    db.insert_root(Tag("animals"))
+    storage = db._storage.storage
+
+    with db.batch():
+        db.select("animals").insert(Tag("dog"))
+        assert db._storage.buffer.copied == set(["tags"])
+        assert db._storage.buffer["tags"] is not storage.memory["tags"]
+        assert len(storage.memory["tags"]) == 1
+
+    assert len(storage.memory["tags"]) == 2
+    db.close()
+
+
+def test_rollback_keeps_fields_staged_before_the_batch():
+
+    db = TinyTagsDB(storage=MemoryStorage, autosave=False)
+    db.insert_root(Tag("animals"))
+    db.select("animals").insert(Tag("cat"))
+    eid = db.select("animals").eid
+    assert db.TAGS._staged == {eid: {"tagtype": "taglist"}}
+
+    with pytest.raises(ValueError):
+        with db.batch():
+            db.select("cat").insert(Data("d1", "x", "y"))
+            raise ValueError()
+
+    # The staged tagtype of animals is kept, and that of cat is dropped.
+    assert db.TAGS._staged == {eid: {"tagtype": "taglist"}}
+    assert db.select("animals").tagtype == "taglist"
+    assert db.select("cat").tagtype is None
+
+    db.save()
+    assert db.TAGS._staged == {}
+    assert db.TAGS._read()[eid]["tagtype"] == "taglist"
+    db.close()
@@ -0,0 +1,57 @@
+import random
+
+from tinydb.storages import MemoryStorage
+
+from tinytags import Bitmap, TinyTagsDB
+
+
+def test_operations_match_sets():
+
+    choose = random.Random(7)
+
+    for attempt in range(200):
+        left = set(choose.sample(range(300), choose.randint(0, 40)))
+        right = set(choose.sample(range(300), choose.randint(0, 40)))
+        a, b = Bitmap.from_ids(left), Bitmap.from_ids(right)
+
+        assert list(a) == sorted(left)
+        assert len(a) == len(left)
+        assert all((id in a) == (id in left) for id in range(310))
+        assert Bitmap.decode(a.encode()) == a
+
+        assert list(a & b) == sorted(left & right)
+        assert list(a | b) == sorted(left | right)
+        assert list(a ^ b) == sorted(left ^ right)
+        assert list(a - b) == sorted(left - right)
+
+
+def test_members_match_documents_after_writes(random_writes):
+
+    db = TinyTagsDB(storage=MemoryStorage, bitmaps=True)
+    keys = db.TAGS.bitmaps
+
+    for seed in range(15):
+        random_writes(db, 20, seed)
+
+        # Cached bitmaps must have been dropped by the writes in between.
+        for tag in db.TAGS.all():
+            for key in keys:
+                assert db.TAGS.members(tag.eid, key) == Bitmap.from_ids(tag[key])
+                assert Bitmap.decode(tag["bitmaps"][key]) == Bitmap.from_ids(tag[key])
+
+
+def test_selects_match_sets(random_writes):
+
+    plain = TinyTagsDB(storage=MemoryStorage)
+    bitmaps = TinyTagsDB(storage=MemoryStorage, bitmaps=True)
+    for db in [plain, bitmaps]:
+        random_writes(db, 300, 1)
+
+    names = sorted(tag["name"] for tag in plain.TAGS.all())
+    choose = random.Random(2)
+
+    for attempt in range(100):
+        expression = " {0} ".format(choose.choice(["and", "or", "xor", "not"])).join(choose.sample(names, 2))
+        for key in ["x", "&"]:
+            assert sorted(element.eid for element in plain.select(expression).get(key)) == \
+                sorted(element.eid for element in bitmaps.select(expression).get(key)), (expression, key)
@@ -0,0 +1,56 @@
+import json
+
+import pytest
+from tinydb.storages import MemoryStorage
+
+from tinytags import TinyTagsDB
+
+
+def write_json(tmpdir):
+
+    source = tmpdir.join("tags.json")
+    source.write(json.dumps({"tags": [
+        {"name": "animals", "tags": [
+            {"name": "cat", "data": [{"name": "c1", "description": "", "location": "loc1"}]},
+            {"name": "dog", "data": [{"name": "c1", "description": "", "location": "loc1"}]}]}]}))
+    return str(source)
+
+
+def test_same_bookmark_in_two_folders_is_one_data(tmpdir):
+
+    db = TinyTagsDB(storage=MemoryStorage)
+    assert db.import_bulk(write_json(tmpdir))["data"] == 1
+    assert sorted(len(data["parents"]) for data in db.DATA.all()) == [2]
+    db.close()
+
+
+def test_reimport_matches_existing_data(tmpdir):
+
+    db = TinyTagsDB(storage=MemoryStorage)
+    source = write_json(tmpdir)
+    db.import_bulk(source)
+
+    assert db.import_bulk(source) == {"tags": 0, "data": 0, "tablecells": 0, "tables": 0}
+    assert len(db.DATA) == 1
+    assert len(db.select("cat").get("d")) == 1
+    assert len(db.select("dog").get("d")) == 1
+    db.close()
+
+
+def test_csv_rows_without_tags_are_skipped(tmpdir):
+
+    source = tmpdir.join("data.csv")
+    source.write("name,description,location,tags\n"
+                 "d1,first,loc1,animals/dog\n"
+                 "d2,second,loc2,\n"
+                 "d3,third,loc3, ; \n")
+
+    db = TinyTagsDB(storage=MemoryStorage)
+    with pytest.warns(UserWarning) as warned:
+        assert db.import_bulk(str(source))["data"] == 1
+
+    assert len(warned) == 2
+    assert "'d2'" in str(warned[0].message)
+    assert [data["name"] for data in db.DATA.all()] == ["d1"]
+    assert all(data["parents"] for data in db.DATA.all())
+    db.close()
@@ -0,0 +1,94 @@
+import pytest
+from tinydb.storages import MemoryStorage
+
+from tinytags import Data, SQLiteStorage, Table, Tag, TagList, TinyTagsDB
+
+
+def check(db):
+    """
+    Asserts that every id in every document points at a document that points back.
+    """
+
+    tags = dict((element.eid, element) for element in db.TAGS.all())
+    data = dict((element.eid, element) for element in db.DATA.all())
+    tables = dict((element.eid, element) for element in db.TABS.all())
+    cells = dict((element.eid, element) for element in db.CELLS.all())
+
+    for eid, tag in tags.items():
+        assert all(id in tags for id in tag["taglist"])
+        assert all(id in data and eid in data[id]["parents"] for id in tag["datalist"])
+        assert all(id in tables for id in tag["tables"])
+        assert all(id in cells for id in tag["tablecells"])
+        if tag["parenttype"] == "tag":
+            assert tag["parent"] in tags and eid in tags[tag["parent"]]["taglist"]
+        if tag["parenttype"] == "cell":
+            assert tag["parent"] in cells
+
+    for eid, document in data.items():
+        assert document["parents"]
+        assert all(id in tags and eid in tags[id]["datalist"] for id in document["parents"])
+
+    for eid, cell in cells.items():
+        assert all(id in tags and eid in tags[id]["tablecells"] for id in cell["complex"])
+
+    for eid, table in tables.items():
+        assert table["tablecells"]
+        assert all(id in cells for id in table["tablecells"])
+        assert all(id in tags for id in table["tags"])
+
+
+@pytest.fixture(params=["memory", "json", "sqlite"])
+def db(request, tmpdir):
+
+    if request.param == "memory":
+        db = TinyTagsDB(storage=MemoryStorage)
+    elif request.param == "json":
+        db = TinyTagsDB(str(tmpdir.join("db.json")))
+    else:
+        db = TinyTagsDB(str(tmpdir.join("db.sqlite")), storage=SQLiteStorage)
+
+    for root in ["animals", "actions", "places"]:
+        db.insert_root(Tag(root))
+    db.select("animals").insert(Tag("dog"), Tag("cat"))
+    db.select("actions").insert(Tag("run"), Tag("jump"))
+    db.select("places").insert(Tag("park"))
+    db.select("dog").insert(Tag("puppy"), Data("d1", "x", "y"), Data("d2", "x", "y"))
+    db.select("cat").insert(Data("d3", "x", "y"))
+    db.select("run").insert(Data(eid=db.select("dog").datalist[0], db=db))
+    db.select("park").insert(db.select("puppy"))
+
+    for pair in [("animals", "actions"), ("animals", "places")]:
+        for cell in Table(TagList([db.select(name) for name in pair], "and", db=db)).cells():
+            cell.insert_cell()
+
+    check(db)
+    yield db
+    db.close()
+
+
+def test_remove_tag_with_children_and_cells(db):
+
+    db.select("dog").remove()
+    check(db)
+    assert db.select("dog") is None
+
+    db.select("animals").remove()
+    check(db)
+    assert db.select("cat") is None
+    assert len(db.CELLS) == 0
+
+
+def test_remove_data_and_tables(db):
+
+    db.select("run").remove()
+    check(db)
+
+    for element in db.DATA.all():
+        Data(eid=element.eid, db=db).remove()
+        check(db)
+    assert len(db.DATA) == 0
+
+    for element in db.TABS.all():
+        Table(eid=element.eid, db=db).remove()
+        check(db)
+    assert len(db.TABS) == 0
@@ -0,0 +1,101 @@
+import random
+
+from tinydb.storages import MemoryStorage
+
+from tinytags import ClosureIndex, TinyTagsDB
+
+
+def brute_force(documents):
+    """
+    Returns the ancestors, descendants, alldata and dataancestors of tag
+    documents {eid: {"taglist": [...], "datalist": [...]}} by walking them.
+    """
+
+    descendants, alldata = {}, {}
+    for eid in documents:
+        seen, stack = set(), list(documents[eid]["taglist"])
+        while stack:
+            tag = stack.pop()
+            if tag not in seen:
+                seen.add(tag)
+                stack.extend(documents[tag]["taglist"])
+        descendants[eid] = seen
+        alldata[eid] = set(documents[eid]["datalist"]).union(*[documents[id]["datalist"] for id in seen])
+
+    ancestors = dict((eid, set(tag for tag in documents if eid in descendants[tag])) for eid in documents)
+
+    dataancestors = {}
+    for eid, ids in alldata.items():
+        for id in ids:
+            dataancestors.setdefault(id, set()).add(eid)
+
+    return ancestors, descendants, alldata, dataancestors
+
+
+def nonempty(index):
+
+    return dict((key, set(value)) for key, value in index.items() if value)
+
+
+def check(closure, documents):
+
+    expected = brute_force(documents)
+    found = (closure.ancestors, closure.descendants, closure.alldata, closure.dataancestors)
+
+    for name, index, want in zip(["ancestors", "descendants", "alldata", "dataancestors"], found, expected):
+        assert nonempty(index) == nonempty(want), name
+
+
+def test_random_dag():
+
+    choose = random.Random(3)
+    closure = ClosureIndex()
+    documents = {}
+
+    for step in range(600):
+        action = choose.choice(["add", "link", "link", "unlink", "data", "undata", "remove"])
+        eids = sorted(documents)
+
+        if action == "add" or len(eids) < 2:
+            eid = max(eids or [0]) + 1
+            documents[eid] = {"taglist": [], "datalist": []}
+        elif action == "remove":
+            eid = choose.choice(eids)
+            del documents[eid]
+            for document in documents.values():
+                if eid in document["taglist"]:
+                    document["taglist"].remove(eid)
+            closure.update(eid, None)
+            check(closure, documents)
+            continue
+        else:
+            # Links only go from lower to higher eids, so there are no cycles,
+            # but a tag can have several parents.
+            parent, child = sorted(choose.sample(eids, 2))
+            eid = parent
+            document = documents[parent]
+            if action == "link" and child not in document["taglist"]:
+                document["taglist"].append(child)
+            elif action == "unlink" and document["taglist"]:
+                document["taglist"].remove(choose.choice(document["taglist"]))
+            elif action == "data":
+                document["datalist"].append(1000 + step)
+            elif action == "undata" and document["datalist"]:
+                document["datalist"].remove(choose.choice(document["datalist"]))
+
+        closure.update(eid, documents[eid])
+        check(closure, documents)
+
+
+def test_database_after_random_writes(random_writes):
+
+    db = TinyTagsDB(storage=MemoryStorage)
+
+    for seed in range(15):
+        random_writes(db, 20, seed)
+        documents = dict((tag.eid, tag) for tag in db.TAGS.all())
+        check(db.CLOSURE, documents)
+
+    # Rebuilt from storage it is the same.
+    db.reload()
+    check(db.CLOSURE, dict((tag.eid, tag) for tag in db.TAGS.all()))
@@ -0,0 +1,65 @@
+import random
+
+from tinydb.storages import MemoryStorage
+
+from tinytags import ComboIndex, TinyTagsDB
+
+
+def brute_force(documents, key):
+    """
+    Returns {sorted tuple of ids: sorted eids} of documents {eid: document}.
+    """
+
+    combos = {}
+    for eid, document in sorted(documents.items()):
+        if document.get(key) is not None:
+            combos.setdefault(tuple(sorted(document[key])), []).append(eid)
+    return combos
+
+
+def check(index, documents):
+
+    expected = brute_force(documents, index.key)
+    assert index.combos == expected
+    assert index.eidcombos == dict((eid, combo) for combo, eids in expected.items() for eid in eids)
+
+    for combo, eids in expected.items():
+        assert index.get(list(reversed(combo))) == eids[0]
+
+
+def test_random_updates():
+
+    choose = random.Random(5)
+    index = ComboIndex("complex")
+    documents = {}
+
+    for step in range(800):
+        eid = choose.randint(1, 40)
+        if choose.random() < 0.2:
+            documents.pop(eid, None)
+            index.update(eid, None)
+        else:
+            # Few ids, so combinations are often shared and change order.
+            documents[eid] = {"complex": choose.sample(range(1, 7), choose.randint(0, 3))}
+            if choose.random() < 0.1:
+                documents[eid] = {"other": []}
+            index.update(eid, documents[eid])
+
+        check(index, documents)
+
+    assert index.get([99]) is None
+
+
+def test_database_after_random_writes(random_writes):
+
+    db = TinyTagsDB(storage=MemoryStorage)
+
+    for seed in range(15):
+        random_writes(db, 20, seed)
+        check(db.TABS.combos, dict((table.eid, table) for table in db.TABS.all()))
+        check(db.CELLS.combos, dict((cell.eid, cell) for cell in db.CELLS.all()))
+
+    db.reload()
+    check(db.TABS.combos, dict((table.eid, table) for table in db.TABS.all()))
+    check(db.CELLS.combos, dict((cell.eid, cell) for cell in db.CELLS.all()))
+    assert db.CELLS.combos.combos
@@ -0,0 +1,65 @@
+import gc
+
+import pytest
+from tinydb.storages import MemoryStorage
+
+from tinytags import Tag, TagList, TinyTagsDB
+
+
+def test_objects_without_db_use_the_only_open_database():
+
+    first = TinyTagsDB(storage=MemoryStorage)
+    first.insert_root(Tag("animals"))
+
+    assert TagList([], "and").TABLE is first
+    assert Tag(eid=1).TABLE is first
+
+
+def test_several_open_databases_need_db():
+
+    first = TinyTagsDB(storage=MemoryStorage)
+    second = TinyTagsDB(storage=MemoryStorage)
+    first.insert_root(Tag("animals"))
+    second.insert_root(Tag("places"))
+
+    with pytest.raises(LookupError):
+        TagList([], "and")
+    with pytest.raises(LookupError):
+        Tag(eid=1)
+
+    assert Tag(eid=1, db=second).name == "places"
+    assert TagList([], "and", db=first).TABLE is first
+
+    # Unsaved tags are bound when inserted.
+    tag = Tag("dog")
+    assert tag.TABLE is None
+    first.select("animals").insert(tag)
+    assert tag.TABLE is first
+
+    second.close()
+    assert TagList([], "and").TABLE is first
+    assert Tag(eid=1).name == "animals"
+
+
+def test_no_open_database():
+
+    TinyTagsDB(storage=MemoryStorage).close()
+
+    with pytest.raises(LookupError):
+        TagList([], "and")
+
+
+def test_dropped_databases_are_not_kept_open():
+
+    first = TinyTagsDB(storage=MemoryStorage)
+    first.insert_root(Tag("animals"))
+    dropped = TinyTagsDB(storage=MemoryStorage)
+    dropped.insert_root(Tag("places"))
+
+    # Dropped without close(), the database is freed and the other one used.
+    del dropped
+    assert Tag(eid=1).name == "animals"
+
+    del first
+    gc.collect()
+    assert len(TinyTagsDB.opened) == 0
@@ -0,0 +1,29 @@
+from tinydb.storages import MemoryStorage
+
+import tinytags
+from tinytags import Tag, TinyTagsDB
+
+
+def test_explain_compiles_once(monkeypatch):
+
+    db = TinyTagsDB(storage=MemoryStorage)
+    db.insert_root(Tag("animals"))
+    db.select("animals").insert(Tag("dog"), Tag("cat"))
+
+    compiled = []
+
+    class CountingPlan(tinytags.SelectPlan):
+        def __init__(self, expression):
+            compiled.append(expression)
+            super(CountingPlan, self).__init__(expression)
+
+    monkeypatch.setattr(tinytags, "SelectPlan", CountingPlan)
+
+    explain = db.explain("dog or cat")
+    assert compiled == ["dog or cat"]
+    assert explain.steps[0]["detail"].startswith("compiled ")
+
+    explain = db.explain("dog or cat")
+    assert compiled == ["dog or cat"]
+    assert explain.steps[0]["detail"].startswith("cached ")
+    db.close()
@@ -0,0 +1,36 @@
+from tinydb.storages import MemoryStorage
+
+from tinytags import Data, Tag, TinyTagsDB
+
+
+def test_objects_stay_live_and_fresh_after_writes():
+
+    db = TinyTagsDB(storage=MemoryStorage)
+    db.insert_root(Tag("a"))
+    a = db.select("a")
+
+    a.insert(Tag("b"))
+    b = db.select("b")
+    assert db.select("a") is a
+    assert list(a.taglist) == [b.eid]
+
+    b.insert(Data("d1", "x", "y"))
+    d1 = db.select("b").get("d")[0]
+    assert db.select("b") is b
+    assert list(b.datalist) == [d1.eid]
+
+    b.rename("c")
+    assert db.select("c") is b
+    assert db.select("a") is a
+    assert repr(b) == "#c"
+    assert [tag.name for tag in a.get()] == ["c"]
+
+    d1.remove()
+    assert db.select("c") is b
+    assert list(b.datalist) == []
+
+    b.remove()
+    assert db.select("a") is a
+    assert list(a.taglist) == []
+    assert (a.tagtype, a.hastags, repr(a)) == (None, False, "a")
+    assert db.select("c") is None
@@ -0,0 +1,73 @@
+import pickle
+from array import array
+
+import pytest
+
+from tinytags import IdList
+
+
+def check(ids, expected):
+
+    assert ids.tolist() == expected
+    for id in range(-2, 40):
+        assert (id in ids) == (id in expected), id
+
+
+@pytest.mark.parametrize("mutate, expected", [
+    (lambda ids: ids.append(0), [1, 3, 5, 0]),
+    (lambda ids: ids.append(9), [1, 3, 5, 9]),
+    (lambda ids: ids.extend([2, 4]), [1, 3, 5, 2, 4]),
+    (lambda ids: ids.insert(0, 7), [7, 1, 3, 5]),
+    (lambda ids: ids.remove(3), [1, 5]),
+    (lambda ids: ids.pop(0), [3, 5]),
+    (lambda ids: ids.reverse(), [5, 3, 1]),
+    (lambda ids: ids.fromlist([2, 0]), [1, 3, 5, 2, 0]),
+    (lambda ids: ids.fromstring(IdList([4, 2]).tostring()), [1, 3, 5, 4, 2]),
+    (lambda ids: ids.__setitem__(0, 8), [8, 3, 5]),
+    (lambda ids: ids.__delitem__(1), [1, 5]),
+    (lambda ids: ids.__setitem__(slice(0, 2), IdList([9, 2])), [9, 2, 5]),
+])
+def test_membership_after_mutation(mutate, expected):
+
+    ids = IdList([1, 3, 5])
+    assert 3 in ids
+    mutate(ids)
+    check(ids, expected)
+
+
+def test_slices_and_inplace_operators():
+
+    ids = IdList([1, 3, 5])
+    assert 5 in ids
+    ids[0:1] = IdList([6])
+    check(ids, [6, 3, 5])
+
+    del ids[0:2]
+    check(ids, [5])
+
+    ids += IdList([2])
+    assert isinstance(ids, IdList)
+    check(ids, [5, 2])
+
+    ids *= 2
+    assert isinstance(ids, IdList)
+    check(ids, [5, 2, 5, 2])
+
+
+def test_byteswap():
+
+    swapped = array("i", [1, 3])
+    swapped.byteswap()
+
+    ids = IdList([1, 3])
+    assert 1 in ids
+    ids.byteswap()
+    check(ids, swapped.tolist())
+
+
+def test_unsorted_and_pickled():
+
+    ids = IdList([9, 2, 7])
+    check(ids, [9, 2, 7])
+    check(pickle.loads(pickle.dumps(ids)), [9, 2, 7])
+    assert ids == [9, 2, 7] and ids != [9, 2]
@@ -0,0 +1,28 @@
+from tinydb import Query
+from tinydb.storages import MemoryStorage
+
+from tinytags import Tag, TinyTagsDB
+
+
+def test_scans_are_counted():
+
+    db = TinyTagsDB(storage=MemoryStorage)
+    db.insert_root(Tag("animals"))
+    db.select("animals").insert(Tag("dog"), Tag("cat"))
+    tag = Query()
+
+    with db.instrument() as stats:
+        assert len(db.TAGS.all()) == 3
+        assert db.TAGS.get(tag.name == "dog")["name"] == "dog"
+        assert [element["name"] for element in db.TAGS.search(tag.name == "cat")] == ["cat"]
+        assert db.TAGS.count(tag.name == "bird") == 0
+        assert db.TAGS.get(eid=1)["name"] == "animals"
+
+    # One scan each, and none for the read by eid.
+    assert stats.total("scan") == 4
+
+    with db.instrument() as stats:
+        db.TAGS.search(tag.name == "cat")
+
+    # Answered from the query cache.
+    assert stats.total("scan") == 0
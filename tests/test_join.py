@@ -0,0 +1,55 @@
+import pytest
+from tinydb.storages import MemoryStorage
+
+from tinytags import Join, Table, Tag, TagList, TinyTagsDB
+
+
+@pytest.fixture
+def db():
+
+    db = TinyTagsDB(storage=MemoryStorage)
+    db.insert_root(Tag("animals"))
+    db.insert_root(Tag("actions"))
+    db.select("animals").insert(Tag("dog"), Tag("cat"), Tag("bird"))
+    db.select("actions").insert(Tag("run"), Tag("jump"))
+    return db
+
+
+def names(cells):
+
+    return [cell.name for cell in cells]
+
+
+def test_join_is_lazy(db, monkeypatch):
+
+    made = []
+    cell = Table._cell
+    monkeypatch.setattr(Table, "_cell", lambda table, complex: made.append(complex) or cell(table, complex))
+
+    join = TagList([db.select("animals"), db.select("actions")], "and", db=db).join()
+    assert isinstance(join, Join)
+    assert made == []
+
+    assert len(join) == 6
+    assert made == []
+
+    join[4]
+    assert len(made) == 1
+
+
+def test_join_sequence(db):
+
+    table = Table(TagList([db.select("animals"), db.select("actions")], "and", db=db), db=db)
+    join = table.join()
+    cells = list(table.cells())
+
+    assert names(join) == names(cells)
+    assert [join[row].name for row in range(len(join))] == names(cells)
+    assert join[-1].name == cells[-1].name
+    assert names(join[1:4]) == names(cells[1:4])
+    assert names(join[::2]) == names(cells[::2])
+    assert names(table.get("&")) == names(cells)
+    assert join.name == table.name
+
+    with pytest.raises(IndexError):
+        join[6]
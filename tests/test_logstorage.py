@@ -0,0 +1,118 @@
+import json
+import os
+import time
+
+from tinytags import Data, LogStorage, Tag, TinyTagsDB
+
+
+def open_db(tmpdir, **kwargs):
+
+    return TinyTagsDB(str(tmpdir.join("db.json")), storage=LogStorage, **kwargs)
+
+
+def test_storage_options_are_passed_on(tmpdir):
+
+    db = open_db(tmpdir, compact_every=7, fsync=True, background=False)
+    storage = db._storage.storage
+    assert (storage.compact_every, storage.fsync, storage.background) == (7, True, False)
+    assert type(db.TAGS).__name__ == "DocumentTable"
+    db.close()
+
+
+def test_replay(tmpdir):
+
+    db = open_db(tmpdir)
+    db.insert_root(Tag("animals"))
+    db.select("animals").insert(Tag("dog"), Tag("cat"))
+    db.select("dog").insert(Data("d1", "x", "y"))
+    db.select("cat").rename("kitten")
+    db.close()
+
+    assert os.path.getsize(str(tmpdir.join("db.json.log"))) > 0
+
+    db = open_db(tmpdir)
+    assert sorted(tag.name for tag in db.select("animals").get()) == ["dog", "kitten"]
+    assert [data.name for data in db.select("dog").get("d")] == ["d1"]
+    db.close()
+
+
+def test_torn_last_record(tmpdir):
+
+    db = open_db(tmpdir)
+    db.insert_root(Tag("animals"))
+    db.select("animals").insert(Tag("dog"))
+    db.close()
+
+    logpath = str(tmpdir.join("db.json.log"))
+    with open(logpath, "a") as log:
+        log.write(json.dumps({"seq": 1000, "table": "tags", "eid": 1, "set": {"name": "torn"}})[:20])
+
+    db = open_db(tmpdir)
+    assert db.select("dog") is not None
+    assert db.select("torn") is None
+    db.select("animals").insert(Tag("cat"))
+    db.close()
+
+    db = open_db(tmpdir)
+    assert sorted(tag.name for tag in db.select("animals").get()) == ["cat", "dog"]
+    db.close()
+
+
+def test_repeated_compaction(tmpdir):
+
+    for background in [True, False]:
+        path = tmpdir.mkdir("background" if background else "foreground")
+        db = open_db(path, compact_every=5, background=background)
+        storage = db._storage.storage
+        compactions = []
+
+        compact = storage.compact
+
+        def counting():
+            compactions.append(storage.records)
+            compact()
+
+        storage.compact = counting
+
+        db.insert_root(Tag("animals"))
+        for number in range(30):
+            db.select("animals").insert(Tag("tag{0}".format(number)))
+            if storage.compacting is not None:
+                storage.compacting.join()
+
+        assert len(compactions) >= 3
+        db.close()
+
+        assert os.path.getsize(str(path.join("db.json.log"))) < 5 * 1024
+        db = open_db(path)
+        assert len(db.select("animals").taglist) == 30
+        db.close()
+
+
+def test_close_at_compaction_boundary(tmpdir):
+
+    db = open_db(tmpdir, compact_every=5)
+    storage = db._storage.storage
+    write_snapshot = storage._write_snapshot
+
+    def slow(snapshot, oldlog):
+        time.sleep(0.2)
+        write_snapshot(snapshot, oldlog)
+
+    storage._write_snapshot = slow
+
+    # The first compaction is still writing when the records reach the boundary
+    # again, so the next one starts in close().
+    db.insert_root(Tag("animals"))
+    for number in range(9):
+        db.select("animals").insert(Tag("tag{0}".format(number)))
+    assert storage.compacting.is_alive()
+    assert storage.records >= storage.compact_every
+    db.close()
+
+    assert not storage.compacting.is_alive()
+    assert not os.path.exists(str(tmpdir.join("db.json.log.old")))
+
+    db = open_db(tmpdir)
+    assert len(db.select("animals").taglist) == 9
+    db.close()
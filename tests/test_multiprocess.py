@@ -0,0 +1,94 @@
+import multiprocessing
+
+import pytest
+
+from tinytags import Data, SQLiteStorage, Tag, TinyTagsDB
+
+STORAGES = {"json": {}, "sqlite": {"storage": SQLiteStorage}}
+
+
+def work(args):
+
+    path, storage, number = args
+    db = TinyTagsDB(path, multiprocess=True, **STORAGES[storage])
+    for i in range(20):
+        root = db.select("root")
+        root.insert(Tag("p{0}_{1}".format(number, i)))
+        root.insert(Data("d{0}_{1}".format(number, i), "x", "y"))
+    db.close()
+
+
+@pytest.mark.parametrize("storage", sorted(STORAGES))
+def test_concurrent_processes_lose_no_ids(tmpdir, storage):
+
+    path = str(tmpdir.join("db." + storage))
+    db = TinyTagsDB(path, multiprocess=True, **STORAGES[storage])
+    db.insert_root(Tag("root"))
+    db.close()
+
+    pool = multiprocessing.Pool(4)
+    try:
+        pool.map(work, [(path, storage, number) for number in range(4)])
+    finally:
+        pool.close()
+        pool.join()
+
+    db = TinyTagsDB(path, multiprocess=True, **STORAGES[storage])
+    root = db.select("root")
+    tageids = [element.eid for element in db.TAGS.all()]
+    dataeids = [element.eid for element in db.DATA.all()]
+
+    assert len(tageids) == len(set(tageids)) == 81
+    assert len(dataeids) == len(set(dataeids)) == 80
+    assert sorted(root.taglist) == sorted(eid for eid in tageids if eid != root.eid)
+    assert sorted(root.datalist) == sorted(dataeids)
+    assert all(db.DATA.get(eid=eid)["parents"] == [root.eid] for eid in dataeids)
+    db.close()
+
+
+def test_threadsafe_reader_reloads_before_reading(tmpdir):
+
+    path = str(tmpdir.join("db.json"))
+    reader = TinyTagsDB(path, multiprocess=True, threadsafe=True)
+    reader.insert_root(Tag("root"))
+    assert reader.select("root").get() == []
+
+    # Another process, as far as the file lock can tell.
+    writer = TinyTagsDB(path, multiprocess=True)
+    writer.select("root").insert(Tag("child"))
+    writer.close()
+
+    # The reload is a write, so it must not happen under the read lock of select().
+    assert [tag.name for tag in reader.select("root").get()] == ["child"]
+    reader.close()
+
+
+def test_only_tables_written_by_another_process_are_reloaded(tmpdir):
+
+    path = str(tmpdir.join("db.json"))
+    reader = TinyTagsDB(path, multiprocess=True)
+    reader.insert_root(Tag("root"))
+    reader.select("root").insert(Data("d1", "x", "y"))
+    root = reader.select("root")
+
+    reloaded = []
+    for table in [reader.TAGS, reader.TABS, reader.CELLS, reader.DATA]:
+        table.reload = lambda table=table, reload=table.reload: reloaded.append(table.name) or reload()
+
+    writer = TinyTagsDB(path, multiprocess=True)
+    writer.DATA.update({"description": "changed"}, eids=[writer.select("root").datalist[0]])
+    writer.close()
+
+    assert [data.description for data in reader.select("root").get("d")] == ["changed"]
+    assert reloaded == ["data"]
+
+    # Live objects of the other tables are kept.
+    assert reader.select("root") is root
+
+    writer = TinyTagsDB(path, multiprocess=True)
+    writer.select("root").insert(Tag("child"))
+    writer.close()
+
+    assert [tag.name for tag in reader.select("root").get()] == ["child"]
+    assert reloaded == ["data", "tags"]
+    reader.close()
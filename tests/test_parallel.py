@@ -0,0 +1,33 @@
+import pytest
+
+import tinytags
+from tinytags import Table, Tag, TinyTagsDB
+
+pytestmark = pytest.mark.skipif(tinytags.ProcessPoolExecutor is None, reason="needs concurrent.futures")
+
+
+def test_cell_eids_match_serial_and_cells(tmpdir):
+
+    db = TinyTagsDB(str(tmpdir.join("db.json")), workers=3)
+    db.PARALLEL_ROWS = 1
+
+    with db.batch():
+        for root in "abc":
+            db.insert_root(Tag(root))
+            db.select(root).insert(*[Tag("{0}{1}".format(root, number)) for number in range(5)])
+
+    table = Table(db.select("a and b and c"), db=db)
+    for row in [0, 7, 33, 64, 99, 124]:
+        table.cell(row).insert_cell()
+
+    parallel = table.cell_eids()
+    expected = [getattr(cell, "eid", None) or 0 for cell in table.cells()]
+
+    db.workers = None
+    assert parallel.tolist() == table.cell_eids().tolist() == expected
+    assert len([eid for eid in expected if eid]) == 6
+
+    db.workers = 3
+    assert table.cell_eids(30, 70).tolist() == expected[30:70]
+    assert table.cell_eids(200).tolist() == []
+    db.close()
@@ -0,0 +1,84 @@
+import pytest
+from tinydb.storages import MemoryStorage
+
+from tinytags import Data, Tag, TextIndex, TinyTagsDB
+
+
+@pytest.fixture
+def db():
+
+    db = TinyTagsDB(storage=MemoryStorage)
+    db.insert_root(Tag("programming"))
+    db.select("programming").insert(Tag("python"), Tag("web"))
+    db.select("python").insert(Data("Python tutorial", "A python tutorial for python beginners", "http://a"),
+                               Data("Snake care", "Keeping a python snake", "http://b"))
+    db.select("web").insert(Data("Web tutorial", "HTML and CSS", "http://c"))
+    yield db
+    db.close()
+
+
+def names(results):
+
+    return [element.name for element, score in results]
+
+
+def rebuilt(table, fields):
+    """
+    Returns the postings of a TextIndex built from scratch over table.
+    """
+
+    index = TextIndex(fields)
+    for element in table.all():
+        index.update(element.eid, element)
+    return index.postings
+
+
+def test_ranking(db):
+
+    results = list(db.search("python tutorial"))
+    assert names(results) == ["Python tutorial", "Web tutorial", "Snake care"]
+
+    scores = [score for element, score in results]
+    assert scores == sorted(scores, reverse=True)
+    assert all(isinstance(element, Data) for element, score in results)
+
+    assert names(db.search("python tutorial", limit=2)) == ["Python tutorial", "Web tutorial"]
+    assert names(db.search("PYTHON")) == ["Python tutorial", "Snake care"]
+    assert list(db.search("cobol")) == []
+
+
+def test_within(db):
+
+    assert names(db.search("tutorial", within="web")) == ["Web tutorial"]
+    assert names(db.search("tutorial", within=db.select("python"))) == ["Python tutorial"]
+    assert names(db.search("tutorial", within="python or web")) == ["Python tutorial", "Web tutorial"]
+    assert names(db.search("tutorial", within="programming not web")) == ["Python tutorial"]
+    assert list(db.search("tutorial", within="nosuchtag")) == []
+
+
+def test_tags(db):
+
+    results = list(db.search("python", tags=True))
+    assert names(results) == ["python"]
+    assert isinstance(results[0][0], Tag)
+
+
+def test_index_follows_writes(db):
+
+    db.select("web").insert(Data("Django tutorial", "A python web framework", "http://d"))
+    assert "Django tutorial" in names(db.search("python"))
+    assert names(db.search("django")) == ["Django tutorial"]
+
+    [data for data in db.select("python").get("d") if data.name == "Snake care"][0].remove()
+    assert "Snake care" not in names(db.search("python"))
+    assert list(db.search("snake")) == []
+
+    db.select("web").rename("internet")
+    assert names(db.search("internet", tags=True)) == ["internet"]
+    assert list(db.search("web", tags=True)) == []
+
+    db.select("python").remove()
+    assert names(db.search("python")) == ["Django tutorial"]
+
+    assert db.DATA.text.postings == rebuilt(db.DATA, ["name", "description", "location"])
+    assert db.TAGS.text.postings == rebuilt(db.TAGS, ["name"])
@@ -0,0 +1,150 @@
+from itertools import permutations
+
+import pytest
+from tinydb.storages import MemoryStorage
+
+import tinytags
+from tinytags import Data, SelectPlan, Table, Tag, TagList, TinyTagsDB
+
+
+LEAVES = {"animals": ["dog", "cat"], "actions": ["run", "jump"], "places": ["park", "home"]}
+
+
+@pytest.fixture
+def db():
+
+    db = TinyTagsDB(storage=MemoryStorage)
+    for root, leaves in sorted(LEAVES.items()):
+        db.insert_root(Tag(root))
+        db.select(root).insert(*[Tag(leaf) for leaf in leaves])
+        for leaf in leaves:
+            db.select(leaf).insert(Data(leaf + "1", "x", "y"))
+
+    for pair in [("animals", "actions"), ("animals", "places"), ("actions", "places")]:
+        for cell in Table(TagList([db.select(name) for name in pair], "and", db=db)).cells():
+            cell.insert_cell()
+
+    yield db
+    db.close()
+
+
+def cells(db, expression):
+
+    return sorted(cell.eid for cell in db.select(expression).get("&"))
+
+
+def members(db, name):
+
+    return set(db.select(name).tablecells)
+
+
+def test_precedence(db):
+
+    dog, cat, run, park = [members(db, name) for name in ["dog", "cat", "run", "park"]]
+
+    # not binds tightest, then and, xor, or.
+    assert cells(db, "dog or cat and run") == sorted(dog | (cat & run))
+    assert cells(db, "cat and run or dog") == sorted((cat & run) | dog)
+    assert cells(db, "dog or cat not run") == sorted(dog | (cat - run))
+    assert cells(db, "dog and park xor run") == sorted((dog & park) ^ run)
+    assert cells(db, "dog xor run or park") == sorted((dog ^ run) | park)
+    assert cells(db, "dog and run not park or cat") == sorted((dog & (run - park)) | cat)
+
+    # Operators of one level group to the left.
+    assert cells(db, "dog or run not run") == sorted(dog | (run - run))
+    assert cells(db, "dog not run not park") == sorted((dog - run) - park)
+
+    assert SelectPlan("a or b and c").tree == ("or", ("tag", 0), ("and", ("tag", 1), ("tag", 2)))
+    assert SelectPlan("a and b not c").tree == ("and", ("tag", 0), ("not", ("tag", 1), ("tag", 2)))
+
+
+def test_parentheses(db):
+
+    dog, cat, run, park = [members(db, name) for name in ["dog", "cat", "run", "park"]]
+
+    assert cells(db, "(dog or cat) and run") == sorted((dog | cat) & run)
+    assert cells(db, "dog or (cat and run)") == sorted(dog | (cat & run))
+    assert cells(db, "(dog or cat) not (run or park)") == sorted((dog | cat) - (run | park))
+    assert cells(db, "((dog))") == cells(db, "dog or dog")
+    assert cells(db, "(dog xor run) and (cat or park)") == sorted((dog ^ run) & (cat | park))
+
+
+def test_tag_classes(db):
+
+    assert db.select(".animals").name == "animals"
+    assert db.select("#animals") is None
+    assert db.select("#dog").name == "dog"
+    assert db.select(".dog") is None
+
+    # A tag of the wrong class isn't found and matches nothing.
+    assert cells(db, "#dog and .run") == []
+    assert cells(db, "#dog or .run") == cells(db, "dog")
+
+
+def test_unknown_tags(db):
+
+    assert db.select("bird") is None
+    assert cells(db, "dog and bird") == []
+    assert cells(db, "dog or bird") == cells(db, "dog")
+    assert cells(db, "dog not bird") == cells(db, "dog")
+    assert cells(db, "bird or (dog and run)") == cells(db, "dog and run")
+    assert db.select("bird or fish").get("&") == []
+
+
+@pytest.mark.parametrize("expression", ["", "dog and", "and dog", "dog cat", "(dog or cat", "dog or cat)",
+                                        "()", "dog or $cat", "dog and or cat", "not dog"])
+def test_malformed_expressions(db, expression):
+
+    with pytest.raises(ValueError):
+        db.select(expression)
+
+
+def test_plan_cache(db, monkeypatch):
+
+    compiled = []
+
+    class CountingPlan(SelectPlan):
+        def __init__(self, expression):
+            compiled.append(expression)
+            super(CountingPlan, self).__init__(expression)
+
+    monkeypatch.setattr(tinytags, "SelectPlan", CountingPlan)
+
+    before = cells(db, "dog or cat")
+    plan = db.plans.get("dog or cat")
+    assert cells(db, "dog or cat") == before
+    assert compiled == ["dog or cat"]
+    assert db.plans.get("dog or cat") is plan
+
+    # Plans hold tag names, so a cached plan sees writes made after it was compiled.
+    db.select("cat").rename("kitten")
+    assert cells(db, "dog or cat") == cells(db, "dog")
+    assert cells(db, "dog or kitten") == before
+
+    db.select("animals").insert(Tag("cat"))
+    db.select("cat").insert(Data("c1", "x", "y"))
+    for cell in Table(TagList([db.select("animals"), db.select("places")], "and", db=db)).cells():
+        cell.insert_cell()
+    assert cells(db, "dog or cat") == sorted(members(db, "dog") | members(db, "cat"))
+    assert len(members(db, "cat")) == 2
+
+    db.select("dog").remove()
+    assert cells(db, "dog or cat") == sorted(members(db, "cat"))
+    assert compiled == ["dog or cat", "dog or kitten"]
+
+
+@pytest.mark.parametrize("op", ["and", "or", "xor", "not"])
+def test_same_as_select_logical(db, op):
+
+    names = ["dog", "run", "park", "animals", "actions"]
+
+    for count in [1, 2, 3]:
+        for tagnames in permutations(names, count):
+            expression = " {0} ".join(tagnames).format(op)
+            for key in ["x", "&"]:
+                selected = db.select(expression)
+                if count == 1:
+                    selected = TagList([selected], op, db=db)
+                baseline = db._select_logical(op, *tagnames)
+                assert sorted(element.eid for element in selected.get(key)) == \
+                    sorted(element.eid for element in baseline.get(key)), (expression, key)
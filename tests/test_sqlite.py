@@ -0,0 +1,48 @@
+import pytest
+
+from tinytags import Data, SQLiteStorage, Tag, TinyTagsDB
+
+
+def open_db(tmpdir):
+
+    return TinyTagsDB(str(tmpdir.join("db.sqlite")), storage=SQLiteStorage)
+
+
+def test_round_trip(tmpdir):
+
+    db = open_db(tmpdir)
+    db.insert_root(Tag("animals"))
+    db.select("animals").insert(Tag("dog"), Tag("cat"))
+    db.select("dog").insert(Data("d1", "a dog", "http://example.com/d1"))
+    db.select("cat").rename("kitten")
+    db.close()
+
+    db = open_db(tmpdir)
+    assert type(db.TAGS).__name__ == "DocumentTable"
+    assert sorted(tag.name for tag in db.select("animals").get()) == ["dog", "kitten"]
+
+    data = db.select("dog").get("d")
+    assert [(d.name, d.description, d.location) for d in data] == [("d1", "a dog", "http://example.com/d1")]
+    assert data[0].parents == [db.select("dog").eid]
+    db.close()
+
+
+def test_rollback(tmpdir):
+
+    db = open_db(tmpdir)
+    db.insert_root(Tag("animals"))
+
+    with pytest.raises(ValueError):
+        with db.batch():
+            db.select("animals").insert(Tag("dog"), Data("d1", "x", "y"))
+            raise ValueError()
+
+    assert db.select("dog") is None
+    assert db.select("animals").taglist == []
+    assert len(db.DATA) == 0
+    db.close()
+
+    db = open_db(tmpdir)
+    assert db.select("dog") is None
+    assert len(db.TAGS) == 1
+    db.close()
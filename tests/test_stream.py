@@ -0,0 +1,128 @@
+import io
+
+import pytest
+from tinydb.storages import MemoryStorage
+
+from tinytags import Data, SQLiteStorage, Table, Tag, TagList, TinyTagsDB
+
+
+def build(db):
+
+    for root in ["animals", "actions"]:
+        db.insert_root(Tag(root))
+    db.select("animals").insert(Tag("dog"), Tag("cat"))
+    db.select("actions").insert(Tag("run"), Tag("jump"))
+    db.select("dog").insert(Tag("puppy"), Data("d1", "first", "http://1"), Data("d2", "second", "http://2"))
+    db.select("run").insert(Data(eid=db.select("dog").datalist[0], db=db))
+
+    table = Table(TagList([db.select("animals"), db.select("actions")], "and", db=db), db=db)
+    for cell in table.cells():
+        cell.insert_cell()
+
+
+def graph(db):
+    """
+    Returns every element with its references as names instead of eids, which
+    import_stream() must keep whatever eids it gives.
+    """
+
+    tables = {"tags": db.TAGS, "data": db.DATA, "tablecells": db.CELLS, "tables": db.TABS}
+    names = dict((tablename, dict((element.eid, element["name"]) for element in table.all()))
+                 for tablename, table in tables.items())
+
+    def named(tablename, ids):
+        return sorted(names[tablename][id] for id in ids)
+
+    result = {}
+    for tag in db.TAGS.all():
+        parent = None
+        if tag["parent"] is not None:
+            parent = names["tags" if tag["parenttype"] == "tag" else "tablecells"][tag["parent"]]
+        result["tag", tag["name"]] = (named("tags", tag["taglist"]), named("data", tag["datalist"]),
+                                      named("tables", tag["tables"]), named("tablecells", tag["tablecells"]),
+                                      tag["tagtype"], tag["parenttype"], parent)
+    for data in db.DATA.all():
+        result["data", data["name"]] = (data["description"], data["location"], named("tags", data["parents"]))
+    for cell in db.CELLS.all():
+        result["cell", cell["name"]] = (named("tags", cell["complex"]), named("tags", cell["tags"]), cell["type"])
+    for table in db.TABS.all():
+        result["table", table["name"]] = (named("tags", table["tags"]), named("tablecells", table["tablecells"]))
+
+    return result
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def target(request, tmpdir):
+
+    if request.param == "memory":
+        db = TinyTagsDB(storage=MemoryStorage)
+    else:
+        db = TinyTagsDB(str(tmpdir.join("db.sqlite")), storage=SQLiteStorage)
+
+    yield db
+    db.close()
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_round_trip_into_fresh_db(target, compress):
+
+    source = TinyTagsDB(storage=MemoryStorage)
+    build(source)
+
+    stream = io.BytesIO()
+    counts = source.export_stream(stream, compress=compress)
+    assert counts == {"tags": 7, "data": 2, "tablecells": 4, "tables": 1}
+
+    stream.seek(0)
+    assert target.import_stream(stream, compress=compress) == counts
+    assert graph(target) == graph(source)
+
+    # The imported graph works through the API too.
+    assert sorted(tag.name for tag in target.select("animals").get()) == ["cat", "dog"]
+    assert [data.name for data in target.select("run").get("d")] == ["d1"]
+    assert sorted(cell.name for cell in target.select("animals and actions").get("x")[0].cells()) == \
+        sorted(cell.name for cell in source.select("animals and actions").get("x")[0].cells())
+    source.close()
+
+
+def test_remapped_import_adds_to_existing(target):
+
+    target.insert_root(Tag("places"))
+    target.select("places").insert(Tag("park"), Data("p1", "x", "y"))
+    before = graph(target)
+    last = dict((tablename, table._last_id) for tablename, table in
+                [("tags", target.TAGS), ("data", target.DATA), ("tablecells", target.CELLS), ("tables", target.TABS)])
+
+    source = TinyTagsDB(storage=MemoryStorage)
+    build(source)
+    exported = graph(source)
+    lines = list(source.export_stream())
+    source.close()
+
+    target.import_stream(lines)
+
+    # Existing elements are untouched and the imported ones get eids past them.
+    expected = dict(before)
+    expected.update(exported)
+    assert graph(target) == expected
+    assert min(tag.eid for tag in target.TAGS.all() if ("tag", tag["name"]) in exported) == last["tags"] + 1
+    assert min(data.eid for data in target.DATA.all() if data["name"] in ["d1", "d2"]) == last["data"] + 1
+
+
+def test_import_without_remap_keeps_eids(target):
+
+    source = TinyTagsDB(storage=MemoryStorage)
+    build(source)
+    lines = list(source.export_stream())
+
+    target.import_stream(lines, remap=False)
+    assert graph(target) == graph(source)
+    assert sorted((tag.eid, tag["name"]) for tag in target.TAGS.all()) == \
+        sorted((tag.eid, tag["name"]) for tag in source.TAGS.all())
+    source.close()
+
+
+def test_rejects_other_streams(target):
+
+    with pytest.raises(ValueError):
+        target.import_stream(['{"format": "other", "version": 1}\n'])
@@ -0,0 +1,85 @@
+import threading
+
+import pytest
+
+from tinytags import LogStorage, ReadWriteLock, SQLiteStorage, Tag, TinyTagsDB
+
+STORAGES = {"json": {}, "sqlite": {"storage": SQLiteStorage}, "log": {"storage": LogStorage}}
+
+
+@pytest.mark.parametrize("storage", sorted(STORAGES))
+def test_concurrent_inserts_lose_no_ids(tmpdir, storage):
+
+    db = TinyTagsDB(str(tmpdir.join("db." + storage)), threadsafe=True, **STORAGES[storage])
+    db.insert_root(Tag("root"))
+    root = db.select("root")
+    errors = []
+
+    def writer(number):
+        try:
+            for i in range(15):
+                root.insert(Tag("t{0}_{1}".format(number, i)))
+        except Exception as error:
+            errors.append(error)
+
+    def reader():
+        try:
+            for i in range(30):
+                tags = db.select("root").get()
+                assert len(tags) == len(set(tag.eid for tag in tags))
+        except Exception as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=writer, args=(number,)) for number in range(4)]
+    threads += [threading.Thread(target=reader) for number in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+
+    eids = [element.eid for element in db.TAGS.all()]
+    assert len(eids) == len(set(eids)) == 61
+    assert sorted(db.TAGS.get(eid=root.eid)["taglist"]) == sorted(eid for eid in eids if eid != root.eid)
+    assert len(root.get()) == 60
+    db.close()
+
+
+def test_read_lock_does_not_upgrade():
+
+    lock = ReadWriteLock()
+
+    with lock.read():
+        with pytest.raises(RuntimeError):
+            lock.acquire_write()
+
+    # The writing thread may still read, and the lock is free afterwards.
+    with lock.write():
+        with lock.read():
+            pass
+    assert (lock.readers, lock.writer, lock.waiting) == (0, None, 0)
+
+
+def test_loading_a_stale_tagtype_does_not_write(tmpdir):
+
+    db = TinyTagsDB(str(tmpdir.join("db.json")), threadsafe=True)
+    db.insert_root(Tag("root"))
+    db.select("root").insert(Tag("child"))
+
+    # A tagtype left stale in storage, as by an older version.
+    eid = db.select("root").eid
+    db.TAGS.update({"tagtype": "datalist"}, eids=[eid])
+    db.ELEMENTS.clear()
+
+    # Selecting runs under the read lock, so it may not write the fix.
+    with db.instrument() as stats:
+        root = db.select("root")
+    assert root.tagtype == "taglist"
+    assert stats.total("write") == 0
+    assert db.TAGS.get(eid=eid)["tagtype"] == "datalist"
+
+    # The next write to the tag stores it.
+    root.insert(Tag("other"))
+    assert db.TAGS.get(eid=eid)["tagtype"] == "taglist"
+    db.close()
@@ -16,991 +16,5437 @@
 
 # Dreamt up in the summer of 2017
 
+import os
 import re
-from tinydb import TinyDB, Query
+import math
+import heapq
+import csv
+import gc
+import gzip
+import json
+import zlib
+import base64
+import binascii
+import sqlite3
+import threading
+import warnings
+import weakref
+from array import array
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from contextlib import contextmanager
+from copy import deepcopy
+from functools import wraps
+from itertools import product
+from timeit import default_timer
+from tinydb import TinyDB, database
+from tinydb.middlewares import Middleware
+from tinydb.storages import Storage
+
+try:
+    from HTMLParser import HTMLParser
+except ImportError:
+    from html.parser import HTMLParser
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# AsyncTinyTagsDB uses asyncio, or trollius and futures on Python 2.
+try:
+    import asyncio
+except ImportError:
+    try:
+        import trollius as asyncio
+    except ImportError:
+        asyncio = None
+
+try:
+    from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+except ImportError:
+    ThreadPoolExecutor = ProcessPoolExecutor = None
+
+
+class ConflictError(RuntimeError):
+    """
+    Raised when an element changed since it was read, as seen by its version.
+    """
 
-class TinyTagsDB(TinyDB):
-    def __init__(self, database):
-        super(TinyTagsDB, self).__init__(database)
-        
-        TinyTagsDB.TAGS = self.table("tags")
-        TinyTagsDB.TABS = self.table("tables")
-        TinyTagsDB.CELLS = self.table("tablecells")
-        TinyTagsDB.DATA = self.table("data")
-        TinyTagsDB.TABLE = self
-        
-    def select(self, string):
-        """
-        Input:
-        String can be a db.select("tagname"), db.select(".tagname"), or db.select("#tagname")
-        We can combine tags to create tag lists by using db.select(".tagname and .tagname")
-        Logical operaters to combine tags are and, or, xor, not.
-        
-        Output:
-        Either Tag() or TagList()
-        """
-        
-        reg = re.match("([\.\#\&]?)(\w+)\s*(and|or|xor|not)?\s*([\.\#\&]?)(\w*)", string)
 
-        logicalop = None
+def committed(method):
+    """
+    Runs a table write holding the commit lock of its database, if it has one.
+    """
 
-        if reg.group(3) != None:
+    @wraps(method)
+    def locked(self, *args, **kwargs):
 
-            regsplit = re.split("\s+(and|or|xor|not)\s+", string)
-            logicalops = regsplit[1:][::2]
-            
-            if all(x == logicalops[0] for x in logicalops):
-                logicalop = logicalops[0]
-                
-            names = regsplit[0:][::2]
-            
-        # return Tag or TagList    
-        if len(reg.group(1)) == 1 or reg.group(1) == "" and reg.group(3) == None:
-            return self._select_single(reg.group(1), reg.group(2))
+        if self.committing is None:
+            return method(self, *args, **kwargs)
 
-        elif logicalop != None:
-            return self._select_logical(logicalop, *names)
-        
-    def select_data(self, dataname):
-        
-        dataeid = self.TABLE.DATA.get(Query().name == dataname).eid
-        return Data(eid=dataeid)
-          
-    def _select_single(self, tagclass=None, tagname=None):
-        """
-        Input: _select_single(tagname="tagname")
-        Output: Tag() matches a mix of categories and data.
+        with self.committing():
+            return method(self, *args, **kwargs)
 
-        Input: _select_single(".", "tagname")
-        Output: Tag() that only matches a categorytype.
+    return locked
 
-        Input: _select_single("#", "tagname")
-        Output: Tag() that only matches a datatype.
 
-        Input: _select_single("&", "tagname")
-        Output: TableCell()
-        """
-        
-        if tagclass == None or tagclass == "":
-            tagtype = None
-        elif tagclass == ".":
-            tagtype = "taglist"
-        elif tagclass == "#":
-            tagtype = "datalist"
-        elif tagclass == "&":
-            tagtype = "cell"
+class Untimed(object):
+    """
+    A context manager that does nothing, used while nobody listens to Instruments.
+    """
 
-        if tagtype != "cell":
-            tag = self.TABLE.TAGS.get(Query().name == tagname)
-            return Tag(eid=tag.eid) if tag['tagtype'] == tagtype or tagtype == None and tag != None else None
-        
-        else:
-            tablecell = self.TABLE.CELLS.get(Query().name == name)
-            return TableCell(eid=tablecell.eid)
+    def __enter__(self):
 
-    def _select_logical(self, logicalop, *tagnames):
+        return self
+
+    def __exit__(self, *exc):
+
+        return False
+
+
+UNTIMED = Untimed()
+
+
+class Instruments(object):
+    """
+    Counts and times what a TinyTagsDB does, by the public call it happens in,
+    like "TinyTagsDB.select" or "Tag.get". Events are:
+
+        call        a public call, timed from start to end
+        read        a storage read, of the whole database or of one document
+        write       a storage write
+        scan        a full table scan by TagsTable.all(), search(), count() or get(cond)
+        rehydrate   a Tag, Data, Table or TableCell loaded from its document
+        hit         one found in the identity map instead
+
+    Listen with db.instrument(), which collects Stats for a block, or db.add_hook(hook),
+    which calls hook(call, event, seconds) for every event. Calls nested in
+    another count towards the outer one. Nothing is timed while nobody listens.
+    """
+
+    def __init__(self):
+
+        self.hooks = []
+        self.collectors = []
+
+        # Stack of public calls of each thread
+        self.local = threading.local()
+
+    @property
+    def active(self):
+
+        return bool(self.hooks or self.collectors)
+
+    def call(self, element, name):
         """
-        Input: 
-        _select_logical(logicalop, "nameoftag1", "nameoftag2", ...)
-        
-        Input takes four strings.
-        tagclass can be "", ".", "#"
-        logicalop can be "and", "or", "xor", "not"
-        
-        Output: TagList()
+        Returns a context manager for the public call name of element.
         """
-        if logicalop in ["and", "or", "xor", "not"]:
-            taglist = TagList([], logicalop)
 
-            for tag in tagnames:
-                reg = re.match("([\.\#\&]?)(\w+)", tag)
-                gottag = _select_single(reg.group(2), tagclass=reg.group(1))
-                taglist.append(gottag)
+        if not self.active:
+            return UNTIMED
 
-                return taglist
+        return self._call("{0}.{1}".format(type(element).__name__, name))
 
-    def insert_root(self, element):
-        
-        if isinstance(element, Tag):
-            tab = self.TABLE.TAGS
-            
-        elif isinstance(element, TableCell):
-            tab = self.TABLE.CELLS
-            
-        eid = tab.insert(element.__serialize__())
-        
-        element.eid = eid
-       
-    def roots(self):
+    @contextmanager
+    def _call(self, name):
+
+        calls = self.local.__dict__.setdefault("calls", [])
+        calls.append(name)
+
+        start = default_timer()
+        try:
+            yield
+        finally:
+            if len(calls) == 1:
+                self.record("call", default_timer() - start)
+            calls.pop()
+
+    def timed(self, event):
         """
-        Returns all root categories.
+        Returns a context manager that records event with the time its block takes.
         """
 
-        return [Tag(eid=tag.eid) for tag in self.TABLE.TAGS.all() if tag['parenttype'] == None]
+        if not self.active:
+            return UNTIMED
 
-    def show_roots(self):
+        return self._timed(event)
 
-        for root in self.roots():
-            print "{}".format(root)
+    @contextmanager
+    def _timed(self, event):
 
-    def save(self):
-        pass
+        start = default_timer()
+        try:
+            yield
+        finally:
+            self.record(event, default_timer() - start)
 
+    def record(self, event, seconds=0.0):
 
-class NamedComplex(object):
+        if not self.active:
+            return
+
+        calls = getattr(self.local, "calls", None)
+        call = calls[0] if calls else None
+
+        for collector in list(self.collectors):
+            collector.add(call, event, seconds)
+
+        for hook in list(self.hooks):
+            hook(call, event, seconds)
+
+
+class Stats(object):
     """
-    A NamedComplex is made up of a name and a Complex.
+    Counts and seconds of Instruments events, by public call. Events outside any
+    public call are under None.
     """
-    
-    def __init__(self, name=None, complex=None):
-        
-        NamedComplex.TABLE = TinyTagsDB
-        
-        self.name = name
-        self.complex = [] if complex == None else complex
-        self.parent = False
-        self.type = None
 
-    def search(self, filter):
-        
-        for element in self.complex.elementlist:
-            if isinstance(element, NamedComplex):
-                if filter in element.name:
-                    print element.name
-                element.search(filter)
-            else:
-                if filter in element:
-                    print element
-
-    def rename(self, name):
-        
-        self.name = name
-        
-        if self.eid is not None:
-            
-            if isinstance(self, Tag):
-                table = self.TABLE.TAGS
-                
-            elif isinstance(self, TableCell):
-                table = self.TABLE.CELLS
-                    
-            table.update({"name": self.name}, eids=[self.eid])
+    def __init__(self):
 
+        self.counts = {}
+        self.times = {}
+        self._guard = threading.Lock()
 
-class Id(object):
+    def add(self, call, event, seconds):
 
-    TABLE = TinyTagsDB
+        with self._guard:
+            counts = self.counts.setdefault(call, {})
+            counts[event] = counts.get(event, 0) + 1
+            times = self.times.setdefault(call, {})
+            times[event] = times.get(event, 0.0) + seconds
 
-    def __init__(self, namedcomplex=None):
+    def total(self, event):
+        """
+        Returns the number of event over all calls.
+        """
 
-        self.namedcomplex = namedcomplex
-        self.eid = namedcomplex.eid
+        return sum(counts.get(event, 0) for counts in self.counts.values())
 
-    def show(self):
+    def report(self):
         """
-        Return a numbered list of hashtags, categories, complex categories, and tables.
+        Returns {call: {event: {"count": n, "seconds": s}}}.
         """
 
-        for key, value in self.namedcomplex.items():
-            print "{0}: {1}".format(key, value)
-        print "\r"
+        return dict((call, dict((event, {"count": count, "seconds": self.times[call][event]})
+                                for event, count in counts.items()))
+                    for call, counts in self.counts.items())
 
-    def update_type(self, type, table, eid):
-        
-        if eid == None:
-            return None
+    def show(self):
 
-        table.update({"tagtype": type}, eids=[eid])
+        for call in sorted(self.counts, key=str):
+            calls = self.counts[call].get("call", 0)
+            print "{0}: {1} calls".format(call, calls)
+            for event in ["read", "write", "scan", "rehydrate", "hit"]:
+                if event in self.counts[call]:
+                    count = self.counts[call][event]
+                    print " "*4 + "{0}: {1} ({2:.1f} per call, {3:.6f}s)".format(
+                        event, count, float(count) / max(calls, 1), self.times[call][event])
 
-        self.sync()
 
-    def update_tag_parent(self, type, upeid, table, eid):
+class TagsTable(database.Table):
+    """
+    A tinydb Table that keeps a name index of its elements.
 
-        if eid == None:
-            return None
+    Every write goes through insert, insert_multiple or process_elements,
+    so the index stays current with insert_root, Tag.insert, rename and remove.
+    """
 
-        table.update({"parenttype": type}, eids=[eid])
-        
-        table.update({"parent": upeid}, eids=[eid])
+    def __init__(self, storage, name, cache_size=10):
 
-        self.sync()
+        # Instruments of the owning TinyTagsDB
+        self.instruments = Instruments()
 
-    def update_id(self, upeid, table, eid, key, sync=None):
+        super(TagsTable, self).__init__(storage, name, cache_size)
+
+        # Identity map of the owning TinyTagsDB, refreshed on writes.
+        self.elements = None
+
+        # eid -> fields staged while autosave is off, written by flush()
+        self.autosave = True
+
+        # Id list keys kept as a compressed Bitmap in each element's "bitmaps" field.
+        self.bitmaps = []
+        self._bitmaps = ElementCache(10000)
+
+        # Other indexes fed every written element through update(eid, element).
+        self.indexes = []
+
+        # With versions, every write bumps the element's version field, and
+        # committing is the context manager that writes run in.
+        self.versions = False
+        self.committing = None
+
+        # Set by every write, so a multiprocess database can tell which tables it changed.
+        self.changed = False
+
+        self.reload()
+
+    def reload(self):
         """
-        Inserts upeid into table -> eid -> key, and then syncs the element.
+        Rebuilds the last eid and the name index from storage and drops staged fields.
         """
 
-        if upeid == None:
-            return None
+        # name -> sorted list of eids, and eid -> name
+        self._names = {}
+        self._eidnames = {}
+        self._staged = {}
 
-        e = table.get(eid=eid)[key]
-        if upeid not in e:
-            e.append(upeid)
-            table.update({key: e}, eids=[eid])
+        for index in self.indexes:
+            index.clear()
 
-            if sync is not None: sync.sync()
+        data = self._read()
+        for eid in sorted(data):
+            self._reindex(eid, data[eid])
 
-    def remove_id(self, upeid, table, eid, key, sync=None):
+        self._last_id = max(data) if data else 0
+        self._bitmaps.clear()
+        self.clear_cache()
+
+    def _derive(self, element):
         """
-        Deletes element from selected category in database.
+        Sets the bitmaps field of element from its id lists, and bumps its version.
         """
-        e = table.get(eid=eid)[key]
-        if upeid in e:
-            e.remove(upeid)
-            table.update({key: e}, eids=[eid])
-            
-            if sync is not None: sync.sync()
 
-            
-class Tag(NamedComplex, Id):
-    
-    def __init__(self, name=None, taglist=None, datalist=None, eid=None):
+        if self.versions and element is not None:
+            element['version'] = element.get('version', 0) + 1
 
-        if eid != None:
-            namedcomplex = self.TABLE.TAGS.get(eid=eid)
+        if self.bitmaps and element is not None:
+            element['bitmaps'] = dict((key, Bitmap.from_ids(element[key]).encode())
+                                      for key in self.bitmaps if key in element)
 
-            NamedComplex.__init__(self, namedcomplex['name'])
-            Id.__init__(self, namedcomplex)
+    def members(self, eid, key, ids=None):
+        """
+        Returns the ids in the list key of element eid, as a Bitmap if this table
+        keeps bitmaps and as a set otherwise. ids is the list if the caller has it.
+        """
 
-            self.taglist = namedcomplex['taglist']
-            self.datalist = namedcomplex['datalist']
-            self.tables = namedcomplex['tables']
-            self.tablecells = namedcomplex['tablecells']
-            self.parent = namedcomplex['parent']
-            self.parenttype = namedcomplex['parenttype']
-            self.eid = namedcomplex.eid
+        if key not in self.bitmaps:
+            return set(ids if ids is not None else self.get(eid=eid)[key])
 
-            self.__update_type__()
+        bitmap = self._bitmaps.get((eid, key))
 
-            
-        else:
-            NamedComplex.__init__(self, name)
-            
-            self.taglist = taglist if taglist != None else []
-            self.datalist = datalist if datalist != None else []
-            self.tables = []
-            self.tablecells = []
-            self.parent = None 
-            self.parenttype = None
-            self.eid = None
+        if bitmap is None:
+            if ids is not None:
+                bitmap = Bitmap.from_ids(ids)
+            else:
+                element = self.get(eid=eid)
+                encoded = element.get('bitmaps', {}).get(key)
+                bitmap = Bitmap.decode(encoded) if encoded is not None else Bitmap.from_ids(element[key])
+            self._bitmaps.put((eid, key), bitmap)
 
-            self.__update_type__()
-            
-    def __repr__(self):
+        return bitmap
 
-        return self.displayname
+    def add_index(self, index):
+        """
+        Adds an index with clear() and update(eid, element) methods and fills it.
+        """
 
-    def __update_type__(self):
+        self.indexes.append(index)
 
-        if self.taglist != [] and self.datalist != []:
-            self.tagtype = None
-            self.hastags = True
-            self.displayname = "{0}".format(self.name)
-            
-        elif self.taglist != []:
-            self.tagtype = "taglist"
-            self.hastags = True
-            self.displayname = ".{0}".format(self.name)
-        
-        elif self.datalist != []:
-            self.tagtype = "datalist"
-            self.hastags = False
-            self.displayname = "#{0}".format(self.name)
+        data = self._read()
+        for eid in sorted(data):
+            index.update(eid, data[eid])
 
-        else:
-            self.tagtype = None
-            self.hastags = False
-            self.displayname = "{0}".format(self.name)
-            
-        self.update_type(self.tagtype, self.TABLE.TAGS, self.eid)
-        
-    def __serialize__(self):
+    def _reindex(self, eid, element):
+        """
+        Moves eid to the index entry for element's name, or drops it if element is None.
+        """
 
-        self.dict = {'name': self.name,
-                    'taglist': self.taglist,
-                    'datalist': self.datalist,
-                    'tables': self.tables,
-                    'tablecells': self.tablecells,
-                    'tagtype': self.tagtype,
-                    'parent': self.parent,
-                    'parenttype': self.parenttype}
+        for index in self.indexes:
+            index.update(eid, element)
 
-        return self.dict
+        if eid in self._eidnames:
+            name = self._eidnames.pop(eid)
+            self._names[name].remove(eid)
+            if self._names[name] == []:
+                del self._names[name]
 
-    def sync(self):
+        if element is not None:
+            name = element.get('name')
+            self._eidnames[eid] = name
+            insort(self._names.setdefault(name, []), eid)
 
-        self.namedcomplex = self.TABLE.TAGS.get(eid=self.eid)
+    def _written(self, eid, element):
+        """
+        Updates indexes and caches after element eid was written, or removed if element is None.
+        """
 
-        self.name = self.namedcomplex['name']
-        self.taglist = self.namedcomplex['taglist']
-        self.datalist = self.namedcomplex['datalist']
-        self.tables = self.namedcomplex['tables']
-        self.tablecells = self.namedcomplex['tablecells']
-        self.tagtype = self.namedcomplex['tagtype']
-        self.parent = self.namedcomplex['parent']
-        self.parenttype = self.namedcomplex['parenttype']
-        
-    def show(self):
-        
-        print self.displayname
-        
-        try:
-            for tag in self.get("^"):
-                print " "*4 + "Parent: {0}".format(str(tag))
-        except:
-            pass
-        
-        for cell in self.get("&"):
-            cell.show(tabs=1)
+        self._reindex(eid, element)
+        self.changed = True
 
-        for tag in self.get():
-            if tag.get("^").eid not in [cell.eid for cell in self.get("&")]:
-                print " "*4 + "{}".format(tag)
+        for key in self.bitmaps:
+            self._bitmaps.evict((eid, key))
 
-    def get(self, key=None):
+        if element is None:
+            self._staged.pop(eid, None)
+
+        if self.elements is None:
+            return
+
+        if element is None:
+            self.elements.evict((self.name, eid))
+            return
+
+        # Live objects keep their identity and are refreshed from what was written.
+        cached = self.elements.get((self.name, eid))
+        if cached is not None:
+            document = database.Element(((key, list(value) if isinstance(value, list) else value)
+                                         for key, value in element.items()), eid)
+            document.update(self._staged.get(eid, {}))
+            cached.sync(document)
+            self.elements.touch((self.name, eid), cached)
+
+    def _overlay(self, element):
         """
-        Returns a list of tags, data, tables, or tablecells.
+        Applies staged fields to an element read from storage.
         """
 
-        if self.namedcomplex is not None:
-            if key == "" or key == None:
-                return TagList([Tag(eid=id) for id in self.namedcomplex['taglist']])
-            
-            elif key == ".":
-                return TagList(
-                    [Tag(eid=id) for id in self.namedcomplex['taglist'] if Tag(eid=id).tagtype == "taglist"])
-            
-            elif key == "#":
-                return TagList(
-                    [Tag(eid=id) for id in self.namedcomplex['taglist'] if Tag(eid=id).tagtype == "datalist"])
-            
-            # To abstraction. Returns a list of parent categories that category belongs to.
-            elif key == "^" and self.namedcomplex['parent'] != False:
-                if self.parenttype == "tag":
-                    return Tag(eid=self.namedcomplex['parent'])
-                
-                elif self.parenttype == "cell":
-                    return TableCell(eid=self.namedcomplex['parent'])
-            
-            elif key == "x" and self.tables != []:
-                return [Table(eid=id) for id in self.namedcomplex['tables']]
-            
-            # Down to TableCells
-            elif key == "&":
-                return [TableCell(eid=id) for id in self.namedcomplex['tablecells']]
-            
-            elif key == "d":
-                # Returns the data that is associated with this complex tag.
-                return [Data(eid=id) for id in self.namedcomplex['datalist']]
-            
-    def insert(self, *args):
-        """
-        If selected gets eid and inserts into complex. If made from Category(),
-        enters into database and then enters into complex.
-        """
+        if element is not None and element.eid in self._staged:
+            element.update(self._staged[element.eid])
 
-        for element in args:
-            
-            if isinstance(element, Tag) and element.eid == None:
-            
-                # Insert HashTag into table hashtags.
-                eid = self.TABLE.TAGS.insert(element.__serialize__())
+        return element
 
-                element.eid = eid
+    def _scan(self):
 
-                # Add tag element eid to this tag
-                self.update_id(eid, self.TABLE.TAGS, self.eid, "taglist", self)
-                
-                # Insert this Tag into element tag parent.
-                self.update_tag_parent("tag", self.eid, self.TABLE.TAGS, eid)
-            
-            elif isinstance(element, Data) and element.eid == None:
-            
-                # Insert Data into table data.
-                eid = self.TABLE.DATA.insert(element.__serialize__())
-                
-                # Add data element eid to this tag
-                self.update_id(eid, self.TABLE.TAGS, self.eid, "datalist", self)
-                
-                # Insert this Tag into element tag parent.
-                self.update_id(self.eid, self.TABLE.DATA, eid, "parents")
-        
-            # Set eid for category or hashtag.
-            elif element.eid is not None:
+        return super(TagsTable, self).all()
 
-                eid = element.eid
+    def get(self, cond=None, eid=None):
 
-                if isinstance(element, Tag):
-                    
-                    if element.parenttype == "tag":
-                        
-                        cell = TableCell(None, TagList([self.eid] + [element.parent]))
-                        cell.insert_cell()
-                        
-                        self.update_tag_parent("cell", cell.eid, self.TABLE.TAGS, eid) 
-                        
-                    elif element.parenttype == "cell":
-                        
-                        cell = element.get("^")
-                        
-                        cell.insert(Tag(eid=self.eid))
-                        cell.insert_cell()
-                        
-                    else:
-                        
-                        # Add this tag to element parent
-                        self.update_tag_parent("tag", self.eid, self.TABLE.TAGS, eid)
- 
-                    # Add tag element eid to this parent tag
-                    self.update_id(eid, self.TABLE.TAGS, self.eid, "taglist", self)
+        if eid is not None:
+            return self._overlay(super(TagsTable, self).get(eid=eid))
 
-                elif isinstance(element, Data):
-                    # Add data element eid to this tag
-                    self.update_id(eid, self.TABLE.TAGS, self.eid, "datalist", self)
+        with self.instruments.timed("scan"):
+            for element in self._scan():
+                if cond(element):
+                    return self._overlay(element)
 
-                    # Add this tag eid into table data element parents.
-                    self.update_id(self.eid, self.TABLE.DATA, eid, "parents", element)
-                    
-        self.__update_type__()
+    def all(self):
 
-    def remove(self):
-        """
-        Deletes category and all it's children.
-        """
+        with self.instruments.timed("scan"):
+            return self._scan()
 
-        for cellid in self.taglist:
-            Tag(eid=cell).remove()
+    def search(self, cond):
 
-        for dataid in self.datalist:
-            Data(eid=data).remove()
+        # count() goes through search() too.
+        if cond in self._query_cache:
+            return self._query_cache[cond][:]
 
-        for tableid in self.tables:
-            Table(eid=tableid).remove()
-            
-        for cellid in self.tablecells:
-            TableCell(eid=cellid).remove()
+        with self.instruments.timed("scan"):
+            elements = [element for element in self._scan() if cond(element)]
 
-        if self.eid != None:
-            self.TABLE.TAGS.remove(eids=[self.eid])
+        self._query_cache[cond] = elements
 
-class TagList(list):
-    """
-    A TagList is made up of several Tags
-    """
+        return elements[:]
 
-    def __init__(self, elementlist, op=None):
-        
-        self[:] = elementlist 
-        
-        self.setoperator = op
-        
-    def __repr__(self):
-        return "TagList({0})".format(self[:])
-    
-    def show(self):
+    def stage(self, fields, eid):
+        """
+        Writes fields to eid now if autosave is on, otherwise holds them until flush().
+        Returns True if the fields were written.
+        """
 
-        print self
+        if self.autosave:
+            self.update(fields, eids=[eid])
+            return True
 
-    def get(self, key):
+        self._staged.setdefault(eid, {}).update(fields)
+        return False
+
+    def update_version(self, fields, eid, version):
+        """
+        Writes fields to element eid if it is still at version, the version it had
+        when it was read. Otherwise raises ConflictError and writes nothing.
         """
-        Returns tables and tablecells that are related to tags in this TagList.
 
-        Input:
-        TagList().get(key)
-        key is either TagList().get("x") for all tables, 
-                      TagList().get(".x") for tables that hold categories, 
-                      TagList().get("#x") for tables that hold data,
-                      TagList().get("&") for tablecells.
+        def apply(data, eid):
+            if data[eid].get('version') != version:
+                raise ConflictError("Element {0} of {1} changed since it was read.".format(eid, self.name))
+            data[eid].update(fields)
 
-        Logical operaters that are used with you use TinyTagsDB.select()
-        will be used to find relations among tags.
-        
-        Output:
-        A list of Table() or TableCell()
+        self.process_elements(apply, eids=[eid])
+
+    def flush(self):
+        """
+        Writes all staged fields in a single storage write.
         """
 
-        # Get sets of tablecell or table ids for all tags in TagList
-        if key == "x":
-            sets = [set(tag.tables) for tag in self[:]]
-            tagclass = "table"
-        elif key == ".x":
-            sets = [set(tag.tables) for tag in self[:] if tag.tagtype == "taglist"]
-            tagclass = "table"
-        elif key == "#x":
-            sets = [set(tag.tables) for tag in self[:] if tag.tagtype == "datalist"]
-            tagclass = "table"
-        elif key == "&":
-            sets = [set(tag.tablecells) for tag in self[:] if tag.tagtype == "datalist"]
-            tagclass = "cell"
+        if self._staged:
+            staged, self._staged = self._staged, {}
 
-        # Choose set operation and does a set operation on the sets.
-        if self.setoperator == "and":
-            ids = reduce(lambda x, y: x & y, sets)
-        if self.setoperator == "or":
-            ids = reduce(lambda x, y: x | y, sets)
-        if self.setoperator == "xor":
-            ids = reduce(lambda x, y: x ^ y, sets)
-        if self.setoperator == "not":
-            ids = reduce(lambda x, y: x - y, sets)
+            def apply(data, eid):
+                if eid in data:
+                    data[eid].update(staged[eid])
 
-        # Return a list of tables or tablecells that match 
-        if tagclass == "table":
-            return [Table(eid=id) for id in ids]
-        elif tagclass == "cell":
-            return [TableCell(eid=id) for id in ids]
+            self.process_elements(apply, eids=list(staged))
 
-            
-    def join(self):
+    @committed
+    def write_elements(self, elements):
         """
-        To complexity. Returns a complex table of two or more dimensions.
-        This applies to the elements and creates a number of complex words
-        If a category list is put into a category it becomes a supercategory.
-        This applies to the category names and works to better organize
-        repeating elemenets in categories and specifiy category names.
-        Uses tables and set operations to combine elements. If it affects
-        the name then do set operations to merge the elements. This creates
-        a table where the table cells are a complex name with a list of
-        elements that the class is made up of.
+        Inserts or replaces elements, a dict of eid -> element, in a single write.
         """
-        
-        return Table(self).join()
 
-    
-class Data(object):
+        if not elements:
+            return
 
-    TABLE = TinyTagsDB
-    
-    def __init__(self, name=None, description=None, location=None, eid=None):
+        for element in elements.values():
+            self._derive(element)
 
-        if eid != None:
-            self.eid = eid
-            self.sync()
-            
-        else:
-            self.name = name
-            self.description = description
-            self.location = location
-            self.parents = []
-            self.eid = None
-        
-    def __repr__(self):
+        data = self._read()
+        data.update(elements)
+        self._write(data)
 
-        return 'Data("{0}")'.format(self.name)
-    
-    def __serialize__(self):
-        
-        self.dict = {'name': self.name,
-                    'description': self.description,
-                    'location': self.location,
-                    'parents': self.parents}
-        
-        return self.dict
+        for eid, element in elements.items():
+            self._written(eid, element)
 
-    def sync(self):
-        
-        self.data = self.TABLE.DATA.get(eid=self.eid)
-        
-        self.name = self.data['name']
-        self.description = self.data['description']
-        self.location = self.data['location']
-        self.parents = self.data['parents']
+        self._last_id = max(self._last_id, max(elements))
 
-    def show(self):
-        
-        print "Name: {0}\nDescription: {1}\nLocation: {2}\r".format(self.name, self.description, self.location)
+    def iter_elements(self):
+        """
+        Yields (eid, element) of every element in eid order.
+        """
 
+        data = self._read()
+        for eid in sorted(data):
+            yield eid, self._overlay(data[eid])
 
-class Table(list, Id):
-    
-    def __init__(self, tags=None, tablecell=None, eid=None):
-        
-        self.name = ""
-        self.eid = None
-        self.tablecell = tablecell
-        self[:] = [tablecell] if tablecell != None else []
-        self.joined = False
-        self.type = None
+    def lookup(self, name):
+        """
+        Returns the first element named name, or None.
+        """
 
-        if tags != None:
-            self.categorylist = tags
-            self.tags = [category.eid for category in tags]
-            self.length = len(self.tags)
-            self.categorylisthastags = []
-            
-            for tag in self.categorylist:
-                if tag.hastags == True:
-                    self.categorylisthastags.append(tag)
-            self.categorylist = self.categorylisthastags
-            
-            for tag in self.categorylist:
-                if tag == self.categorylist[0]:
-                    self.name += tag.name
-                else:
-                    self.name += " x {0}".format(tag.name)
-           
+        eids = self._names.get(name)
+        if eids:
+            return self.get(eid=eids[0])
 
-        if eid == None:
-            try:
-                len_match = lambda list, length : len(list) == length
-                self.table = self.TABLE.TABS.get((Query().tags.all(self.tags)) & (Query().tags.test(len_match, self.length)))
-            except:
-                self.table = None
-                
-        else:
-            self.table = self.TABLE.TABS.get(eid=eid)
+    def lookup_eids(self, name):
+        """
+        Returns the eids of all elements named name.
+        """
 
-        if self.table != None:
+        return list(self._names.get(name, []))
 
-            self.name = self.table['name']
-            self.tags = self.table['tags']
-            self[:] = self.table['tablecells']
-            self.eid = self.table.eid
-            
-    def __repr__(self):
-        
-        return self.name
-    
-    def __serialize__(self):
-        
-        tablecells = [tablecell for tablecell in self[:] if tablecell.eid != None]
+    @committed
+    def insert(self, element):
 
-        self.dict = {'name': self.name,
-                    'tags': self.tags,
-                    'tablecells': tablecells,
-                    'type': self.type}
-        
-        return self.dict
-    
-    def sync(self):
-        
-        self.table = self.TABLE.TABS.get(eid=self.eid)
-        
-        self.name = self.table['name']
-        self.tags = self.table['tags']
-        self[:] = self.table['tablecells']
-        
-    def show(self):
-        
-        print "Name:", self.name
-        print "Tags:", self.tags
-        print "Cells:", self[:]
-        print "Eid:", self.eid
-        
-    def _ylength(self):
-        
-        self.repeateach = []
-        self.repeattotal = []
+        self._derive(element)
+        eid = super(TagsTable, self).insert(element)
+        self._written(eid, element)
 
-        lengths = []
-        for category in self.categorylist:
-            lengths.append(len(category.taglist))
+        return eid
 
-        multiply = list(reversed(lengths))
-        
-        while True:
-            multiply.pop()
-            if len(multiply) == 0:
-                self.repeateach.append(1)
-                break
-            self.repeateach.append(reduce(lambda x, y: x*y, multiply))
-        multiply = list(lengths)
-        while True:
-            multiply.pop()
-            if len(multiply) == 0:
-                self.repeattotal.append(1)
-                break
-            self.repeattotal.append(reduce(lambda x, y: x*y, multiply))
-        self.repeattotal = list(reversed(self.repeattotal))
-        
-        return zip(self.repeateach, self.repeattotal)
+    @committed
+    def insert_multiple(self, elements):
 
-    def join(self):
+        elements = list(elements)
+        for element in elements:
+            self._derive(element)
+        eids = super(TagsTable, self).insert_multiple(elements)
+        for eid, element in zip(eids, elements):
+            self._written(eid, element)
 
-        if self.joined is False:
-            
-            self.joined = True
-            
-            ylength = self._ylength()
-            l = []
-            columns = []
-            
-            for selectlength, category in zip(range(len(self.categorylist)), self.categorylist):
-                categorycomplex = category.taglist
-                for element in categorycomplex:
-                    l += [element]*ylength[selectlength][0]
-                l = l*ylength[selectlength][1]
-                columns.append(l)
-                l = []
-                
-            rows = zip(*columns)
+        return eids
 
-            len_match = lambda list, length : len(list) == length
-            
-            for cell in rows:
-                
-                c = list(cell)
+    @committed
+    def process_elements(self, func, cond=None, eids=None):
 
-                # Set table type
+        touched = {}
+
+        def indexed(data, eid):
+            func(data, eid)
+            touched[eid] = data.get(eid)
+            self._derive(touched[eid])
+
+        eids = super(TagsTable, self).process_elements(indexed, cond, eids)
+
+        for eid, element in touched.items():
+            self._written(eid, element)
+
+        return eids
+
+    @committed
+    def purge(self):
+
+        super(TagsTable, self).purge()
+        self.changed = True
+        self._names = {}
+        self._eidnames = {}
+        self._staged = {}
+
+        for index in self.indexes:
+            index.clear()
+
+        if self.elements is not None:
+            self.elements.clear()
+
+
+class DocumentTable(TagsTable):
+    """
+    A TagsTable that reads and writes single documents through storages that
+    support it, SQLiteStorage and LogStorage, instead of rewriting the table.
+
+    The storage provides load(table, eid), read_table(table), store(table, eid, old, new),
+    replace_table(table, values), count(table) and a transaction() context manager.
+    """
+
+    def __init__(self, storage, name, cache_size=10):
+
+        # StorageProxy -> BatchMiddleware, which forwards to the storage
+        self._backend = storage._storage
+
+        super(DocumentTable, self).__init__(storage, name, cache_size)
+
+    def _read(self):
+
+        with self.instruments.timed("read"):
+            return self._backend.read_table(self.name)
+
+    def _write(self, values):
+
+        self.clear_cache()
+        self._backend.replace_table(self.name, values)
+
+    def __len__(self):
+
+        return self._backend.count(self.name)
+
+    def get(self, cond=None, eid=None):
+
+        if eid is not None:
+            with self.instruments.timed("read"):
+                return self._overlay(self._backend.load(self.name, eid))
+
+        return super(DocumentTable, self).get(cond)
+
+    def iter_elements(self):
+        """
+        Yields (eid, element) of every element in eid order, loading one at a time.
+        """
+
+        for eid in sorted(self._eidnames):
+            element = self.get(eid=eid)
+            if element is not None:
+                yield eid, element
+
+    def _store(self, eid, old, new):
+
+        with self.instruments.timed("write"):
+            self._backend.store(self.name, eid, old, new)
+
+    @committed
+    def insert(self, element):
+
+        return self.insert_multiple([element])[0]
+
+    @committed
+    def insert_multiple(self, elements):
+
+        elements = list(elements)
+        eids = []
+
+        with self._backend.transaction():
+            for element in elements:
+                self._derive(element)
+                eid = self._get_next_id()
+                self._store(eid, None, element)
+                eids.append(eid)
+
+        self.clear_cache()
+
+        for eid, element in zip(eids, elements):
+            self._written(eid, element)
+
+        return eids
+
+    @committed
+    def process_elements(self, func, cond=None, eids=None):
+
+        if eids is None:
+            data = self._read()
+            eids = [eid for eid in data if cond(data[eid])]
+        else:
+            data = dict((eid, self._backend.load(self.name, eid)) for eid in eids)
+
+        touched = {}
+
+        with self._backend.transaction():
+            for eid in eids:
+                old = data.get(eid)
+                if old is not None:
+                    old = dict((key, list(value) if isinstance(value, list) else value) for key, value in old.items())
+
+                func(data, eid)
+
+                touched[eid] = data.get(eid)
+                self._derive(touched[eid])
+                self._store(eid, old, touched[eid])
+
+        self.clear_cache()
+
+        for eid, element in touched.items():
+            self._written(eid, element)
+
+        return eids
+
+    @committed
+    def write_elements(self, elements):
+
+        if not elements:
+            return
+
+        with self._backend.transaction():
+            for eid, element in elements.items():
+                self._derive(element)
+                self._store(eid, self._backend.load(self.name, eid), element)
+
+        self.clear_cache()
+
+        for eid, element in elements.items():
+            self._written(eid, element)
+
+        self._last_id = max(self._last_id, max(elements))
+
+
+class SQLiteStorage(Storage):
+    """
+    Stores a TinyTagsDB in an SQLite file in WAL mode:
+
+        db = TinyTagsDB("tags.sqlite", storage=SQLiteStorage)
+
+    Scalar fields of a document are kept as JSON in the documents table and id lists
+    as one row per id in the members table. Its tables are DocumentTables, which write
+    one document at a time, and appending or removing an id writes one row, so the
+    cost of a write doesn't grow with the size of the database. Names, parents and
+    id list members are indexed.
+    """
+
+    table_class = DocumentTable
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS documents (
+            tbl TEXT NOT NULL,
+            eid INTEGER NOT NULL,
+            name TEXT,
+            parent INTEGER,
+            doc TEXT NOT NULL,
+            PRIMARY KEY (tbl, eid));
+        CREATE INDEX IF NOT EXISTS documents_name ON documents (tbl, name);
+        CREATE INDEX IF NOT EXISTS documents_parent ON documents (tbl, parent);
+        CREATE TABLE IF NOT EXISTS members (
+            seq INTEGER PRIMARY KEY,
+            tbl TEXT NOT NULL,
+            eid INTEGER NOT NULL,
+            key TEXT NOT NULL,
+            member);
+        CREATE INDEX IF NOT EXISTS members_element ON members (tbl, eid, key);
+        CREATE INDEX IF NOT EXISTS members_member ON members (tbl, key, member);
+    """
+
+    def __init__(self, path):
+
+        super(SQLiteStorage, self).__init__()
+
+        # Transactions are managed by begin(), commit() and transaction().
+        self.connection = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(self.SCHEMA)
+
+        self.depth = 0
+
+    @contextmanager
+    def transaction(self):
+        """
+        Runs the block in a transaction, or in the open one of a batch.
+        """
+
+        self.begin()
+        try:
+            yield self.connection
+        except:
+            self.rollback()
+            raise
+        self.commit()
+
+    def begin(self):
+
+        if self.depth == 0:
+            self.connection.execute("BEGIN")
+        self.depth += 1
+
+    def commit(self):
+
+        self.depth -= 1
+        if self.depth == 0:
+            self.connection.execute("COMMIT")
+
+    def rollback(self):
+
+        self.depth -= 1
+        if self.depth == 0:
+            self.connection.execute("ROLLBACK")
+
+    def _element(self, eid, document, members):
+
+        document = json.loads(document)
+        for key, member in members:
+            document[key].append(member)
+
+        return database.Element(document, eid)
+
+    def load(self, table, eid):
+        """
+        Returns element eid of table, or None.
+        """
+
+        row = self.connection.execute("SELECT doc FROM documents WHERE tbl = ? AND eid = ?", (table, eid)).fetchone()
+        if row is None:
+            return None
+
+        members = self.connection.execute("SELECT key, member FROM members WHERE tbl = ? AND eid = ? ORDER BY seq",
+                                          (table, eid))
+
+        return self._element(eid, row[0], members)
+
+    def read_table(self, table):
+        """
+        Returns all elements of table as a dict of eid -> Element.
+        """
+
+        members = {}
+        for eid, key, member in self.connection.execute(
+                "SELECT eid, key, member FROM members WHERE tbl = ? ORDER BY seq", (table,)):
+            members.setdefault(eid, []).append((key, member))
+
+        return dict((eid, self._element(eid, document, members.get(eid, [])))
+                    for eid, document in self.connection.execute(
+                        "SELECT eid, doc FROM documents WHERE tbl = ?", (table,)))
+
+    def store(self, table, eid, old, new):
+        """
+        Writes the changes from old to new of element eid, removing it if new is None.
+        Ids appended to or removed from a list only touch the rows of those ids.
+        """
+
+        if new is None:
+            self.connection.execute("DELETE FROM documents WHERE tbl = ? AND eid = ?", (table, eid))
+            self.connection.execute("DELETE FROM members WHERE tbl = ? AND eid = ?", (table, eid))
+            return
+
+        lists = dict((key, list(value)) for key, value in new.items() if isinstance(value, list))
+        document = dict((key, [] if key in lists else value) for key, value in new.items())
+        parent = new.get('parent') if isinstance(new.get('parent'), int) else None
+
+        self.connection.execute("INSERT OR REPLACE INTO documents (tbl, eid, name, parent, doc) VALUES (?, ?, ?, ?, ?)",
+                                (table, eid, new.get('name'), parent, json.dumps(document)))
+
+        for key, ids in lists.items():
+            before = list(old.get(key, [])) if old is not None else []
+
+            if ids == before:
+                continue
+
+            if ids[:len(before)] == before:
+                added = ids[len(before):]
+
+            else:
+                # Delete the rows of removed ids if the rest keep their order, else rewrite the list.
+                rows = self.connection.execute(
+                    "SELECT seq, member FROM members WHERE tbl = ? AND eid = ? AND key = ? ORDER BY seq",
+                    (table, eid, key)).fetchall()
+
+                kept, removed = 0, []
+                for seq, member in rows:
+                    if kept < len(ids) and ids[kept] == member:
+                        kept += 1
+                    else:
+                        removed.append((seq,))
+
+                if kept == len(ids):
+                    self.connection.executemany("DELETE FROM members WHERE seq = ?", removed)
+                    added = []
+                else:
+                    self.connection.execute("DELETE FROM members WHERE tbl = ? AND eid = ? AND key = ?", (table, eid, key))
+                    added = ids
+
+            self.connection.executemany("INSERT INTO members (tbl, eid, key, member) VALUES (?, ?, ?, ?)",
+                                        [(table, eid, key, member) for member in added])
+
+    def replace_table(self, table, values):
+
+        with self.transaction():
+            self.connection.execute("DELETE FROM documents WHERE tbl = ?", (table,))
+            self.connection.execute("DELETE FROM members WHERE tbl = ?", (table,))
+            for eid, element in values.items():
+                self.store(table, int(eid), None, element)
+
+    def count(self, table):
+
+        return self.connection.execute("SELECT COUNT(*) FROM documents WHERE tbl = ?", (table,)).fetchone()[0]
+
+    def read(self):
+
+        tables = [row[0] for row in self.connection.execute("SELECT DISTINCT tbl FROM documents")]
+
+        return dict((table, dict((str(eid), dict(element)) for eid, element in self.read_table(table).items()))
+                    for table in tables)
+
+    def write(self, data):
+
+        with self.transaction():
+            self.connection.execute("DELETE FROM documents")
+            self.connection.execute("DELETE FROM members")
+            for table, values in data.items():
+                for eid, element in values.items():
+                    self.store(table, int(eid), None, element)
+
+    def close(self):
+
+        self.connection.close()
+
+
+class LogStorage(Storage):
+    """
+    Stores a TinyTagsDB as a JSON snapshot plus an append-only log of changes:
+
+        db = TinyTagsDB("tags.json", storage=LogStorage)
+        db = TinyTagsDB("tags.json", storage=LogStorage, compact_every=1000, fsync=True)
+
+    Each write appends one record with only the changed fields, and the ids
+    appended to or removed from id lists, to "tags.json.log", so its cost is
+    the size of the change. On open the snapshot is loaded and the log replayed.
+    After compact_every records the state is written to a fresh snapshot in a
+    background thread and the log starts over. Records are flushed when a write or
+    batch commits, and fsynced with it too if fsync=True, so a crash loses at
+    most the records written since the last fsync.
+
+    An existing TinyDB JSON file can be opened with LogStorage as its first snapshot.
+    State lives in memory, so only one process may open it; it can't be multiprocess.
+    """
+
+    table_class = DocumentTable
+
+    def __init__(self, path, compact_every=10000, fsync=False, background=True):
+
+        super(LogStorage, self).__init__()
+
+        self.path = path
+        self.logpath = path + ".log"
+        self.compact_every = compact_every
+        self.fsync = fsync
+        self.background = background
+
+        # table -> {eid: document}, and the seq of the last change applied
+        self.tables = {}
+        self.seq = 0
+
+        # Records not yet written and the old documents of the open transaction
+        self.depth = 0
+        self.pending = []
+        self.undo = {}
+
+        self.records = 0
+        self.compacting = None
+        self.lock = threading.RLock()
+
+        self._open()
+
+    def _open(self):
+
+        if os.path.exists(self.path) and os.path.getsize(self.path) > 0:
+            with open(self.path) as file:
+                snapshot = json.load(file)
+
+            if "tables" not in snapshot or "seq" not in snapshot:
+                # A plain TinyDB JSON file.
+                snapshot = {"seq": 0, "tables": snapshot}
+
+            self.seq = snapshot["seq"]
+            self.tables = dict((table, dict((int(eid), document) for eid, document in values.items()))
+                               for table, values in snapshot["tables"].items())
+
+        # A log left behind by an unfinished compaction comes before the current log.
+        interrupted = os.path.exists(self.logpath + ".old")
+
+        for path in [self.logpath + ".old", self.logpath]:
+            if os.path.exists(path):
+                self._replay(path)
+
+        self.log = open(self.logpath, "a")
+
+        if interrupted:
+            self._write_snapshot(self._snapshot(), self.logpath + ".old")
+            self.log.truncate(0)
+
+    def _replay(self, path):
+
+        with open(path, "r+") as file:
+            end = 0
+            for line in iter(file.readline, ""):
+                try:
+                    record = json.loads(line) if line.endswith("\n") else None
+                except ValueError:
+                    record = None
+
+                if record is None:
+                    # The last record was only partly written before a crash.
+                    # Cut it off, so records appended next start on a line of their own.
+                    file.truncate(end)
+                    break
+
+                end = file.tell()
+                if record["seq"] > self.seq:
+                    self._apply(record)
+                    self.seq = record["seq"]
+                    self.records += 1
+
+    def _apply(self, record):
+
+        table = self.tables.setdefault(record["table"], {})
+        eid = record["eid"]
+
+        if "doc" in record:
+            if record["doc"] is None:
+                table.pop(eid, None)
+            else:
+                table[eid] = record["doc"]
+            return
+
+        document = table[eid]
+        document.update(record.get("set", {}))
+
+        for key in record.get("unset", []):
+            document.pop(key, None)
+
+        for key, positions in record.get("remove", {}).items():
+            for position in reversed(positions):
+                del document[key][position]
+
+        for key, ids in record.get("add", {}).items():
+            document[key].extend(ids)
+
+    @staticmethod
+    def _copy(document):
+
+        return dict((key, list(value) if isinstance(value, list) else value) for key, value in document.items())
+
+    @staticmethod
+    def _delta(old, new):
+        """
+        Returns the fields of a change record from document old to new.
+        """
+
+        delta = {}
+
+        for key, value in new.items():
+            before = old.get(key)
+
+            if value == before:
+                continue
+
+            if isinstance(value, list) and isinstance(before, list):
+                if value[:len(before)] == before:
+                    delta.setdefault("add", {})[key] = value[len(before):]
+                    continue
+
+                # Positions of removed ids, if the ids left keep their order.
+                kept, removed = 0, []
+                for position, id in enumerate(before):
+                    if kept < len(value) and value[kept] == id:
+                        kept += 1
+                    else:
+                        removed.append(position)
+
+                if kept == len(value):
+                    delta.setdefault("remove", {})[key] = removed
+                    continue
+
+            delta.setdefault("set", {})[key] = value
+
+        unset = [key for key in old if key not in new]
+        if unset:
+            delta["unset"] = unset
+
+        return delta
+
+    def _append(self, record):
+
+        self.seq += 1
+        record["seq"] = self.seq
+        self.pending.append(json.dumps(record))
+
+        if self.depth == 0:
+            self._flush()
+
+    def _flush(self):
+
+        if self.pending:
+            self.log.write("\n".join(self.pending) + "\n")
+            self.log.flush()
+            if self.fsync:
+                os.fsync(self.log.fileno())
+
+            self.records += len(self.pending)
+            self.pending = []
+
+        if self.records >= self.compact_every:
+            self.compact()
+
+    @contextmanager
+    def transaction(self):
+        """
+        Runs the block in a transaction, or in the open one of a batch.
+        """
+
+        self.begin()
+        try:
+            yield self
+        except:
+            self.rollback()
+            raise
+        self.commit()
+
+    def begin(self):
+
+        self.lock.acquire()
+        self.depth += 1
+
+    def commit(self):
+
+        try:
+            self.depth -= 1
+            if self.depth == 0:
+                self.undo = {}
+                self._flush()
+        finally:
+            self.lock.release()
+
+    def rollback(self):
+
+        try:
+            self.depth -= 1
+            if self.depth == 0:
+                for (table, eid), document in self.undo.items():
+                    if document is None:
+                        self.tables.get(table, {}).pop(eid, None)
+                    else:
+                        self.tables.setdefault(table, {})[eid] = document
+                self.seq -= len(self.pending)
+                self.pending = []
+                self.undo = {}
+        finally:
+            self.lock.release()
+
+    def load(self, table, eid):
+        """
+        Returns element eid of table, or None.
+        """
+
+        document = self.tables.get(table, {}).get(eid)
+
+        return database.Element(self._copy(document), eid) if document is not None else None
+
+    def read_table(self, table):
+        """
+        Returns all elements of table as a dict of eid -> Element.
+        """
+
+        return dict((eid, database.Element(self._copy(document), eid))
+                    for eid, document in self.tables.get(table, {}).items())
+
+    def store(self, table, eid, old, new):
+        """
+        Applies the change from old to new of element eid and appends it to the log,
+        removing the element if new is None.
+        """
+
+        with self.transaction():
+            documents = self.tables.setdefault(table, {})
+            current = documents.get(eid)
+
+            if (table, eid) not in self.undo:
+                self.undo[(table, eid)] = current
+
+            if new is None:
+                documents.pop(eid, None)
+                self._append({"table": table, "eid": eid, "doc": None})
+
+            elif current is None:
+                documents[eid] = self._copy(new)
+                self._append({"table": table, "eid": eid, "doc": documents[eid]})
+
+            else:
+                delta = self._delta(current, new)
+                documents[eid] = self._copy(new)
+                if delta:
+                    delta.update({"table": table, "eid": eid})
+                    self._append(delta)
+
+    def replace_table(self, table, values):
+
+        with self.transaction():
+            values = dict((int(eid), element) for eid, element in values.items())
+            for eid in list(self.tables.get(table, {})):
+                if eid not in values:
+                    self.store(table, eid, None, None)
+            for eid, element in values.items():
+                self.store(table, eid, None, element)
+
+    def count(self, table):
+
+        return len(self.tables.get(table, {}))
+
+    def read(self):
+
+        return dict((table, dict((str(eid), self._copy(document)) for eid, document in values.items()))
+                    for table, values in self.tables.items())
+
+    def write(self, data):
+
+        with self.transaction():
+            for table in set(self.tables) | set(data):
+                self.replace_table(table, data.get(table, {}))
+
+    def _snapshot(self):
+
+        return json.dumps({"seq": self.seq, "tables": self.tables})
+
+    def _write_snapshot(self, snapshot, oldlog):
+
+        temporary = self.path + ".tmp"
+        with open(temporary, "w") as file:
+            file.write(snapshot)
+            file.flush()
+            os.fsync(file.fileno())
+
+        os.rename(temporary, self.path)
+        os.remove(oldlog)
+
+    def compact(self):
+        """
+        Writes the current state to a new snapshot and starts a new log.
+        The snapshot is written in a background thread unless background is False.
+        """
+
+        with self.lock:
+            if self.compacting is not None and self.compacting.is_alive():
+                return
+
+            snapshot = self._snapshot()
+
+            self.log.close()
+            os.rename(self.logpath, self.logpath + ".old")
+            self.log = open(self.logpath, "a")
+            self.records = 0
+
+            if self.background:
+                self.compacting = threading.Thread(target=self._write_snapshot, args=(snapshot, self.logpath + ".old"))
+                self.compacting.daemon = True
+                self.compacting.start()
+            else:
+                self._write_snapshot(snapshot, self.logpath + ".old")
+
+    def close(self):
+
+        # Flushing can start a compaction, so wait for it after the flush.
+        self._flush()
+        if self.compacting is not None:
+            self.compacting.join()
+
+        os.fsync(self.log.fileno())
+        self.log.close()
+
+
+class ComboIndex(object):
+    """
+    Finds elements by the canonical form of an id list, the sorted tuple of its ids,
+    so the tags [2, 1] and [1, 2] are the same combination.
+    """
+
+    def __init__(self, key):
+
+        self.key = key
+        self.clear()
+
+    def clear(self):
+
+        # combination -> sorted list of eids, and eid -> combination
+        self.combos = {}
+        self.eidcombos = {}
+
+    @staticmethod
+    def canonical(ids):
+
+        return tuple(sorted(getattr(id, "eid", id) for id in ids))
+
+    def update(self, eid, element):
+
+        if eid in self.eidcombos:
+            combo = self.eidcombos.pop(eid)
+            self.combos[combo].remove(eid)
+            if self.combos[combo] == []:
+                del self.combos[combo]
+
+        if element is not None and element.get(self.key) is not None:
+            combo = self.canonical(element[self.key])
+            self.eidcombos[eid] = combo
+            insort(self.combos.setdefault(combo, []), eid)
+
+    def get(self, ids):
+        """
+        Returns the first eid with the combination of ids, or None.
+        """
+
+        eids = self.combos.get(self.canonical(ids))
+
+        return eids[0] if eids else None
+
+
+class ClosureIndex(object):
+    """
+    The ancestors and descendants of every tag over the taglist links, and the
+    data under each tag at any depth. Fed by the tags table on every write.
+    """
+
+    def __init__(self):
+
+        self.clear()
+
+    def clear(self):
+
+        # Direct links, tag eid -> set of eids
+        self.children = {}
+        self.parents = {}
+        self.datalists = {}
+
+        # data eid -> tags that hold it directly
+        self.dataparents = {}
+
+        # Closure, tag eid -> set of tag eids or data eids
+        self.ancestors = {}
+        self.descendants = {}
+        self.alldata = {}
+
+        # data eid -> every tag it is under
+        self.dataancestors = {}
+
+    def update(self, eid, element):
+
+        children = set(element['taglist']) if element is not None else set()
+        datalist = set(element['datalist']) if element is not None else set()
+
+        oldchildren = self.children.get(eid, set())
+        olddatalist = self.datalists.get(eid, set())
+
+        for child in children - oldchildren:
+            self._link(eid, child)
+
+        for child in oldchildren - children:
+            self._unlink(eid, child)
+
+        if datalist - olddatalist:
+            self._add_data(eid, datalist - olddatalist)
+
+        if olddatalist - datalist:
+            self._remove_data(eid, olddatalist - datalist)
+
+        if element is None:
+            for parent in list(self.parents.get(eid, ())):
+                self._unlink(parent, eid)
+
+            for index in [self.children, self.parents, self.datalists,
+                          self.ancestors, self.descendants, self.alldata]:
+                index.pop(eid, None)
+
+    def _link(self, parent, child):
+
+        self.children.setdefault(parent, set()).add(child)
+        self.parents.setdefault(child, set()).add(parent)
+
+        above = set([parent]) | self.ancestors.get(parent, set())
+        below = set([child]) | self.descendants.get(child, set())
+        data = self.alldata.get(child, set())
+
+        for tag in above:
+            self.descendants.setdefault(tag, set()).update(below)
+            self.alldata.setdefault(tag, set()).update(data)
+
+        for tag in below:
+            self.ancestors.setdefault(tag, set()).update(above)
+
+        for id in data:
+            self.dataancestors.setdefault(id, set()).update(above)
+
+    def _unlink(self, parent, child):
+
+        self.children[parent].discard(child)
+        self.parents[child].discard(parent)
+
+        above = set([parent]) | self.ancestors.get(parent, set())
+        below = set([child]) | self.descendants.get(child, set())
+
+        self._refresh(above, below, set(self.alldata.get(child, ())))
+
+    def _add_data(self, tag, ids):
+
+        self.datalists.setdefault(tag, set()).update(ids)
+
+        above = set([tag]) | self.ancestors.get(tag, set())
+
+        for id in ids:
+            self.dataparents.setdefault(id, set()).add(tag)
+            self.dataancestors.setdefault(id, set()).update(above)
+
+        for each in above:
+            self.alldata.setdefault(each, set()).update(ids)
+
+    def _remove_data(self, tag, ids):
+
+        self.datalists[tag] -= ids
+
+        for id in ids:
+            self.dataparents[id].discard(tag)
+
+        self._refresh(set([tag]) | self.ancestors.get(tag, set()), set(), ids)
+
+    def _refresh(self, above, below, data):
+        """
+        Recomputes the ancestors of the tags in below, the descendants and data
+        of the tags in above, and the ancestors of data after a link is removed.
+        """
+
+        memo = {}
+
+        def up(tag):
+            if tag not in below:
+                return self.ancestors.get(tag, set())
+            if tag not in memo:
+                memo[tag] = set()
+                result = set()
+                for parent in self.parents.get(tag, ()):
+                    result.add(parent)
+                    result |= up(parent)
+                memo[tag] = result
+            return memo[tag]
+
+        for tag in below:
+            self.ancestors[tag] = up(tag)
+
+        memo = {}
+
+        def down(tag):
+            if tag not in above:
+                return self.descendants.get(tag, set()), self.alldata.get(tag, set())
+            if tag not in memo:
+                memo[tag] = (set(), set())
+                descendants, alldata = set(), set(self.datalists.get(tag, ()))
+                for child in self.children.get(tag, ()):
+                    childdescendants, childdata = down(child)
+                    descendants.add(child)
+                    descendants |= childdescendants
+                    alldata |= childdata
+                memo[tag] = (descendants, alldata)
+            return memo[tag]
+
+        for tag in above:
+            self.descendants[tag], self.alldata[tag] = down(tag)
+
+        for id in data:
+            tags = set()
+            for tag in self.dataparents.get(id, ()):
+                tags.add(tag)
+                tags |= self.ancestors.get(tag, set())
+            self.dataancestors[id] = tags
+
+
+class TextIndex(object):
+    """
+    An inverted index of the words in the text fields of every element, ranking
+    elements against a query with BM25. Fed by its table on every write.
+    """
+
+    WORDS = re.compile(r"\w+", re.UNICODE)
+
+    # BM25 saturation of repeated words and weight of the element's length
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self, fields):
+
+        self.fields = fields
+        self.clear()
+
+    def clear(self):
+
+        # word -> {eid: times the word is in the element}, and eid -> its words
+        self.postings = {}
+        self.words = {}
+
+        # eid -> number of words in the element, and the sum of them
+        self.lengths = {}
+        self.total = 0
+
+    @classmethod
+    def tokenize(cls, text):
+
+        return cls.WORDS.findall(text.lower()) if text else []
+
+    def update(self, eid, element):
+
+        for word in self.words.pop(eid, ()):
+            postings = self.postings[word]
+            del postings[eid]
+            if not postings:
+                del self.postings[word]
+
+        self.total -= self.lengths.pop(eid, 0)
+
+        if element is None:
+            return
+
+        counts = {}
+        for field in self.fields:
+            value = element.get(field)
+            if isinstance(value, basestring):
+                for word in self.tokenize(value):
+                    counts[word] = counts.get(word, 0) + 1
+
+        for word, count in counts.items():
+            self.postings.setdefault(word, {})[eid] = count
+
+        self.words[eid] = tuple(counts)
+        self.lengths[eid] = sum(counts.values())
+        self.total += self.lengths[eid]
+
+    def score(self, query, eids=None):
+        """
+        Returns {eid: BM25 score} of the elements holding any word of query,
+        only those in the set eids if it is given.
+        """
+
+        count = len(self.lengths)
+        if count == 0:
+            return {}
+
+        average = float(self.total) / count or 1.0
+        scores = {}
+
+        for word in set(self.tokenize(query)):
+            postings = self.postings.get(word)
+            if not postings:
+                continue
+
+            idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+
+            if eids is not None and len(eids) < len(postings):
+                matches = [eid for eid in eids if eid in postings]
+            else:
+                matches = [eid for eid in postings if eids is None or eid in eids]
+
+            for eid in matches:
+                frequency = postings[eid]
+                norm = frequency + self.K1 * (1 - self.B + self.B * self.lengths[eid] / average)
+                scores[eid] = scores.get(eid, 0.0) + idf * frequency * (self.K1 + 1) / norm
+
+        return scores
+
+
+class NameIndex(object):
+    """
+    Tag names for TinyTagsDB.autocomplete(): a sorted list of lowercased names
+    searched by bisection for prefixes, and the trigrams of each name to find
+    names with typos. Fed by the tags table on every write.
+    """
+
+    # Names sharing the most trigrams with the text that get an edit distance
+    CANDIDATES = 16
+
+    # Trigrams in more names than this are too common to pick candidates by.
+    COMMON = 1000
+
+    SYMBOLS = {"taglist": ".", "datalist": "#"}
+
+    def __init__(self):
+
+        self.clear()
+
+    def clear(self):
+
+        # Sorted (lowercased name, eid), and eid -> (name, tagtype, children)
+        self.sorted = []
+        self.entries = {}
+
+        # trigram -> set of eids
+        self.trigrams = {}
+
+    @staticmethod
+    def grams(key):
+
+        # Padded so beginnings count most and short names have trigrams.
+        padded = "$$" + key + "$"
+        return set(padded[i:i + 3] for i in xrange(len(padded) - 2))
+
+    @staticmethod
+    def distance(a, b, limit):
+        """
+        Returns the edit distance from a to the closest beginning of b, counting
+        swapped neighbours as one edit, or limit + 1 once it is over limit.
+        """
+
+        if len(b) < len(a) - limit:
+            return limit + 1
+
+        # Beginnings longer than this are too far from a.
+        b = b[:len(a) + limit]
+
+        before, previous = None, range(len(b) + 1)
+        for i, x in enumerate(a, 1):
+            current = [i]
+            for j, y in enumerate(b, 1):
+                cost = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (x != y))
+                if i > 1 and j > 1 and x == b[j - 2] and a[i - 2] == y:
+                    cost = min(cost, before[j - 2] + 1)
+                current.append(cost)
+            if min(current) > limit:
+                return limit + 1
+            before, previous = previous, current
+
+        return min(previous)
+
+    def update(self, eid, element):
+
+        old = self.entries.pop(eid, None)
+        name = (element.get('name') or "") if element is not None else None
+
+        if old is not None and old[0] != name:
+            key = old[0].lower()
+            del self.sorted[bisect_left(self.sorted, (key, eid))]
+            for gram in self.grams(key):
+                self.trigrams[gram].discard(eid)
+                if not self.trigrams[gram]:
+                    del self.trigrams[gram]
+
+        if element is None:
+            return
+
+        if old is None or old[0] != name:
+            key = name.lower()
+            insort(self.sorted, (key, eid))
+            for gram in self.grams(key):
+                self.trigrams.setdefault(gram, set()).add(eid)
+
+        children = len(element.get('taglist', ())) + len(element.get('datalist', ()))
+        self.entries[eid] = (name, element.get('tagtype'), children)
+
+    def entry(self, eid):
+        """
+        Returns (displayname, children, eid) of tag eid.
+        """
+
+        name, tagtype, children = self.entries[eid]
+        return self.SYMBOLS.get(tagtype, "") + name, children, eid
+
+    def suggest(self, text, limit=10, fuzzy=True):
+        """
+        Returns up to limit eids: names starting with text in name order, then
+        with fuzzy, names within about a typo per three letters of text, closest first.
+        """
+
+        key = text.lower()
+        found = []
+
+        position = bisect_left(self.sorted, (key,))
+        while len(found) < limit and position < len(self.sorted) and self.sorted[position][0].startswith(key):
+            found.append(self.sorted[position][1])
+            position += 1
+
+        if not fuzzy or len(found) >= limit or key == "":
+            return found
+
+        postings = [self.trigrams[gram] for gram in self.grams(key) if gram in self.trigrams]
+        rare = [eids for eids in postings if len(eids) <= self.COMMON]
+
+        shared = {}
+        for eids in rare or postings:
+            for eid in eids:
+                shared[eid] = shared.get(eid, 0) + 1
+
+        limitdistance = max(1, len(key) // 3)
+        seen = set(found)
+        close = []
+
+        for eid, count in heapq.nlargest(self.CANDIDATES, shared.items(), key=lambda item: item[1]):
+            if eid in seen:
+                continue
+
+            # Against the beginnings of the name, as text may be unfinished.
+            name = self.entries[eid][0].lower()
+            distance = self.distance(key, name, limitdistance)
+
+            if distance <= limitdistance:
+                close.append((distance, -count, name, eid))
+
+        return found + [entry[-1] for entry in sorted(close)[:limit - len(found)]]
+
+
+class ElementCache(object):
+    """
+    A least recently used cache. TinyTagsDB uses it as the identity map of live
+    Tag, Data, Table and TableCell objects keyed by (tablename, eid), and to keep
+    compiled select() expressions.
+    Once capacity is reached the least recently used object is dropped.
+    """
+
+    def __init__(self, capacity=None):
+
+        self.capacity = capacity
+        self._elements = OrderedDict()
+
+        # (key, object) of objects evicted or touched since record(), for rolling back a batch.
+        self.touched = None
+
+        # get() reorders too, so readers on several threads need this.
+        self._guard = threading.Lock()
+
+    def __len__(self):
+
+        return len(self._elements)
+
+    def __contains__(self, key):
+
+        return key in self._elements
+
+    def get(self, key):
+
+        with self._guard:
+            element = self._elements.pop(key, None)
+            if element is not None:
+                self._elements[key] = element
+
+        return element
+
+    def put(self, key, element):
+
+        with self._guard:
+            self._elements.pop(key, None)
+            self._elements[key] = element
+
+            if self.capacity is not None and len(self._elements) > self.capacity:
+                self._elements.popitem(last=False)
+
+    def evict(self, key):
+
+        with self._guard:
+            element = self._elements.pop(key, None)
+
+        if element is not None:
+            self.touch(key, element)
+
+    def touch(self, key, element):
+        """
+        Notes that element, cached or not, was written while recording.
+        """
+
+        touched = self.touched
+        if touched is not None:
+            touched.append((key, element))
+
+    def record(self):
+        """
+        Starts keeping every evicted or touched object until recorded() is called.
+        """
+
+        self.touched = []
+
+    def recorded(self):
+        """
+        Returns [(key, element)] of the objects evicted or touched since record(), and stops.
+        """
+
+        touched, self.touched = self.touched or [], None
+        return touched
+
+    def clear(self, tablenames=None):
+        """
+        Drops every object, or only those keyed (tablename, eid) of tablenames.
+        """
+
+        with self._guard:
+            if tablenames is None:
+                self._elements.clear()
+                return
+
+            for key in [key for key in self._elements if key[0] in tablenames]:
+                del self._elements[key]
+
+
+class Rehydrate(type):
+    """
+    Metaclass for Tag, Data, Table and TableCell.
+    Calling the class with only an eid, as in Tag(eid=id, db=db), returns the live object
+    from the identity map of db and only loads the document when it isn't there.
+    """
+
+    def __call__(cls, *args, **kwargs):
+
+        eid = kwargs.get('eid')
+
+        if eid is None or args or set(kwargs) - set(['eid', 'db']):
+            return super(Rehydrate, cls).__call__(*args, **kwargs)
+
+        # Each database has its own identity map.
+        db = TinyTagsDB.resolve(kwargs.get('db'))
+        key = (cls.tablename, eid)
+
+        element = db.ELEMENTS.get(key)
+        if element is None:
+            with db.snapshot(), db.instruments.timed("rehydrate"):
+                element = super(Rehydrate, cls).__call__(*args, **kwargs)
+            db.ELEMENTS.put(key, element)
+        else:
+            db.instruments.record("hit")
+
+        return element
+
+
+class ReadWriteLock(object):
+    """
+    Lets any number of threads read at once, or one thread write.
+    Waiting writers go before new readers. Both locks are reentrant and the
+    writing thread may read. A reading thread can't upgrade to writing, as two
+    of them would wait for each other, so calls that may write take the write
+    lock up front.
+    """
+
+    def __init__(self):
+
+        self.condition = threading.Condition(threading.Lock())
+        self.readers = 0
+        self.writer = None
+        self.writes = 0
+        self.waiting = 0
+
+        # Read depth of each thread
+        self.local = threading.local()
+
+    def acquire_read(self):
+
+        me = threading.current_thread()
+        depth = getattr(self.local, "reads", 0)
+
+        with self.condition:
+            if depth == 0 and self.writer is not me:
+                while self.writer is not None or self.waiting:
+                    self.condition.wait()
+            self.readers += 1
+
+        self.local.reads = depth + 1
+
+    def release_read(self):
+
+        self.local.reads -= 1
+
+        with self.condition:
+            self.readers -= 1
+            if self.readers == 0:
+                self.condition.notify_all()
+
+    def acquire_write(self):
+
+        me = threading.current_thread()
+
+        with self.condition:
+            if self.writer is not me:
+                if getattr(self.local, "reads", 0):
+                    raise RuntimeError("Can't take the write lock while holding the read lock.")
+
+                self.waiting += 1
+                while self.writer is not None or self.readers > 0:
+                    self.condition.wait()
+                self.waiting -= 1
+
+                self.writer = me
+            self.writes += 1
+
+    def release_write(self):
+
+        with self.condition:
+            self.writes -= 1
+            if self.writes == 0:
+                self.writer = None
+                self.condition.notify_all()
+
+    def reading(self):
+        """
+        Returns True if this thread holds the read lock but not the write lock.
+        """
+
+        return getattr(self.local, "reads", 0) > 0 and self.writer is not threading.current_thread()
+
+    @contextmanager
+    def read(self):
+
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextmanager
+    def write(self):
+
+        self.acquire_write()
+        try:
+            yield
+        finally:
+            self.release_write()
+
+
+def reading(method):
+    """
+    Runs the method holding the read lock of its object's database.
+    """
+
+    return guarded(method, "read")
+
+
+def writing(method):
+    """
+    Runs the method holding the write lock of its object's database.
+    """
+
+    return guarded(method, "write")
+
+
+def guarded(method, mode):
+    """
+    Wraps method to run as a public call of its object's database: under the
+    read or write lock, named by mode, and counted by its Instruments.
+    """
+
+    @wraps(method)
+    def locked(self, *args, **kwargs):
+
+        db = getattr(self, "TABLE", None)
+        if db is None:
+            return method(self, *args, **kwargs)
+
+        with db.instruments.call(self, method.__name__):
+            try:
+                if db.lock is None:
+                    return method(self, *args, **kwargs)
+
+                # Reloading writes, so it has to happen before the read lock is taken.
+                if mode == "read":
+                    db.refresh()
+
+                with getattr(db.lock, mode)():
+                    return method(self, *args, **kwargs)
+
+            finally:
+                # A batch rolled back syncs the live objects its writes went through.
+                if mode == "write" and db.ELEMENTS.touched is not None:
+                    for element in (self,) + args:
+                        if hasattr(element, "sync") and getattr(element, "eid", None) is not None:
+                            db.ELEMENTS.touch((element.tablename, element.eid), element)
+
+    return locked
+
+
+class FileLock(object):
+    """
+    An advisory lock on a file, shared between processes, held shared while
+    reading storage and exclusive while writing it. Holds nest, and a shared hold
+    inside an exclusive one doesn't lock again. The file also keeps a generation
+    number for each table that writers bump, so other processes can tell which
+    of their indexes are stale.
+
+    Without fcntl only the threads of this process are kept apart.
+    """
+
+    def __init__(self, path):
+
+        self.path = path
+        self.file = open(path, "a+")
+
+        # flock doesn't tell threads of one process apart.
+        self.mutex = threading.RLock()
+        self.depth = 0
+        self.exclusive = False
+
+    def _flock(self, operation):
+
+        if fcntl is not None:
+            fcntl.flock(self.file.fileno(), getattr(fcntl, operation))
+
+    @contextmanager
+    def hold(self, exclusive=False):
+
+        with self.mutex:
+            if self.depth == 0:
+                self._flock("LOCK_EX" if exclusive else "LOCK_SH")
+                self.exclusive = exclusive
+
+            elif exclusive and not self.exclusive:
+                raise RuntimeError("A shared FileLock can't be made exclusive.")
+
+            self.depth += 1
+            try:
+                yield self
+            finally:
+                self.depth -= 1
+                if self.depth == 0:
+                    self._flock("LOCK_UN")
+
+    def read_generations(self):
+        """
+        Returns {tablename: generation}.
+        """
+
+        self.file.seek(0)
+        text = self.file.read().strip()
+        generations = json.loads(text) if text else {}
+
+        # A single number was written by versions that reloaded every table.
+        return generations if isinstance(generations, dict) else {}
+
+    def write_generations(self, generations):
+
+        self.file.seek(0)
+        self.file.truncate()
+        self.file.write(json.dumps(generations, sort_keys=True))
+        self.file.flush()
+
+    def close(self):
+
+        self.file.close()
+
+
+class Bitmap(object):
+    """
+    A set of eids stored as the bits of a Python int, so and, or, xor and
+    difference run a machine word at a time. Supports &, |, ^, - and iteration
+    like a set, and encodes to a zlib compressed base64 string for storage.
+    """
+
+    def __init__(self, bits=0):
+
+        self.bits = bits
+
+    @classmethod
+    def from_ids(cls, ids):
+
+        ids = list(ids)
+        if ids == []:
+            return cls()
+
+        buffer = bytearray(max(ids) // 8 + 1)
+        for id in ids:
+            buffer[id // 8] |= 1 << (id % 8)
+
+        buffer.reverse()
+        return cls(int(binascii.hexlify(bytes(buffer)), 16))
+
+    @classmethod
+    def decode(cls, string):
+
+        raw = zlib.decompress(base64.b64decode(string))
+        return cls(int(binascii.hexlify(raw), 16) if raw else 0)
+
+    def encode(self):
+
+        hexbits = "{0:x}".format(self.bits) if self.bits else ""
+        if len(hexbits) % 2:
+            hexbits = "0" + hexbits
+
+        return base64.b64encode(zlib.compress(binascii.unhexlify(hexbits))).decode("ascii")
+
+    def __repr__(self):
+
+        return "Bitmap({0})".format(list(self))
+
+    def __iter__(self):
+
+        # Reversed binary string so that string index == eid.
+        bits = bin(self.bits)[:1:-1]
+        position = bits.find("1")
+        while position != -1:
+            yield position
+            position = bits.find("1", position + 1)
+
+    def __len__(self):
+
+        return bin(self.bits).count("1")
+
+    def __contains__(self, id):
+
+        return bool(self.bits >> id & 1)
+
+    def __eq__(self, other):
+
+        return isinstance(other, Bitmap) and self.bits == other.bits
+
+    def __ne__(self, other):
+
+        return not self == other
+
+    def __and__(self, other):
+
+        return Bitmap(self.bits & other.bits)
+
+    def __or__(self, other):
+
+        return Bitmap(self.bits | other.bits)
+
+    def __xor__(self, other):
+
+        return Bitmap(self.bits ^ other.bits)
+
+    def __sub__(self, other):
+
+        return Bitmap(self.bits & ~other.bits)
+
+
+class IdList(array):
+    """
+    The eids of an id list such as Tag.taglist, kept in order as 4 byte ints.
+    "in" is a binary search, on the ids themselves when they are sorted, as
+    they are when eids were added in the order they were made, or else on a
+    sorted copy made on first use.
+    """
+
+    __slots__ = ("_sorted",)
+
+    def __new__(cls, ids=()):
+
+        return super(IdList, cls).__new__(cls, "i", ids)
+
+    def __init__(self, ids=()):
+
+        self._sorted = None
+
+    def __repr__(self):
+
+        return "IdList({0})".format(self.tolist())
+
+    def __reduce__(self):
+
+        return IdList, (self.tolist(),)
+
+    def __contains__(self, id):
+
+        # None until first use, then False when the ids are sorted themselves.
+        if self._sorted is None:
+            ordered = sorted(self)
+            self._sorted = False if ordered == self.tolist() else array("i", ordered)
+
+        ids = self if self._sorted is False else self._sorted
+        position = bisect_left(ids, id)
+        return position < len(ids) and ids[position] == id
+
+    def __eq__(self, other):
+
+        if isinstance(other, (list, tuple, array)):
+            return len(self) == len(other) and all(x == y for x, y in zip(self, other))
+        return NotImplemented
+
+    def __ne__(self, other):
+
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    def _changed(self, method, *args):
+
+        self._sorted = None
+        return getattr(super(IdList, self), method)(*args)
+
+    def _removed(self, method, *args):
+
+        # Taking ids out of sorted ids leaves them sorted.
+        ordered = self._sorted is False
+        value = self._changed(method, *args)
+        if ordered:
+            self._sorted = False
+        return value
+
+    def append(self, id):
+
+        # So does appending a larger id, as eids are made in order.
+        ordered = self._sorted is False and (len(self) == 0 or self[-1] < id)
+        self._changed("append", id)
+        if ordered:
+            self._sorted = False
+
+    def extend(self, ids):
+
+        self._changed("extend", ids)
+
+    def insert(self, position, id):
+
+        self._changed("insert", position, id)
+
+    def remove(self, id):
+
+        self._removed("remove", id)
+
+    def pop(self, position=-1):
+
+        return self._removed("pop", position)
+
+    def reverse(self):
+
+        self._changed("reverse")
+
+    def byteswap(self):
+
+        self._changed("byteswap")
+
+    def fromlist(self, ids):
+
+        self._changed("fromlist", ids)
+
+    def fromstring(self, string):
+
+        self._changed("fromstring", string)
+
+    def fromfile(self, file, count):
+
+        self._changed("fromfile", file, count)
+
+    def __iadd__(self, ids):
+
+        return self._changed("__iadd__", ids)
+
+    def __imul__(self, count):
+
+        return self._changed("__imul__", count)
+
+    def __setitem__(self, index, value):
+
+        self._changed("__setitem__", index, value)
+
+    def __delitem__(self, index):
+
+        self._removed("__delitem__", index)
+
+    def __setslice__(self, start, stop, ids):
+
+        self._changed("__setslice__", start, stop, ids)
+
+    def __delslice__(self, start, stop):
+
+        self._removed("__delslice__", start, stop)
+
+
+class SelectPlan(object):
+    """
+    A select() expression compiled to a tree of set operations.
+
+    Leaves are ("tag", index) into self.leaves, a list of (tagclass, tagname).
+    Nodes are (op, left, right) where op is and, or, xor or not (difference).
+    """
+
+    TOKENS = re.compile(r"\s*(?:(\()|(\))|(and|or|xor|not)\b|([\.\#\&]?)(\w+))")
+
+    # Lowest to highest binding.
+    PRECEDENCE = [["or"], ["xor"], ["and"], ["not"]]
+
+    OPERATIONS = {"and": lambda x, y: x & y,
+                  "or": lambda x, y: x | y,
+                  "xor": lambda x, y: x ^ y,
+                  "not": lambda x, y: x - y}
+
+    def __init__(self, string):
+
+        self.string = string
+        self.leaves = []
+        self.tokens = []
+
+        position = 0
+        string = string.rstrip()
+        while position < len(string):
+            match = self.TOKENS.match(string, position)
+            if match is None or match.end() == position:
+                raise ValueError("Can't parse select expression at: {0}".format(string[position:]))
+            position = match.end()
+
+            if match.group(1) or match.group(2):
+                self.tokens.append(match.group(1) or match.group(2))
+            elif match.group(3):
+                self.tokens.append(match.group(3))
+            else:
+                self.tokens.append((match.group(4), match.group(5)))
+
+        self.position = 0
+        self.tree = self._parse(0)
+
+        if self.position != len(self.tokens):
+            raise ValueError("Unexpected {0} in select expression: {1}".format(self.tokens[self.position], self.string))
+
+    def __repr__(self):
+
+        return "SelectPlan({0})".format(self.string)
+
+    def _next(self):
+
+        if self.position >= len(self.tokens):
+            raise ValueError("Unexpected end of select expression: {0}".format(self.string))
+
+        token = self.tokens[self.position]
+        self.position += 1
+
+        return token
+
+    def _parse(self, level):
+
+        if level == len(self.PRECEDENCE):
+            return self._atom()
+
+        node = self._parse(level + 1)
+
+        while self.position < len(self.tokens) and self.tokens[self.position] in self.PRECEDENCE[level]:
+            op = self._next()
+            node = (op, node, self._parse(level + 1))
+
+        return node
+
+    def _atom(self):
+
+        token = self._next()
+
+        if token == "(":
+            node = self._parse(0)
+            if self._next() != ")":
+                raise ValueError("Missing ) in select expression: {0}".format(self.string))
+            return node
+
+        if not isinstance(token, tuple):
+            raise ValueError("Unexpected {0} in select expression: {1}".format(token, self.string))
+
+        if token not in self.leaves:
+            self.leaves.append(token)
+
+        return ("tag", self.leaves.index(token))
+
+    def operators(self, node=None):
+        """
+        Returns the set of operators used in the expression.
+        """
+
+        node = self.tree if node is None else node
+
+        if node[0] == "tag":
+            return set()
+
+        return set([node[0]]) | self.operators(node[1]) | self.operators(node[2])
+
+    def evaluate(self, sets, node=None):
+        """
+        Runs the set operations on sets, one set per leaf.
+        A leaf set of None is left out of the operation it is in.
+        """
+
+        node = self.tree if node is None else node
+
+        if node[0] == "tag":
+            return sets[node[1]]
+
+        left = self.evaluate(sets, node[1])
+        right = self.evaluate(sets, node[2])
+
+        if left is None:
+            return right
+        if right is None:
+            return left
+
+        return self.OPERATIONS[node[0]](left, right)
+
+
+class Explain(object):
+    """
+    The steps TinyTagsDB.explain() saw select(expression).get(key) take. Each step
+    is a dict with:
+
+        step        "parse", "resolve", "members", an operation like "and", or "fetch"
+        detail      what it did
+        estimated   the size expected from the sizes going in, for operations
+        actual      the size it came to
+        reads       storage reads, of the whole database or of one document
+        scans       full table scans
+        loads       objects loaded from documents, not found in the identity map
+        seconds     time it took
+    """
+
+    def __init__(self, expression, key):
+
+        self.expression = expression
+        self.key = key
+        self.steps = []
+        self.result = None
+
+    def add(self, step, detail, estimated=None, actual=None, reads=0, scans=0, loads=0, seconds=0.0):
+
+        self.steps.append({"step": step,
+                           "detail": detail,
+                           "estimated": estimated,
+                           "actual": actual,
+                           "reads": reads,
+                           "scans": scans,
+                           "loads": loads,
+                           "seconds": seconds})
+
+    def __repr__(self):
+
+        return 'Explain("{0}", "{1}", {2} steps)'.format(self.expression, self.key, len(self.steps))
+
+    def show(self):
+
+        print 'select("{0}").get("{1}")'.format(self.expression, self.key)
+        for number, step in enumerate(self.steps):
+            sizes = "actual {0}".format(step["actual"]) if step["actual"] is not None else ""
+            if step["estimated"] is not None:
+                sizes = "estimated {0}, ".format(step["estimated"]) + sizes
+            print " "*4 + "{0}. {1}: {2}".format(number + 1, step["step"], step["detail"])
+            print " "*8 + "{0}{1}{2} reads, {3} scans, {4} loads, {5:.3f} ms".format(
+                sizes, " | " if sizes else "", step["reads"], step["scans"], step["loads"], step["seconds"] * 1000)
+
+
+def join_rows(axes, repeateach, start, stop):
+    """
+    Returns the complex of rows start up to stop of a join.
+    """
+
+    return [[axis[(index // each) % len(axis)] for axis, each in zip(axes, repeateach)]
+            for index in xrange(start, stop)]
+
+
+def join_cells(axes, repeateach, combos, start, stop):
+    """
+    Returns an array of the eid of the saved tablecell of each row start up to stop
+    of a join, or 0 where there is none. combos maps the canonical form of a complex
+    to the sorted eids of its tablecells. Run by the process pool of TinyTagsDB.
+    """
+
+    eids = array("i")
+    for index in xrange(start, stop):
+        found = combos.get(tuple(sorted([axis[(index // each) % len(axis)] for axis, each in zip(axes, repeateach)])))
+        eids.append(found[0] if found else 0)
+
+    return eids
+
+
+class BatchBuffer(dict):
+    """
+    The working copy of the database in a batch. A table is copied from the
+    storage's data when the batch first looks it up, not when the batch begins,
+    so tables the batch never touches are never copied. Tables read and then
+    written need the copy before the write, as readers change the id lists of
+    the documents they read before writing them back.
+    """
+
+    def __init__(self, data):
+
+        super(BatchBuffer, self).__init__(data)
+        self.copied = set()
+
+    def __getitem__(self, name):
+
+        table = super(BatchBuffer, self).__getitem__(name)
+        if name not in self.copied:
+            self.copied.add(name)
+            table = deepcopy(table)
+            super(BatchBuffer, self).__setitem__(name, table)
+        return table
+
+    def __setitem__(self, name, table):
+
+        self.copied.add(name)
+        super(BatchBuffer, self).__setitem__(name, table)
+
+
+class BatchMiddleware(Middleware):
+    """
+    Holds every write in memory between begin() and commit(), so a batch
+    costs a single write to the wrapped storage.
+    """
+
+    def __init__(self, storage_cls=TinyDB.DEFAULT_STORAGE):
+        super(BatchMiddleware, self).__init__(storage_cls)
+
+        # Working copy of the database while a batch is open, else None.
+        self.buffer = None
+
+        # Storages like JSONStorage share one file handle between reads.
+        self.access = threading.RLock()
+
+        # FileLock of a multiprocess TinyTagsDB, held shared while reading.
+        self.filelock = None
+
+        # Instruments of the owning TinyTagsDB
+        self.instruments = Instruments()
+
+    def read(self):
+
+        if self.buffer is not None:
+            return self.buffer
+
+        with self.access, self.instruments.timed("read"):
+            if self.filelock is None:
+                return self.storage.read()
+
+            with self.filelock.hold():
+                return self.storage.read()
+
+    def write(self, data):
+
+        if self.buffer is not None:
+            self.buffer = data
+        else:
+            with self.access, self.instruments.timed("write"):
+                self.storage.write(data)
+
+    def begin(self):
+
+        with self.access, self.instruments.timed("read"):
+            # Storages with their own transactions, like SQLiteStorage, batch themselves.
+            if hasattr(self.storage, "begin"):
+                return self.storage.begin()
+
+            self.buffer = BatchBuffer(self.storage.read() or {})
+
+    def commit(self):
+
+        with self.access, self.instruments.timed("write"):
+            if hasattr(self.storage, "commit"):
+                return self.storage.commit()
+
+            buffer, self.buffer = self.buffer, None
+            self.storage.write(dict(buffer))
+
+    def rollback(self):
+
+        if hasattr(self.storage, "rollback"):
+            return self.storage.rollback()
+
+        self.buffer = None
+
+
+class TinyTagsDB(TinyDB):
+
+    table_class = TagsTable
+
+    PLAN_CACHE_SIZE = 256
+
+    # Databases open now. Objects made without db= use the database when only one is.
+    # Held weakly, so a database dropped without close() doesn't stay open forever.
+    opened = weakref.WeakSet()
+
+    # With workers, Table.cell_eids() of at least this many rows runs on the process pool.
+    PARALLEL_ROWS = 20000
+
+    # Elements import_stream() writes at once to each table
+    STREAM_CHUNK = 5000
+
+    def __init__(self, database=None, cache_size=10000, autosave=True, bitmaps=False, threadsafe=False,
+                 multiprocess=False, workers=None, storage=TinyDB.DEFAULT_STORAGE, **kwargs):
+        """
+        Other keyword arguments are passed to the storage, as with TinyDB:
+        TinyTagsDB("tags.json", storage=LogStorage, fsync=True)
+        """
+
+        def open_storage(*storage_args, **storage_kwargs):
+            middleware = BatchMiddleware(storage)(*storage_args, **storage_kwargs)
+
+            # Storages like SQLiteStorage bring their own table class.
+            self.table_class = getattr(middleware.storage, "table_class", TagsTable)
+            return middleware
+
+        args = [database] if database is not None else []
+        super(TinyTagsDB, self).__init__(*args, storage=open_storage, **kwargs)
+
+        # Depth of nested batch() blocks.
+        self._batches = 0
+
+        # With threadsafe, reads like select() and Tag.get() run in parallel and
+        # each write, or whole batch, runs alone.
+        self.lock = ReadWriteLock() if threadsafe else None
+
+        # Counters and timers, see instrument() and add_hook()
+        self.instruments = Instruments()
+        self._storage.instruments = self.instruments
+
+        # Processes for large Table.cell_eids(), started when first needed.
+        if workers is not None and ProcessPoolExecutor is None:
+            raise ImportError("workers needs concurrent.futures, from the futures package on Python 2.")
+
+        self.workers = workers
+        self._pool = None
+
+        # With multiprocess, writes commit under an advisory lock on "<database>.lock",
+        # elements carry a version, and update_id and remove_id retry on conflicts.
+        self.filelock = None
+        self.generations = {}
+
+        if multiprocess:
+            if database is None:
+                raise ValueError("A multiprocess TinyTagsDB needs a database path.")
+
+            self.filelock = FileLock(database + ".lock")
+            self.generations = self.filelock.read_generations()
+            self._storage.filelock = self.filelock
+        
+        # Tags, Data, Tables and TableCells keep the database they came from in TABLE,
+        # so several databases can be open at once.
+        self.TAGS = self.table("tags")
+        self.TABS = self.table("tables")
+        self.CELLS = self.table("tablecells")
+        self.DATA = self.table("data")
+        self.TABLE = self
+
+        TinyTagsDB.opened.add(self)
+
+        # Compiled select() expressions
+        self.plans = ElementCache(self.PLAN_CACHE_SIZE)
+
+        # Identity map shared by Tag(eid=id), Data(eid=id), Table(eid=id) and TableCell(eid=id)
+        self.ELEMENTS = ElementCache(cache_size)
+        for table in [self.TAGS, self.TABS, self.CELLS, self.DATA]:
+            table.elements = self.ELEMENTS
+
+            # With autosave off, derived fields like tagtype are only written by save().
+            table.autosave = autosave
+            table.instruments = self.instruments
+
+            if multiprocess:
+                table.versions = True
+                table.committing = self.exclusive
+
+        # Tables by their tags and tablecells by their complex, in any order
+        self.TABS.combos = ComboIndex("tags")
+        self.TABS.add_index(self.TABS.combos)
+        self.CELLS.combos = ComboIndex("complex")
+        self.CELLS.add_index(self.CELLS.combos)
+
+        # Ancestors, descendants and data at any depth of every tag
+        self.CLOSURE = ClosureIndex()
+        self.TAGS.add_index(self.CLOSURE)
+
+        # Words of data and of tag names for search()
+        self.DATA.text = TextIndex(["name", "description", "location"])
+        self.DATA.add_index(self.DATA.text)
+        self.TAGS.text = TextIndex(["name"])
+        self.TAGS.add_index(self.TAGS.text)
+
+        # Tag names by prefix and trigram for autocomplete()
+        self.TAGS.prefixes = NameIndex()
+        self.TAGS.add_index(self.TAGS.prefixes)
+
+        # Keep tag memberships as Bitmaps for TagList.get() and TableCell.get()
+        if bitmaps:
+            self.TAGS.bitmaps = ["taglist", "datalist", "tables", "tablecells"]
+
+    @staticmethod
+    def resolve(db=None):
+        """
+        Returns db, or when db is None the only open database. Raises LookupError
+        if none or several are open.
+        """
+
+        if db is not None:
+            return db
+
+        # A database holds reference cycles, so one dropped without close() is
+        # only gone from opened once the cycles are collected.
+        if len(TinyTagsDB.opened) > 1:
+            gc.collect()
+
+        opened = list(TinyTagsDB.opened)
+        if len(opened) == 1:
+            return opened[0]
+
+        if not opened:
+            raise LookupError("No open TinyTagsDB. Pass db= or open one first.")
+
+        raise LookupError("{0} TinyTagsDBs are open. Pass db= to say which one to use.".format(
+            len(opened)))
+
+    @staticmethod
+    def only():
+        """
+        Returns the only open database, or None if none or several are open.
+        """
+
+        opened = list(TinyTagsDB.opened)
+        return opened[0] if len(opened) == 1 else None
+
+    @contextmanager
+    def instrument(self):
+        """
+        with db.instrument() as stats:
+            ...
+        stats.show()
+
+        Collects the storage reads, writes, scans and rehydrations of each public
+        call made in the block into a Stats.
+        """
+
+        stats = Stats()
+        self.instruments.collectors.append(stats)
+        try:
+            yield stats
+        finally:
+            self.instruments.collectors.remove(stats)
+
+    def add_hook(self, hook):
+        """
+        Calls hook(call, event, seconds) for every event of Instruments, until
+        remove_hook(hook). call is the public call, like "Tag.get", or None.
+        """
+
+        self.instruments.hooks.append(hook)
+
+    def remove_hook(self, hook):
+
+        self.instruments.hooks.remove(hook)
+
+    @contextmanager
+    def exclusive(self):
+        """
+        with db.exclusive():
+            ...
+
+        Holds the file lock of a multiprocess database so the writes of the block
+        commit together. It first reloads the tables another process wrote since
+        the last commit, and at the end bumps the generations of those it wrote.
+        Does nothing for other databases.
+        """
+
+        if self.filelock is None:
+            yield self
+            return
+
+        with self.filelock.hold(exclusive=True):
+            outer = self.filelock.depth == 1
+            if outer:
+                self._refresh()
+
+            try:
+                yield self
+            finally:
+                if outer:
+                    for table in [self.TAGS, self.TABS, self.CELLS, self.DATA]:
+                        if table.changed:
+                            self.generations[table.name] = self.generations.get(table.name, 0) + 1
+                            table.changed = False
+                    self.filelock.write_generations(self.generations)
+
+    def pool(self, work, threshold):
+        """
+        Returns the process pool if this database has workers and work is at least threshold,
+        otherwise None.
+        """
+
+        if self.workers is None or work < threshold:
+            return None
+
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(self.workers)
+
+        return self._pool
+
+    def reduce_sets(self, op, sets):
+        """
+        Runs the set operation op ("and", "or", "xor" or "not") over sets, a list of
+        sets or Bitmaps. Intersections go smallest first.
+        """
+
+        if sets == []:
+            return None
+
+        if op == "not":
+            # a not b not c is a not (b or c)
+            return sets[0] - self.reduce_sets("or", sets[1:]) if len(sets) > 1 else sets[0]
+
+        if op == "and":
+            # Smallest first keeps every intersection small.
+            sets = sorted(sets, key=len)
+
+        return reduce(SelectPlan.OPERATIONS[op], sets)
+
+    def join_cells(self, axes, repeateach, start, stop):
+        """
+        Returns an array of the eid of the saved tablecell of each row of a join from
+        start up to stop, or 0 where there is none.
+
+        Large joins are split into one range of rows per worker. Each worker is sent
+        the tags along each dimension and only the saved tablecells its rows can
+        hold, found through the tablecells of the tags of the first dimension in its
+        range, and returns its eids as an array, joined here in row order.
+        """
+
+        pool = self.pool(stop - start, self.PARALLEL_ROWS) if stop > start else None
+        if pool is None:
+            return join_cells(axes, repeateach, self.CELLS.combos.combos, start, stop)
+
+        size = -(-(stop - start) // self.workers)
+        starts = range(start, stop, size)
+        stops = [min(first + size, stop) for first in starts]
+
+        tagsets = [set(axis) for axis in axes]
+        eidcombos = self.CELLS.combos.eidcombos
+
+        def combos(first, last):
+            # Rows first up to last hold the tags of the first dimension at these positions.
+            found = {}
+            for id in axes[0][first // repeateach[0]:(last - 1) // repeateach[0] + 1]:
+                for eid in Tag(eid=id, db=self).tablecells:
+                    combo = eidcombos.get(eid)
+                    if combo is not None and len(combo) == len(axes) and combo not in found and \
+                            all(not tags.isdisjoint(combo) for tags in tagsets):
+                        found[combo] = self.CELLS.combos.combos[combo]
+            return found
+
+        futures = [pool.submit(join_cells, axes, repeateach, combos(first, last), first, last)
+                   for first, last in zip(starts, stops)]
+
+        eids = array("i")
+        for future in futures:
+            eids.extend(future.result())
+
+        return eids
+
+    def refresh(self):
+        """
+        Reloads the tables another process wrote to a multiprocess database since
+        this one last did. Each is reloaded whole, a read of the table and a rebuild
+        of its indexes, however little was written.
+        A thread holding only the read lock can't reload, and the call that took
+        the lock refreshed just before.
+        """
+
+        if self.lock is not None and self.lock.reading():
+            return
+
+        if self.filelock is not None:
+            with self.filelock.hold():
+                self._refresh()
+
+    def _refresh(self):
+
+        generations = self.filelock.read_generations()
+        stale = [table for table in [self.TAGS, self.TABS, self.CELLS, self.DATA]
+                 if generations.get(table.name) != self.generations.get(table.name)]
+
+        self.generations = generations
+        if stale:
+            self.reload(stale)
+
+    @contextmanager
+    def snapshot(self):
+        """
+        with db.snapshot():
+            ...
+
+        Holds the read lock, which keeps the writers of this process out until
+        the block ends. That is mutual exclusion, not isolation: other processes
+        of a multiprocess database can still write in between. Does nothing
+        unless the database is threadsafe.
+        """
+
+        if self.lock is None:
+            yield self
+        else:
+            with self.lock.read():
+                yield self
+        
+    @reading
+    def select(self, string):
+        """
+        Input:
+        String can be a db.select("tagname"), db.select(".tagname"), or db.select("#tagname")
+        We can combine tags to create tag lists by using db.select(".tagname and .tagname")
+        Logical operaters to combine tags are and, or, xor, not. They can be mixed
+        and grouped with parentheses, as in db.select(".a and (#b or c) not d")
+        "not" binds tightest, then and, xor, or.
+
+        Compiled expressions are kept in an LRU cache keyed by the string.
+        
+        Output:
+        Either Tag() or TagList()
+        """
+
+        self.refresh()
+
+        plan = self.plans.get(string)
+        if plan is None:
+            plan = SelectPlan(string)
+            self.plans.put(string, plan)
+
+        # return Tag or TagList
+        if plan.tree[0] == "tag":
+            return self._select_single(*plan.leaves[0])
+
+        return TagList(plan=plan, leaves=[self._select_single(*leaf) for leaf in plan.leaves], db=self.TABLE)
+
+    @reading
+    def select_data(self, dataname):
+
+        self.refresh()
+        
+        data = self.TABLE.DATA.lookup(dataname)
+        return Data(eid=data.eid, db=self.TABLE) if data is not None else None
+          
+    @reading
+    def search(self, query, within=None, tags=False, limit=None):
+        """
+        Input:
+        db.search("python tutorial"), db.search("python", within="programming and .web"),
+        db.search("anim", tags=True, limit=10)
+
+        Ranks Data by BM25 over the words of their name, description and location,
+        or with tags=True, Tags by the words of their names. within keeps only those
+        under a Tag, a TagList, or the tags of a select() expression, combined with
+        its and, or, xor and not.
+
+        Output:
+        A generator of (Data or Tag, score), best first.
+        """
+
+        self.refresh()
+
+        eids = self._within(within, tags) if within is not None else None
+        scores = (self.TAGS if tags else self.DATA).text.score(query, eids)
+
+        best = lambda item: (-item[1], item[0])
+        if limit is not None:
+            ranked = heapq.nsmallest(limit, scores.items(), key=best)
+        else:
+            ranked = sorted(scores.items(), key=best)
+
+        kind = Tag if tags else Data
+
+        return ((kind(eid=eid, db=self), score) for eid, score in ranked)
+
+    @reading
+    def autocomplete(self, text, limit=10, fuzzy=True):
+        """
+        Input:
+        db.autocomplete("pyt"), db.autocomplete("pyhton", limit=5)
+
+        Suggests tags as text is typed: tags whose name starts with text, in name
+        order, then with fuzzy, if there are fewer than limit, tags whose name is
+        a few typos from text, closest first. Case is ignored and no documents are read.
+
+        Output:
+        A list of up to limit (displayname, children, eid). displayname has the
+        . or # of Tag.displayname, and children counts the tags and data in the tag.
+        """
+
+        self.refresh()
+
+        index = self.TAGS.prefixes
+        return [index.entry(eid) for eid in index.suggest(text, limit, fuzzy)]
+
+    def _within(self, within, tags=False):
+        """
+        Returns the set of tag eids (with tags) or data eids under within, a Tag,
+        a TagList or a select() expression.
+        """
+
+        under = self.CLOSURE.descendants if tags else self.CLOSURE.alldata
+        members = lambda tag: set(under.get(tag.eid, ())) if tag is not None else set()
+
+        if isinstance(within, basestring):
+            plan = self.plans.get(within)
+            if plan is None:
+                plan = SelectPlan(within)
+                self.plans.put(within, plan)
+
+            return plan.evaluate([members(self._select_single(*leaf)) for leaf in plan.leaves])
+
+        if isinstance(within, TagList):
+            if within.plan is not None:
+                return within.plan.evaluate([members(tag) for tag in within.leaves])
+
+            return self.reduce_sets(within.setoperator or "or", [members(tag) for tag in within]) or set()
+
+        return members(within)
+
+    @reading
+    def explain(self, expression, key="x"):
+        """
+        Input:
+        db.explain("a and (b or c)"), db.explain("#a and #b", key="&")
+
+        Runs db.select(expression).get(key) one step at a time: compiling the
+        expression, finding each tag in the name index, getting the ids of each tag,
+        every set operation in the order it runs, and loading the tables or tablecells
+        found. A single tag is explained as a TagList of that tag.
+
+        Output:
+        An Explain with each step's sizes, reads, scans, loads and time.
+        Explain.show() prints them.
+        """
+
+        self.refresh()
+
+        explain = Explain(expression, key)
+        events = ["read", "scan", "rehydrate"]
+
+        with self.instrument() as stats:
+
+            def run(step, detail, function, estimated=None, size=len):
+                before = [stats.total(event) for event in events]
+                start = default_timer()
+                value = function()
+                seconds = default_timer() - start
+                reads, scans, loads = [stats.total(event) - count for event, count in zip(events, before)]
+
+                explain.add(step, detail(value) if callable(detail) else detail, estimated,
+                            size(value) if value is not None else None, reads, scans, loads, seconds)
+                return value
+
+            cached = self.plans.get(expression)
+            plan = run("parse", lambda plan: "{0} {1}".format("cached" if cached else "compiled", plan),
+                       lambda: cached or SelectPlan(expression), size=lambda plan: None)
+            self.plans.put(expression, plan)
+
+            leaves = []
+            for tagclass, name in plan.leaves:
+                leaves.append(run("resolve",
+                                  lambda tag: "{0}{1} by name index: {2}".format(
+                                      tagclass or "", name, "eid {0}".format(tag.eid) if tag is not None else "not found"),
+                                  lambda: self._select_single(tagclass, name),
+                                  size=lambda tag: 1))
+
+            taglist = TagList(plan=plan, leaves=leaves, db=self)
+            members, tagclass = taglist._members(key)
+            field = "tables" if tagclass == "table" else "tablecells"
+            empty = Bitmap() if self.TAGS.bitmaps else set()
+
+            sets = []
+            for (tagclass_, name), tag in zip(plan.leaves, leaves):
+                if tag is None:
+                    detail = "{0}: not found, matches nothing".format(name)
+                    sets.append(run("members", detail, lambda: empty))
+                else:
+                    detail = lambda ids: "{0}.{1}{2}".format(
+                        tag, field, "" if ids is not None else ": wrong tag type, left out")
+                    sets.append(run("members", detail, lambda: members(tag)))
+
+            estimates = {"and": lambda left, right: min(left, right),
+                         "or": lambda left, right: left + right,
+                         "xor": lambda left, right: left + right,
+                         "not": lambda left, right: left}
+
+            if len(plan.operators()) == 1 and taglist.setoperator in ["and", "or", "xor"]:
+                op = taglist.setoperator
+                inputs = [ids for ids in sets if ids is not None]
+                sizes = sorted(len(ids) for ids in inputs) if op == "and" else [len(ids) for ids in inputs]
+                estimated = reduce(estimates[op], sizes) if sizes else None
+                ids = run(op, "{0} of {1} sets{2}, sizes {3}".format(
+                              op, len(inputs), ", smallest first" if op == "and" else "", sizes),
+                          lambda: self.reduce_sets(op, inputs), estimated)
+
+            else:
+                def evaluate(node):
+                    if node[0] == "tag":
+                        return sets[node[1]]
+
+                    left = evaluate(node[1])
+                    right = evaluate(node[2])
+
+                    if left is None:
+                        return right
+                    if right is None:
+                        return left
+
+                    return run(node[0], "{0} {1} {2}".format(len(left), node[0], len(right)),
+                               lambda: SelectPlan.OPERATIONS[node[0]](left, right),
+                               estimates[node[0]](len(left), len(right)))
+
+                ids = evaluate(plan.tree)
+
+            ids = ids if ids is not None else set()
+            kind = Table if tagclass == "table" else TableCell
+            explain.result = run("fetch", "{0} {1} by eid".format(len(ids), field),
+                                 lambda: [kind(eid=id, db=self) for id in ids])
+
+        return explain
+
+    def _select_single(self, tagclass=None, tagname=None):
+        """
+        Input: _select_single(tagname="tagname")
+        Output: Tag() matches a mix of categories and data.
+
+        Input: _select_single(".", "tagname")
+        Output: Tag() that only matches a categorytype.
+
+        Input: _select_single("#", "tagname")
+        Output: Tag() that only matches a datatype.
+
+        Input: _select_single("&", "tagname")
+        Output: TableCell()
+        """
+        
+        if tagclass == None or tagclass == "":
+            tagtype = None
+        elif tagclass == ".":
+            tagtype = "taglist"
+        elif tagclass == "#":
+            tagtype = "datalist"
+        elif tagclass == "&":
+            tagtype = "cell"
+
+        if tagtype != "cell":
+            tag = self.TABLE.TAGS.lookup(tagname)
+            return Tag(eid=tag.eid, db=self.TABLE) if tag != None and (tag['tagtype'] == tagtype or tagtype == None) else None
+        
+        else:
+            tablecell = self.TABLE.CELLS.lookup(tagname)
+            return TableCell(eid=tablecell.eid, db=self.TABLE) if tablecell != None else None
+
+    def _select_logical(self, logicalop, *tagnames):
+        """
+        Input: 
+        _select_logical(logicalop, "nameoftag1", "nameoftag2", ...)
+        
+        tagnames can start with "", ".", "#"
+        logicalop can be "and", "or", "xor", "not"
+        
+        Output: TagList()
+        """
+        if logicalop in ["and", "or", "xor", "not"]:
+            taglist = TagList([], logicalop, db=self.TABLE)
+
+            for tag in tagnames:
+                reg = re.match("([\.\#\&]?)(\w+)", tag)
+                gottag = self._select_single(reg.group(1), reg.group(2))
+                if gottag is not None:
+                    taglist.append(gottag)
+
+            return taglist
+
+    @writing
+    def insert_root(self, element):
+        
+        if isinstance(element, Tag):
+            tab = self.TABLE.TAGS
+            
+        elif isinstance(element, TableCell):
+            tab = self.TABLE.CELLS
+            
+        eid = tab.insert(element.__serialize__())
+        
+        element.eid = eid
+        element.TABLE = self
+       
+    def import_bulk(self, source, format=None):
+        """
+        Input:
+        db.import_bulk("bookmarks.html"), db.import_bulk("tags.json"), db.import_bulk(file, format="csv")
+        format is "json", "csv" or "html" (Netscape bookmark export), and is guessed
+        from the file extension when not given.
+
+        Builds the new tags, data, tablecells and tables in memory and writes
+        each table once inside a batch.
+
+        Output:
+        A dict with the number of tags, data, tablecells and tables created.
+        """
+
+        if isinstance(source, basestring):
+            if format is None:
+                format = source.rsplit(".", 1)[-1].lower()
+            with open(source) as file:
+                return self.import_bulk(file, format)
+
+        readers = {"json": BulkImport.read_json,
+                   "csv": BulkImport.read_csv,
+                   "html": BulkImport.read_html,
+                   "htm": BulkImport.read_html}
+
+        if format not in readers:
+            raise ValueError("Unknown import format: {0}".format(format))
+
+        bulk = BulkImport(self)
+
+        with self.batch():
+            for record in readers[format](source):
+                bulk.add(record)
+            bulk.write()
+
+        return bulk.counts()
+
+    def export_stream(self, destination=None, compress=None):
+        """
+        Input:
+        db.export_stream("backup.ndjson.gz"), db.export_stream(file, compress=True),
+        for line in db.export_stream(): ...
+        compress gzips the output, and is guessed from a .gz path when not given.
+
+        Writes every tag, data, tablecell and table as NDJSON, one element at a
+        time, so storages that load single documents, SQLiteStorage and LogStorage,
+        export in constant memory. See GraphStream for the records. The generator
+        takes no lock, and writes made while it runs may or may not be in it.
+
+        Output:
+        Without destination, a generator of NDJSON lines. Otherwise a dict with
+        the number of elements written from each table.
+        """
+
+        if destination is None:
+            return self._export_lines({})
+
+        if isinstance(destination, basestring):
+            with GraphStream.open(destination, "wb", compress) as file:
+                return self.export_stream(file)
+
+        if compress:
+            with gzip.GzipFile(fileobj=destination, mode="wb") as file:
+                return self.export_stream(file)
+
+        counts = {}
+
+        with self.snapshot():
+            for line in self._export_lines(counts):
+                destination.write(line)
+
+        return counts
+
+    def _export_lines(self, counts):
+
+        self.refresh()
+
+        yield GraphStream.header()
+
+        for tablename, attribute in GraphStream.TABLES:
+            counts[tablename] = 0
+            for eid, element in getattr(self, attribute).iter_elements():
+                counts[tablename] += 1
+                yield GraphStream.line(tablename, eid, element)
+
+    def import_stream(self, source, compress=None, remap=True):
+        """
+        Input:
+        db.import_stream("backup.ndjson.gz"), db.import_stream(file), db.import_stream(lines, remap=False)
+        source is a path, a file or any iterable of lines from export_stream().
+        compress reads gzip, and is guessed from the file when source is a path.
+
+        Writes the elements STREAM_CHUNK at a time per table inside one batch.
+        With remap, every eid, and every eid in taglist, datalist, tables,
+        tablecells, parent, parents, complex and tags, is moved past the last eid
+        of its table, so the import adds to what is there. Without it, elements
+        keep their eids and replace the ones they share them with.
+
+        Output:
+        A dict with the number of elements read into each table.
+        """
+
+        if isinstance(source, basestring):
+            with GraphStream.open(source, "rb", compress) as file:
+                return self.import_stream(file, remap=remap)
+
+        if compress:
+            with gzip.GzipFile(fileobj=source, mode="rb") as file:
+                return self.import_stream(file, remap=remap)
+
+        tables = dict((tablename, getattr(self, attribute)) for tablename, attribute in GraphStream.TABLES)
+        chunks = dict((tablename, {}) for tablename in tables)
+        counts = dict((tablename, 0) for tablename in tables)
+        header = None
+
+        with self.batch():
+            offsets = dict((tablename, table._last_id if remap else 0) for tablename, table in tables.items())
+
+            for line in source:
+                if not line.strip():
+                    continue
+
+                record = json.loads(line)
+
+                if header is None:
+                    GraphStream.check(record)
+                    header = record
+                    continue
+
+                tablename = record["table"]
+                element = record["element"]
+                if remap:
+                    element = GraphStream.remap(tablename, element, offsets)
+
+                chunk = chunks[tablename]
+                chunk[record["eid"] + offsets[tablename]] = element
+                counts[tablename] += 1
+
+                if len(chunk) >= self.STREAM_CHUNK:
+                    tables[tablename].write_elements(chunk)
+                    chunk.clear()
+
+            for tablename, chunk in chunks.items():
+                tables[tablename].write_elements(chunk)
+
+        return counts
+
+    @reading
+    def roots(self):
+        """
+        Returns all root categories.
+        """
+
+        self.refresh()
+
+        return [Tag(eid=tag.eid, db=self.TABLE) for tag in self.TABLE.TAGS.all() if tag['parenttype'] == None]
+
+    def show_roots(self):
+
+        for root in self.roots():
+            print "{}".format(root)
+
+    @contextmanager
+    def batch(self):
+        """
+        with db.batch():
+            ...
+
+        All writes made inside the block are kept in memory and written to storage
+        in one flush when the block exits. If an exception escapes, nothing is written
+        and the database is reloaded from storage. Nested batches join the outer one.
+        A threadsafe database holds the write lock for the whole block, and a
+        multiprocess one the file lock.
+        """
+
+        if self.lock is not None:
+            self.lock.acquire_write()
+
+        try:
+            with self.exclusive():
+                with self._batch():
+                    yield self
+        finally:
+            if self.lock is not None:
+                self.lock.release_write()
+
+    @contextmanager
+    def _batch(self):
+
+        self._batches += 1
+        if self._batches == 1:
+            # Fields staged before the batch, which a rollback must keep.
+            staged = [(table, deepcopy(table._staged)) for table in [self.TAGS, self.TABS, self.CELLS, self.DATA]]
+            self.ELEMENTS.record()
+            self._storage.begin()
+
+        try:
+            yield self
+
+        except:
+            self._batches -= 1
+            if self._batches == 0:
+                self._storage.rollback()
+                self._rollback(self.ELEMENTS.recorded(), staged)
+            raise
+
+        self._batches -= 1
+        if self._batches == 0:
+            self.ELEMENTS.recorded()
+            self.save()
+            self._storage.commit()
+
+    def _rollback(self, touched, staged):
+        """
+        Reloads from storage after a batch was rolled back and restores staged,
+        the (table, staged fields) from before it. Live objects the batch wrote
+        are synced back to their stored documents and put back in the identity
+        map, and those it created are dropped.
+        """
+
+        self.reload()
+
+        for table, fields in staged:
+            table._staged = fields
+
+        tables = {"tags": self.TAGS, "tables": self.TABS, "tablecells": self.CELLS, "data": self.DATA}
+        for (tablename, eid), element in touched:
+            if tables[tablename].get(eid=eid) is not None:
+                element.sync()
+                self.ELEMENTS.put((tablename, eid), element)
+
+    @writing
+    def reload(self, tables=None):
+        """
+        Drops cached objects and rebuilds table state from storage, of all
+        tables or only of those in tables.
+        """
+
+        if tables is None:
+            tables = [self.TAGS, self.TABS, self.CELLS, self.DATA]
+            self.ELEMENTS.clear()
+        else:
+            self.ELEMENTS.clear([table.name for table in tables])
+
+        for table in tables:
+            table.reload()
+
+    @writing
+    def save(self):
+        """
+        Writes any staged changes to storage.
+        """
+
+        for table in [self.TAGS, self.TABS, self.CELLS, self.DATA]:
+            table.flush()
+
+    def close(self):
+
+        self.save()
+        super(TinyTagsDB, self).close()
+
+        if self.filelock is not None:
+            self.filelock.close()
+
+        if self._pool is not None:
+            self._pool.shutdown()
+
+        TinyTagsDB.opened.discard(self)
+
+
+class NamedComplex(object):
+    """
+    A NamedComplex is made up of a name and a Complex.
+    """
+
+    __slots__ = ()
+    
+    def __init__(self, name=None, complex=None):
+        
+        self.name = name
+        self.complex = [] if complex == None else complex
+        self.parent = False
+        self.type = None
+
+    def search(self, filter):
+        """
+        Returns the data under this tag, or under every tag of this tablecell,
+        that has the words of filter, best first.
+        """
+
+        within = self if isinstance(self, Tag) else TagList(self.get("^"), "and", db=self.TABLE)
+
+        return [data for data, score in self.TABLE.search(filter, within=within)]
+
+    @writing
+    def rename(self, name):
+        
+        self.name = name
+        
+        if self.eid is not None:
+            
+            if isinstance(self, Tag):
+                table = self.TABLE.TAGS
+                
+            elif isinstance(self, TableCell):
                 table = self.TABLE.CELLS
-                l = TagList(c)
-
-                # Check to see if tablecell already exists in database and put it into the tablecells
-                dbcell = table.get((Query().complex.all(c)) & (Query().complex.test(len_match, len(c))))
-                if dbcell is not None:
-                    tablecell = TableCell(eid=dbcell.eid)
-                    tablecell.complex = l
-                    table.update({"complex": c}, eids=[dbcell.eid])
+                    
+            table.update({"name": self.name}, eids=[self.eid])
+
+
+class Id(object):
+
+    __slots__ = ()
+
+    # Attempts of update_id and remove_id when another process changed the element.
+    RETRIES = 20
+
+    # Database attribute of the table for each tablename.
+    TABLES = {"tags": "TAGS", "tables": "TABS", "tablecells": "CELLS"}
+
+    def __init__(self, namedcomplex=None):
+
+        self.eid = namedcomplex.eid
+
+    @property
+    def namedcomplex(self):
+        """
+        The stored document, read when it is used instead of kept as a copy.
+        """
+
+        if self.eid is None:
+            return None
+
+        return getattr(self.TABLE, self.TABLES[self.tablename]).get(eid=self.eid)
+
+    def show(self):
+        """
+        Return a numbered list of hashtags, categories, complex categories, and tables.
+        """
+
+        for key, value in self.namedcomplex.items():
+            print "{0}: {1}".format(key, value)
+        print "\r"
+
+    @writing
+    def update_type(self, type, table, eid):
+        
+        if eid == None:
+            return None
+
+        if table.stage({"tagtype": type}, eid):
+            self.sync()
+        else:
+            self.tagtype = type
+
+    @writing
+    def update_tag_parent(self, type, upeid, table, eid):
+
+        if eid == None:
+            return None
+
+        table.update({"parenttype": type}, eids=[eid])
+        
+        table.update({"parent": upeid}, eids=[eid])
+
+        self.sync()
+
+    @writing
+    def update_id(self, upeid, table, eid, key, sync=None):
+        """
+        Inserts upeid into table -> eid -> key, and then syncs the element.
+        """
+
+        if upeid == None:
+            return None
+
+        for attempt in xrange(self.RETRIES):
+            element = table.get(eid=eid)
+            e = element[key]
+            if upeid in e:
+                return
+
+            e.append(upeid)
+            try:
+                table.update_version({key: e}, eid, element.get('version'))
+            except ConflictError:
+                continue
+
+            if sync is not None: sync.sync()
+            return
+
+        raise ConflictError("Gave up adding {0} to {1} of element {2}.".format(upeid, key, eid))
+
+    @writing
+    def remove_id(self, upeid, table, eid, key, sync=None):
+        """
+        Deletes element from selected category in database.
+        """
+
+        for attempt in xrange(self.RETRIES):
+            element = table.get(eid=eid)
+            e = element[key]
+            if upeid not in e:
+                return
+
+            e.remove(upeid)
+            try:
+                table.update_version({key: e}, eid, element.get('version'))
+            except ConflictError:
+                continue
+
+            if sync is not None: sync.sync()
+            return
+
+        raise ConflictError("Gave up removing {0} from {1} of element {2}.".format(upeid, key, eid))
+
+            
+class Tag(NamedComplex, Id):
+
+    __metaclass__ = Rehydrate
+    tablename = "tags"
+
+    # No __dict__ and IdLists for the id lists, so large graphs fit in memory.
+    __slots__ = ("TABLE", "eid", "name", "complex", "type", "taglist", "datalist", "tables",
+                 "tablecells", "parent", "parenttype", "tagtype", "hastags", "displayname")
+    
+    def __init__(self, name=None, taglist=None, datalist=None, eid=None, db=None):
+
+        # Unsaved tags are bound to the database they are inserted into.
+        self.TABLE = TinyTagsDB.resolve(db) if eid != None or db != None else TinyTagsDB.only()
+
+        if eid != None:
+            NamedComplex.__init__(self)
+
+            self.eid = eid
+            self.sync()
+
+            # Loading happens in reads, so a stale stored tagtype is only
+            # written again by the next write to this tag.
+            self._derive_type()
+
+            
+        else:
+            NamedComplex.__init__(self, name)
+            
+            self.taglist = IdList(taglist if taglist != None else ())
+            self.datalist = IdList(datalist if datalist != None else ())
+            self.tables = IdList()
+            self.tablecells = IdList()
+            self.parent = None 
+            self.parenttype = None
+            self.eid = None
+
+            self.__update_type__()
+            
+    def __repr__(self):
+
+        return self.displayname
+
+    def __update_type__(self):
+
+        # The tagtype read from storage, if any.
+        stored = getattr(self, "tagtype", None)
+
+        self._derive_type()
+
+        # Only write tagtype when it differs from the stored document.
+        if self.eid is not None and stored != self.tagtype:
+            self.update_type(self.tagtype, self.TABLE.TAGS, self.eid)
+
+    def _derive_type(self):
+        """
+        Sets tagtype, hastags and displayname from the id lists.
+        """
+
+        if self.taglist != [] and self.datalist != []:
+            self.tagtype = None
+            self.hastags = True
+            self.displayname = "{0}".format(self.name)
+            
+        elif self.taglist != []:
+            self.tagtype = "taglist"
+            self.hastags = True
+            self.displayname = ".{0}".format(self.name)
+        
+        elif self.datalist != []:
+            self.tagtype = "datalist"
+            self.hastags = False
+            self.displayname = "#{0}".format(self.name)
+
+        else:
+            self.tagtype = None
+            self.hastags = False
+            self.displayname = "{0}".format(self.name)
+        
+    def __serialize__(self):
+
+        return {'name': self.name,
+                'taglist': list(self.taglist),
+                'datalist': list(self.datalist),
+                'tables': list(self.tables),
+                'tablecells': list(self.tablecells),
+                'tagtype': self.tagtype,
+                'parent': self.parent,
+                'parenttype': self.parenttype}
+
+    def sync(self, namedcomplex=None):
+
+        if namedcomplex is None:
+            namedcomplex = self.TABLE.TAGS.get(eid=self.eid)
+
+        self.name = namedcomplex['name']
+        self.taglist = IdList(namedcomplex['taglist'])
+        self.datalist = IdList(namedcomplex['datalist'])
+        self.tables = IdList(namedcomplex['tables'])
+        self.tablecells = IdList(namedcomplex['tablecells'])
+        self.tagtype = namedcomplex['tagtype']
+        self.parent = namedcomplex['parent']
+        self.parenttype = namedcomplex['parenttype']
+
+        # As stored, like tagtype, so __update_type__ can tell it changed.
+        self.hastags = self.taglist != []
+        self.displayname = {"taglist": ".", "datalist": "#"}.get(self.tagtype, "") + self.name
+        
+    @reading
+    def show(self):
+        
+        print self.displayname
+        
+        try:
+            for tag in self.get("^"):
+                print " "*4 + "Parent: {0}".format(str(tag))
+        except:
+            pass
+        
+        for cell in self.get("&"):
+            cell.show(tabs=1)
+
+        for tag in self.get():
+            if tag.get("^").eid not in [cell.eid for cell in self.get("&")]:
+                print " "*4 + "{}".format(tag)
+
+    @reading
+    def get(self, key=None):
+        """
+        Returns a list of tags, data, tables, or tablecells.
+        """
+
+        if self.eid is not None:
+            if key == "" or key == None:
+                return TagList([Tag(eid=id, db=self.TABLE) for id in self.taglist], db=self.TABLE)
+            
+            elif key == ".":
+                return TagList([tag for tag in self.get() if tag.tagtype == "taglist"], db=self.TABLE)
+            
+            elif key == "#":
+                return TagList([tag for tag in self.get() if tag.tagtype == "datalist"], db=self.TABLE)
+            
+            # To abstraction. Returns a list of parent categories that category belongs to.
+            elif key == "^" and self.parent != False:
+                if self.parenttype == "tag":
+                    return Tag(eid=self.parent, db=self.TABLE)
+                
+                elif self.parenttype == "cell":
+                    return TableCell(eid=self.parent, db=self.TABLE)
+            
+            elif key == "x" and self.tables != []:
+                return [Table(eid=id, db=self.TABLE) for id in self.tables]
+            
+            # Down to TableCells
+            elif key == "&":
+                return [TableCell(eid=id, db=self.TABLE) for id in self.tablecells]
+            
+            elif key == "d":
+                # Returns the data that is associated with this complex tag.
+                return [Data(eid=id, db=self.TABLE) for id in self.datalist]
+            
+    @reading
+    def descendants(self):
+        """
+        Returns every tag under this tag at any depth.
+        """
+
+        return TagList([Tag(eid=id, db=self.TABLE) for id in sorted(self.TABLE.CLOSURE.descendants.get(self.eid, ()))], db=self.TABLE)
+
+    @reading
+    def all_data(self):
+        """
+        Returns the data of this tag and of every tag under it.
+        """
+
+        return [Data(eid=id, db=self.TABLE) for id in sorted(self.TABLE.CLOSURE.alldata.get(self.eid, ()))]
+
+    def is_under(self, tag):
+        """
+        Returns True if this tag is under tag at any depth.
+        """
+
+        return tag.eid in self.TABLE.CLOSURE.ancestors.get(self.eid, ())
+
+    @writing
+    def insert(self, *args):
+        """
+        If selected gets eid and inserts into complex. If made from Category(),
+        enters into database and then enters into complex.
+        """
+
+        for element in args:
+            
+            if isinstance(element, Tag) and element.eid == None:
+
+                element.TABLE = self.TABLE
+            
+                # Insert HashTag into table hashtags.
+                eid = self.TABLE.TAGS.insert(element.__serialize__())
+
+                element.eid = eid
+
+                # Add tag element eid to this tag
+                self.update_id(eid, self.TABLE.TAGS, self.eid, "taglist", self)
+                
+                # Insert this Tag into element tag parent.
+                self.update_tag_parent("tag", self.eid, self.TABLE.TAGS, eid)
+            
+            elif isinstance(element, Data) and element.eid == None:
+
+                element.TABLE = self.TABLE
+            
+                # Insert Data into table data.
+                eid = self.TABLE.DATA.insert(element.__serialize__())
+                
+                # Add data element eid to this tag
+                self.update_id(eid, self.TABLE.TAGS, self.eid, "datalist", self)
+                
+                # Insert this Tag into element tag parent.
+                self.update_id(self.eid, self.TABLE.DATA, eid, "parents")
+        
+            # Set eid for category or hashtag.
+            elif element.eid is not None:
+
+                eid = element.eid
+
+                if isinstance(element, Tag):
+                    
+                    if element.parenttype == "tag":
+                        
+                        cell = TableCell(None, TagList([self.eid] + [element.parent], db=self.TABLE), db=self.TABLE)
+                        cell.insert_cell()
+                        
+                        self.update_tag_parent("cell", cell.eid, self.TABLE.TAGS, eid) 
+                        
+                    elif element.parenttype == "cell":
+                        
+                        cell = element.get("^")
+                        
+                        cell.insert(Tag(eid=self.eid, db=self.TABLE))
+                        cell.insert_cell()
+                        
+                    else:
+                        
+                        # Add this tag to element parent
+                        self.update_tag_parent("tag", self.eid, self.TABLE.TAGS, eid)
+ 
+                    # Add tag element eid to this parent tag
+                    self.update_id(eid, self.TABLE.TAGS, self.eid, "taglist", self)
+
+                elif isinstance(element, Data):
+                    # Add data element eid to this tag
+                    self.update_id(eid, self.TABLE.TAGS, self.eid, "datalist", self)
+
+                    # Add this tag eid into table data element parents.
+                    self.update_id(self.eid, self.TABLE.DATA, eid, "parents", element)
+                    
+        self.__update_type__()
+
+    @writing
+    def remove(self):
+        """
+        Deletes category and all it's children that have no other parent, with
+        the data, tables and tablecells left without a tag, in one batch.
+        Returns the number of elements removed from each table.
+        """
+
+        if self.eid != None:
+            return CascadingDelete(self.TABLE).tags([self.eid]).write()
+
+class TagList(list):
+    """
+    A TagList is made up of several Tags
+    """
+
+    def __init__(self, elementlist=None, op=None, plan=None, leaves=None, db=None):
+        """
+        A TagList from TinyTagsDB.select() has a compiled plan and leaves, the Tag
+        (or None when it wasn't found) for each tag in the expression.
+        Without db it uses the database of its first tag.
+        """
+
+        if db is None:
+            tags = leaves if leaves is not None else elementlist
+            db = next((tag.TABLE for tag in tags or [] if getattr(tag, "TABLE", None) is not None), None)
+
+        self.TABLE = TinyTagsDB.resolve(db)
+
+        if leaves is not None:
+            elementlist = [tag for tag in leaves if tag is not None]
+
+        self[:] = elementlist if elementlist is not None else []
+        
+        self.plan = plan
+        self.leaves = leaves
+
+        if plan is not None and op is None and len(plan.operators()) == 1:
+            op = list(plan.operators())[0]
+
+        self.setoperator = op
+        
+    def __repr__(self):
+        return "TagList({0})".format(self[:])
+    
+    def show(self):
+
+        print self
+
+    @reading
+    def get(self, key):
+        """
+        Returns tables and tablecells that are related to tags in this TagList.
+
+        Input:
+        TagList().get(key)
+        key is either TagList().get("x") for all tables, 
+                      TagList().get(".x") for tables that hold categories, 
+                      TagList().get("#x") for tables that hold data,
+                      TagList().get("&") for tablecells.
+
+        Logical operaters that are used with you use TinyTagsDB.select()
+        will be used to find relations among tags.
+        
+        Output:
+        A list of Table() or TableCell()
+        """
+
+        tags = self.TABLE.TAGS
+        members, tagclass = self._members(key)
+
+        if self.plan is not None:
+            # Tags that weren't found match nothing.
+            empty = Bitmap() if tags.bitmaps else set()
+            sets = [members(tag) if tag is not None else empty for tag in self.leaves]
+
+            # A chain of one operator can be split up; left out leaves are None.
+            if len(self.plan.operators()) == 1 and self.setoperator in ["and", "or", "xor"]:
+                ids = self.TABLE.reduce_sets(self.setoperator, [ids for ids in sets if ids is not None])
+            else:
+                ids = self.plan.evaluate(sets)
+
+        else:
+            sets = [ids for ids in [members(tag) for tag in self[:]] if ids is not None]
+            ids = self.TABLE.reduce_sets(self.setoperator, sets)
+
+        ids = ids if ids is not None else set()
+
+        # Return a list of tables or tablecells that match 
+        if tagclass == "table":
+            return [Table(eid=id, db=self.TABLE) for id in ids]
+        elif tagclass == "cell":
+            return [TableCell(eid=id, db=self.TABLE) for id in ids]
+
+    def _members(self, key):
+        """
+        Returns a function giving the ids of a tag that TagList.get(key) uses,
+        or None for tags of the wrong type, and "table" or "cell".
+        """
+
+        # Choose which ids of a tag to use. Tags of the wrong type are left out.
+        tags = self.TABLE.TAGS
+        if key == "x":
+            members = lambda tag: tags.members(tag.eid, "tables", tag.tables)
+            tagclass = "table"
+        elif key == ".x":
+            members = lambda tag: tags.members(tag.eid, "tables", tag.tables) if tag.tagtype == "taglist" else None
+            tagclass = "table"
+        elif key == "#x":
+            members = lambda tag: tags.members(tag.eid, "tables", tag.tables) if tag.tagtype == "datalist" else None
+            tagclass = "table"
+        elif key == "&":
+            members = lambda tag: tags.members(tag.eid, "tablecells", tag.tablecells) if tag.tagtype == "datalist" else None
+            tagclass = "cell"
+        else:
+            raise ValueError("Unknown key for TagList.get(): {0}".format(key))
+
+        return members, tagclass
+
+    @reading
+    def join(self):
+        """
+        To complexity. Returns a complex table of two or more dimensions.
+        This applies to the elements and creates a number of complex words
+        If a category list is put into a category it becomes a supercategory.
+        This applies to the category names and works to better organize
+        repeating elemenets in categories and specifiy category names.
+        Uses tables and set operations to combine elements. If it affects
+        the name then do set operations to merge the elements. This creates
+        a table where the table cells are a complex name with a list of
+        elements that the class is made up of.
+        """
+        
+        return Table(self, db=self.TABLE).join()
+
+    
+class Data(object):
+
+    __metaclass__ = Rehydrate
+    tablename = "data"
+
+    __slots__ = ("TABLE", "eid", "name", "description", "location", "parents")
+
+    def __init__(self, name=None, description=None, location=None, eid=None, db=None):
+
+        self.TABLE = TinyTagsDB.resolve(db) if eid != None or db != None else TinyTagsDB.only()
+
+        if eid != None:
+            self.eid = eid
+            self.sync()
+            
+        else:
+            self.name = name
+            self.description = description
+            self.location = location
+            self.parents = IdList()
+            self.eid = None
+        
+    def __repr__(self):
+
+        return 'Data("{0}")'.format(self.name)
+    
+    def __serialize__(self):
+        
+        return {'name': self.name,
+                'description': self.description,
+                'location': self.location,
+                'parents': list(self.parents)}
+
+    def sync(self, data=None):
+        
+        if data is None:
+            data = self.TABLE.DATA.get(eid=self.eid)
+        
+        self.name = data['name']
+        self.description = data['description']
+        self.location = data['location']
+        self.parents = IdList(data['parents'])
+
+    def is_under(self, tag):
+        """
+        Returns True if this data is in tag or in any tag under it.
+        """
+
+        return tag.eid in self.TABLE.CLOSURE.dataancestors.get(self.eid, ())
+
+    def show(self):
+        
+        print "Name: {0}\nDescription: {1}\nLocation: {2}\r".format(self.name, self.description, self.location)
+
+    @writing
+    def remove(self):
+        """
+        Deletes this data and takes it out of its tags.
+        """
+
+        if self.eid != None:
+            return CascadingDelete(self.TABLE).data([self.eid]).write()
+
+
+class Table(list, Id):
+
+    __metaclass__ = Rehydrate
+    tablename = "tables"
+    
+    def __init__(self, tags=None, tablecell=None, eid=None, db=None):
+
+        if db is None and tags:
+            db = tags.TABLE if isinstance(tags, TagList) else tags[0].TABLE
+
+        self.TABLE = TinyTagsDB.resolve(db)
+        
+        self.name = ""
+        self.eid = None
+        self.tablecell = tablecell
+        self[:] = [tablecell] if tablecell != None else []
+        self.joined = False
+        self.type = None
+
+        if tags != None:
+            self.categorylist = tags
+            self.tags = [category.eid for category in tags]
+            self.length = len(self.tags)
+            self.categorylisthastags = []
+            
+            for tag in self.categorylist:
+                if tag.hastags == True:
+                    self.categorylisthastags.append(tag)
+            self.categorylist = self.categorylisthastags
+            
+            for tag in self.categorylist:
+                if tag == self.categorylist[0]:
+                    self.name += tag.name
+                else:
+                    self.name += " x {0}".format(tag.name)
+           
+
+        if eid == None:
+            eid = self.TABLE.TABS.combos.get(self.tags) if tags != None else None
+            self.table = self.TABLE.TABS.get(eid=eid) if eid != None else None
+                
+        else:
+            self.table = self.TABLE.TABS.get(eid=eid)
+
+        if self.table != None:
+
+            self.name = self.table['name']
+            self.tags = self.table['tags']
+            self[:] = self.table['tablecells']
+            self.eid = self.table.eid
+            
+    def __repr__(self):
+        
+        return self.name
+    
+    def __serialize__(self):
+        
+        # Cells are TableCells after a join and eids otherwise.
+        tablecells = [getattr(tablecell, "eid", tablecell) for tablecell in self[:]]
+        tablecells = [eid for eid in tablecells if eid != None]
+
+        self.dict = {'name': self.name,
+                    'tags': self.tags,
+                    'tablecells': tablecells,
+                    'type': self.type}
+        
+        return self.dict
+    
+    def sync(self, table=None):
+        
+        self.table = table if table is not None else self.TABLE.TABS.get(eid=self.eid)
+        
+        self.name = self.table['name']
+        self.tags = self.table['tags']
+        self[:] = self.table['tablecells']
+        
+    def show(self):
+        
+        print "Name:", self.name
+        print "Tags:", self.tags
+        print "Cells:", self[:]
+        print "Eid:", self.eid
+        
+    def _ylength(self):
+        
+        self.repeateach = []
+        self.repeattotal = []
+
+        lengths = []
+        for category in self.categorylist:
+            lengths.append(len(category.taglist))
+
+        multiply = list(reversed(lengths))
+        
+        while True:
+            multiply.pop()
+            if len(multiply) == 0:
+                self.repeateach.append(1)
+                break
+            self.repeateach.append(reduce(lambda x, y: x*y, multiply))
+        multiply = list(lengths)
+        while True:
+            multiply.pop()
+            if len(multiply) == 0:
+                self.repeattotal.append(1)
+                break
+            self.repeattotal.append(reduce(lambda x, y: x*y, multiply))
+        self.repeattotal = list(reversed(self.repeattotal))
+        
+        return zip(self.repeateach, self.repeattotal)
+
+    def _axes(self):
+        """
+        Returns the child tag eids along each dimension of the table.
+        """
+
+        if not hasattr(self, "categorylist"):
+            self.categorylist = [tag for tag in [Tag(eid=id, db=self.TABLE) for id in self.tags] if tag.hastags]
+
+        return [list(category.taglist) for category in self.categorylist]
+
+    def _cell(self, complex):
+        """
+        Returns the TableCell for complex, unsaved if it isn't in the database yet.
+        """
+
+        eid = self.TABLE.CELLS.combos.get(complex)
+
+        if eid is not None:
+            return TableCell(eid=eid, db=self.TABLE)
+
+        return TableCell(None, TagList(complex, db=self.TABLE), db=self.TABLE)
+
+    def size(self):
+        """
+        Returns the number of cells in the join of this table.
+        """
+
+        axes = self._axes()
+
+        return reduce(lambda x, y: x*y, [len(axis) for axis in axes]) if axes != [] else 0
+
+    def cell(self, index):
+        """
+        Returns the cell in row index of the join.
+        """
+
+        axes = self._axes()
+        repeateach = [each for each, total in self._ylength()]
+
+        return self._cell([axis[(index // each) % len(axis)] for axis, each in zip(axes, repeateach)])
+
+    def cell_at(self, coordinates):
+        """
+        Returns the cell at coordinates, the position of a child tag along each dimension.
+        Table.cell_at([0, 1]) is the first child of tag 1 & the second child of tag 2.
+        """
+
+        return self._cell([axis[position] for axis, position in zip(self._axes(), coordinates)])
+
+    def cells(self, start=0, stop=None):
+        """
+        Yields the cells of the join from row start up to row stop, one at a time.
+        Cells that aren't in the database are made as unsaved TableCells
+        when they are reached, and saved with TableCell.insert_cell().
+        """
+
+        axes = self._axes()
+        repeateach = [each for each, total in self._ylength()]
+        size = self.size()
+        stop = size if stop is None else min(stop, size)
+
+        for complex in join_rows(axes, repeateach, start, stop):
+            yield self._cell(complex)
+
+    @reading
+    def cell_eids(self, start=0, stop=None):
+        """
+        Returns an array of the eid of the saved tablecell of each row of the join
+        from row start up to row stop, or 0 for rows whose cell isn't saved.
+        With workers, large joins are split across the process pool.
+        """
+
+        size = self.size()
+        stop = size if stop is None else min(stop, size)
+        if stop <= start:
+            return array("i")
+
+        repeateach = [each for each, total in self._ylength()]
+
+        return self.TABLE.join_cells(self._axes(), repeateach, start, stop)
+
+    @reading
+    def page(self, number, size=50):
+        """
+        Returns page number of the join, counting from 0, with size cells per page.
+        """
+
+        return list(self.cells(number * size, (number + 1) * size))
+
+    @reading
+    def join(self):
+        """
+        Returns the join of this table as a Join, a sequence of its cells made only
+        as they are reached, so large joins never sit in memory at once.
+        """
+
+        self.joined = True
+
+        return Join(self)
+    
+    @reading
+    def select_cells(self, tag, childtagname):
+        """
+        Return a row or column of cells.
+        
+        Input: Table.select_cells(int tag, string childtagname)
+        
+        If you have four cells
+        child1 and child2 are in tag number 1
+        child3 and child4 are in tag number 2
+            child1 & child3
+            child1 & child4
+            child2 & child3
+            child2 & child4
+        Table.select_cells(1, "child1")
+        This will return all cells from parent tag 1 with child, "child1"
+        So child1 & child3, and child1 & child4
+        """
+
+        axes = self._axes()
+        names = [Tag(eid=id, db=self.TABLE).name for id in axes[tag-1]]
+
+        if childtagname not in names:
+            return []
+
+        positions = [xrange(len(axis)) for axis in axes]
+        positions[tag-1] = [names.index(childtagname)]
+
+        return [self.cell_at(coordinates) for coordinates in product(*positions)]
+    
+    @writing
+    def insert_table(self):
+        
+        if self.table == None:
+            
+            # Insert table into database.
+            eid = self.TABLE.TABS.insert(self.__serialize__())
+            self.eid = eid
+
+            for tag in self.tags:
+                # Insert this table eid into parent categories.
+                self.update_id(eid, self.TABLE.TAGS, tag, "tables")
+
+        # Insert new tablecell id into this table.
+        if self.tablecell != None and self.table != None:
+            self.update_id(self.tablecell, self.TABLE.TABS, self.table.eid, "tablecells", self)
+        elif self.tablecell != None and self.table == None:
+            self.update_id(self.tablecell, self.TABLE.TABS, eid, "tablecells")
+
+        # If tablecell is in database, Update table to include all eids in tablecells
+        # If tablcell has no eid, then update_id will return None
+        tablecells = [getattr(tablecell, "eid", tablecell) for tablecell in self[:]]
+        for id in tablecells:
+            self.update_id(id, self.TABLE.TABS, self.eid, "tablecells", self)
+
+    @writing
+    def remove(self):
+        """
+        Deletes this table and its cells in one batch.
+        """
+
+        if self.eid != None:
+            return CascadingDelete(self.TABLE).tables([self.eid]).write()
+    
+    def get(self, key):
+        
+        if key == "^":
+            # Returns the parent Tags that Table belongs to.
+            return TagList([Tag(eid=id, db=self.TABLE) for id in self.tags], db=self.TABLE)
+        
+        if key == "&":
+            # Returns the table cells.
+            if self.joined == True:
+                return Join(self)
+            else:
+                return [TableCell(eid=id, db=self.TABLE) for id in self[:]]
+
+
+class Join(object):
+    """
+    The cells of Table.join() as a sequence. len() is Table.size(), join[i] is
+    Table.cell(i), slices and iterating go through Table.cells(), and each cell is
+    made when it is reached. Other attributes are those of the table.
+    """
+
+    def __init__(self, table):
+
+        self.table = table
+
+    def __len__(self):
+
+        return self.table.size()
+
+    def __iter__(self):
+
+        return self.table.cells()
+
+    def __getitem__(self, index):
+
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step == 1:
+                return list(self.table.cells(start, stop))
+            return [self.table.cell(row) for row in xrange(start, stop, step)]
+
+        size = len(self)
+        row = index + size if index < 0 else index
+        if not 0 <= row < size:
+            raise IndexError("Join index {0} out of range for {1} cells.".format(index, size))
+
+        return self.table.cell(row)
+
+    def __getattr__(self, name):
+
+        return getattr(self.table, name)
+
+    def __repr__(self):
+
+        return repr(self.table)
+
+
+class TableCell(NamedComplex, Id):
+
+    __metaclass__ = Rehydrate
+    tablename = "tablecells"
+
+    __slots__ = ("TABLE", "eid", "name", "complex", "parent", "type", "tags", "elementqueue")
+
+    def __init__(self, name=None, complex=None, eid=None, db=None):
+
+        if db is None and isinstance(complex, TagList):
+            db = complex.TABLE
+
+        self.TABLE = TinyTagsDB.resolve(db)
+        
+        if eid != None:
+            self.eid = eid
+            self.sync()
+
+        else:
+            NamedComplex.__init__(self, name, complex)
+            
+            self.tags = IdList()
+
+            # if no complex, set type to None
+            # else, get all the types of the tags.
+            if complex == None:
+                types = []
+            else:
+                types = [tag.tagtype for tag in complex if not isinstance(tag, int)]
+
+            # if all tag types are the same, set tablecell type to taglist or datalist,
+            # else set tablecell type to mix
+            if types != [] and all(x == types[0] for x in types):
+                self.type = types[0]
+            elif types == []:
+                self.type = None
+            else:
+                self.type = "mix"
+                
+            self.eid = None
+
+        if self.type == "taglist":
+            symbol = "." 
+        elif self.type == "datalist":
+            symbol = "#"
+        else:
+            symbol = ""
+
+        if self.name == None:
+            self.name = ""
+            tags = self.get("^")
+            for tag in tags:
+                if tag == tags[0]:
+                    self.name += tag.name    
+                else:
+                    self.name += " {0}& {1}".format(symbol, tag.name)
+        else:
+            self.name += "{0}&{1}".format(symbol, self.name)
+            
+        self.elementqueue = []
+            
+    def __repr__(self):
+        
+        return self.name
+        
+    def __serialize__(self):
+        
+        return {'name': self.name,
+                'complex': [getattr(tag, "eid", tag) for tag in self.complex],
+                'tags': list(self.tags),
+                'type': self.type}
+    
+    def sync(self, namedcomplex=None):
+        if namedcomplex is None:
+            namedcomplex = self.TABLE.CELLS.get(eid=self.eid)
+        self.complex = IdList(namedcomplex['complex'])
+
+        Id.__init__(self, namedcomplex)
+        self.name = namedcomplex['name']
+        self.tags = IdList(namedcomplex['tags'])
+        self.type = namedcomplex['type']
+        
+    @reading
+    def show(self, tabs=0):
+        cellstring = ""
+        for num, cat in enumerate(self.get("^")):
+            if num == 0:
+                cellstring += "{}".format(cat)
+            else:
+                cellstring += " & {}".format(cat)
+        print " "*4*tabs + cellstring
+        for cat in self.get("^")[1:]:
+            print " "*4*(tabs+1) + "Parent: {}".format(cat)
+        for cat in self.get("and"):
+            print " "*4*(tabs+1) + "{}".format(cat)
+        for hash in self.get("dand"):
+            print " "*4*(tabs+1) + "{}".format(hash)
+        
+    def insert(self, element):
+        """
+        If selected gets eid and inserts into complex. If made from Category(),
+        enters into database and then enters into complex.
+        """
+            
+        if element.eid is not None:
+
+            self.elementqueue.append(element)
+            
+        else:
+            raise LookupError("Must use TinyTagsDB.select() to insert Category or HashTag.")
+
+    @writing
+    def insert_cell(self):
+        if self.eid == None:
+
+            # Reuse the tablecell of the same tags if there is one.
+            self.eid = self.TABLE.CELLS.combos.get(self.complex)
+            if self.eid == None:
+                self.eid = self.TABLE.CELLS.insert(self.__serialize__())
+            self.elementqueue = TagList([Tag(eid=id, db=self.TABLE) for id in self.complex], db=self.TABLE)
+
+        try:
+            for element in self.elementqueue:
+                
+                # Insert eid of element Tag into this table cell key complex
+                self.update_id(element.eid, self.TABLE.CELLS, self.eid, "complex", self)
+
+                # Goto Tag and insert eid for this tablecell into Tag key tablecells.
+                self.update_id(self.eid, self.TABLE.TAGS, element.eid, "tablecells", element)
+                    
+            self.elementqueue = []
+            
+        except:
+            pass
+        
+        # Lookup Tags of this tablecells, and find tags parent categories.
+        tags = TagList([Tag(eid=id, db=self.TABLE).get("^") for id in self.complex], db=self.TABLE)
+
+        # Insert Table
+        Table(tags=tags, tablecell=self.eid, db=self.TABLE).insert_table()
+
+    @writing
+    def remove(self):
+        """
+        Deletes this tablecell, and its table if it was the last cell, in one batch.
+        """
+
+        if self.eid != None:
+            return CascadingDelete(self.TABLE).cells([self.eid]).write()
+        
+    @reading
+    def get(self, key):
+        
+        complex = [getattr(tag, "eid", tag) for tag in self.complex]
+            
+        if key == "^":
+            # Returns the parent tags that TableCell belong to.
+            return TagList([Tag(eid=id, db=self.TABLE) for id in complex], db=self.TABLE)
+            
+        elif key == ".":
+            # To abstraction. Returns a list of categories that the tablecell belong to.
+            pass
+
+        elif key == "and":
+            # Returns common child categories of tablecell categories.
+            if self.type == "taglist":
+                sets = [self.TABLE.TAGS.members(id, "taglist") for id in complex]
+                # Uses a set operation. Returns a list of data.
+                ids = self.TABLE.reduce_sets("and", sets)
+                return [Tag(eid=id, db=self.TABLE) for id in ids]
+            else:
+                return []
+
+        elif key == "dand":
+            # Returns the data that is associated with this complex tag.
+            if self.type == "datalist":
+                sets = [self.TABLE.TAGS.members(id, "datalist") for id in complex]
+                # Uses a set operation. Returns a list of data.
+                dataids = self.TABLE.reduce_sets("and", sets)
+                return [Data(eid=id, db=self.TABLE) for id in dataids]
+            else:
+                return []
+
+
+class CascadingDelete(object):
+    """
+    Removes tags, data, tables and tablecells for the remove() methods, along with
+    everything left without a parent, and drops their eids from the id lists and
+    parents that point at them.
+
+    Tags under a removed tag go too, unless they still have a parent outside it.
+    Data goes when it has no tag left, tables when a tag of theirs or their last
+    cell goes, and tablecells when a tag of their complex or their table goes.
+    A tag whose parent tablecell goes takes the first remaining tag of that
+    tablecell as its parent.
+
+    Each document is read once, and everything is written in one batch.
+    """
+
+    TABLES = {"tags": "TAGS", "data": "DATA", "tables": "TABS", "tablecells": "CELLS"}
+
+    def __init__(self, db):
+
+        self.TABLE = db
+
+        # eid -> working copy of every document read, per table
+        self.documents = dict((tablename, {}) for tablename in self.TABLES)
+
+        # Elements asked to be removed, as (tablename, eids)
+        self.requested = []
+
+        # Eids to remove, and eids of kept documents that changed, per table
+        self.removed = dict((tablename, set()) for tablename in self.TABLES)
+        self.changed = dict((tablename, set()) for tablename in self.TABLES)
+
+    def _get(self, tablename, eid):
+        """
+        Returns the working copy of a document, or None if there is none.
+        """
+
+        documents = self.documents[tablename]
+
+        if eid not in documents:
+            element = getattr(self.TABLE, self.TABLES[tablename]).get(eid=eid)
+            documents[eid] = dict(element) if element is not None else None
+
+        return documents[eid]
+
+    def _drop(self, tablename, eid, key, ids):
+        """
+        Takes ids out of the list key of a document that is kept.
+        """
+
+        document = self._get(tablename, eid)
+
+        if document is not None and eid not in self.removed[tablename]:
+            kept = [id for id in document[key] if id not in ids]
+            if len(kept) != len(document[key]):
+                document[key] = kept
+                self.changed[tablename].add(eid)
+
+    def _parents(self, eid):
+        """
+        Returns the eids of the tags a tag is under.
+        """
+
+        document = self._get("tags", eid)
+
+        if document['parenttype'] == "tag":
+            return [document['parent']]
+
+        elif document['parenttype'] == "cell":
+            cell = self._get("tablecells", document['parent'])
+            return list(cell['complex']) if cell is not None else []
+
+        return []
+
+    def tags(self, eids):
+
+        self.requested.append(("tags", list(eids)))
+
+        return self
+
+    def data(self, eids):
+
+        self.requested.append(("data", list(eids)))
+
+        return self
+
+    def tables(self, eids):
+
+        self.requested.append(("tables", list(eids)))
+
+        return self
+
+    def cells(self, eids):
+
+        self.requested.append(("tablecells", list(eids)))
+
+        return self
+
+    def _tags(self, eids):
+
+        # Every tag under eids ...
+        found = set()
+        stack = list(eids)
+        while stack:
+            eid = stack.pop()
+            if eid not in found and self._get("tags", eid) is not None:
+                found.add(eid)
+                stack.extend(self._get("tags", eid)['taglist'])
+
+        # ... less those with a parent that stays, and then the tags under those.
+        changed = True
+        while changed:
+            changed = False
+            for eid in found - set(eids):
+                if not set(self._parents(eid)) <= found:
+                    found.discard(eid)
+                    changed = True
+
+        self.removed["tags"] |= found
+
+    def _cell_tables(self, eid):
+        """
+        Returns the eids of the tables that may hold tablecell eid, the tables of the
+        parents of its tags.
+        """
+
+        tables = set()
+
+        for tag in self._get("tablecells", eid)['complex']:
+            document = self._get("tags", tag)
+            if document is not None and document['parenttype'] == "tag":
+                parent = self._get("tags", document['parent'])
+                if parent is not None:
+                    tables.update(parent['tables'])
+
+        return tables
+
+    def _collect(self):
+        """
+        Adds the requested elements and everything left without a parent to the removed eids.
+        """
+
+        for tablename, eids in self.requested:
+            if tablename == "tags":
+                self._tags(eids)
+            else:
+                self.removed[tablename].update(eids)
+
+        tags, data, tables, cells = [self.removed[name] for name in ["tags", "data", "tables", "tablecells"]]
+
+        for eid in tags:
+            document = self._get("tags", eid)
+            tables.update(document['tables'])
+            cells.update(document['tablecells'])
+
+            for id in document['datalist']:
+                element = self._get("data", id)
+                if element is not None and set(element['parents']) <= tags:
+                    data.add(id)
+
+        for eid in list(tables):
+            if self._get("tables", eid) is not None:
+                cells.update(self._get("tables", eid)['tablecells'])
+
+        # Tables whose last cell goes
+        for eid in list(cells):
+            for table in self._cell_tables(eid):
+                document = self._get("tables", table)
+                if document is not None and eid in document['tablecells'] and set(document['tablecells']) <= cells:
+                    tables.add(table)
+
+        for name in self.removed:
+            self.removed[name] = set(eid for eid in self.removed[name] if self._get(name, eid) is not None)
+
+    def _unlink(self):
+        """
+        Drops removed eids from the documents that are kept.
+        """
+
+        tags, data, tables, cells = [self.removed[name] for name in ["tags", "data", "tables", "tablecells"]]
+
+        for eid in tags:
+            document = self._get("tags", eid)
+
+            for parent in self._parents(eid):
+                self._drop("tags", parent, 'taglist', tags)
+
+            for id in document['datalist']:
+                self._drop("data", id, 'parents', tags)
+
+        for eid in data:
+            for tag in self._get("data", eid)['parents']:
+                self._drop("tags", tag, 'datalist', data)
+
+        for eid in tables:
+            for tag in self._get("tables", eid)['tags']:
+                self._drop("tags", tag, 'tables', tables)
+
+        for eid in cells:
+            complex = self._get("tablecells", eid)['complex']
+            remaining = [tag for tag in complex if tag not in tags]
+
+            for tag in remaining:
+                self._drop("tags", tag, 'tablecells', cells)
+
+                # Tags under this tablecell move to the first tag left in it.
+                for child in self._get("tags", tag)['taglist']:
+                    document = self._get("tags", child)
+                    if (child not in tags and document is not None and
+                            document['parenttype'] == "cell" and document['parent'] == eid):
+                        document['parent'] = remaining[0]
+                        document['parenttype'] = "tag"
+                        self.changed["tags"].add(child)
+
+            for table in self._cell_tables(eid):
+                self._drop("tables", table, 'tablecells', cells)
+
+    def write(self):
+        """
+        Removes the requested elements and those left without a parent, and writes
+        the documents that changed, one write per table. Reads and writes all run
+        in one batch, so storage is read once and flushed once.
+        Returns the number of elements removed from each table.
+        """
+
+        with self.TABLE.batch():
+            self._collect()
+            self._unlink()
+
+            for eid in self.changed["tags"]:
+                document = self._get("tags", eid)
+                if document['taglist'] != [] and document['datalist'] != []:
+                    document['tagtype'] = None
+                elif document['taglist'] != []:
+                    document['tagtype'] = "taglist"
+                elif document['datalist'] != []:
+                    document['tagtype'] = "datalist"
                 else:
-                    tablecell = TableCell(None, TagList(c))
+                    document['tagtype'] = None
+
+            for tablename, attribute in self.TABLES.items():
+                table = getattr(self.TABLE, attribute)
+                removed = self.removed[tablename]
+
+                if removed:
+                    table.remove(eids=sorted(removed))
+
+                table.write_elements(dict((eid, self._get(tablename, eid)) for eid in self.changed[tablename]
+                                          if eid not in removed))
+
+        return dict((tablename, len(eids)) for tablename, eids in self.removed.items())
+
+
+class BulkImport(object):
+    """
+    Builds tags, data, tablecells and tables for TinyTagsDB.import_bulk() in memory.
+
+    Records are tuples:
+    ("tag", path), ("data", paths, name, description, location), ("cell", paths)
+    where a path is a tuple of tag names starting at a root tag.
+    """
+
+    def __init__(self, db):
+
+        self.TABLE = db
+
+        # eid -> document of every new or changed element, per table
+        self.tags = {}
+        self.data = {}
+        self.cells = {}
+        self.tables = {}
+
+        # Eids of elements created by this import
+        self.created = {"tags": set(), "data": set(), "tablecells": set(), "tables": set()}
+
+        # path -> tag eid, and tag eid -> {child name: eid}
+        self.paths = {}
+        self.children = {}
+
+        # (tag eid, data eid) memberships already made
+        self.members = set()
+
+        # (name, location) -> data eid, so the same bookmark in two folders, or
+        # already in the database, is one Data
+        self.seen = {}
+
+        # Canonical tag combination -> eid of tablecells and tables made by this import
+        self.cellcombos = {}
+        self.tablecombos = {}
+
+    def add(self, record):
+
+        if record[0] == "tag":
+            self.tag(record[1])
+
+        elif record[0] == "data":
+            self.add_data(*record[1:])
+
+        elif record[0] == "cell":
+            self.cell(record[1])
+
+    def _tag(self, eid):
+        """
+        Returns the working copy of a tag document.
+        """
+
+        if eid not in self.tags:
+            self.tags[eid] = dict(self.TABLE.TAGS.get(eid=eid))
+
+        return self.tags[eid]
+
+    def tag(self, path):
+        """
+        Returns the eid of the tag at path, creating it and its parents if needed.
+        """
+
+        path = tuple(path)
+
+        if path in self.paths:
+            return self.paths[path]
+
+        name = path[-1]
+
+        if len(path) == 1:
+            parent = None
+            existing = [eid for eid in self.TABLE.TAGS.lookup_eids(name)
+                        if self._tag(eid)['parenttype'] == None]
+            eid = existing[0] if existing else None
+
+        else:
+            parent = self.tag(path[:-1])
+            if parent not in self.children:
+                self.children[parent] = dict((self._tag(id)['name'], id) for id in self._tag(parent)['taglist'])
+            eid = self.children[parent].get(name)
+
+        if eid is None:
+            eid = self.TABLE.TAGS._get_next_id()
+            self.created["tags"].add(eid)
+
+            document = Tag(name).__serialize__()
+            if parent is not None:
+                document['parent'] = parent
+                document['parenttype'] = "tag"
+                self._tag(parent)['taglist'].append(eid)
+                self.children[parent][name] = eid
+            self.tags[eid] = document
+
+        self.paths[path] = eid
+
+        return eid
+
+    def add_data(self, paths, name, description, location):
+
+        # Data outside of every tag can't be reached or removed.
+        if not paths:
+            warnings.warn("Skipped data {0!r} at {1!r}, which has no tags.".format(name, location))
+            return
+
+        key = (name, location)
+        eid = self.seen.get(key)
+
+        if eid is None:
+            existing = [id for id in self.TABLE.DATA.lookup_eids(name)
+                        if self.TABLE.DATA.get(eid=id)['location'] == location]
+
+            if existing:
+                eid = existing[0]
+                self.data[eid] = dict(self.TABLE.DATA.get(eid=eid))
+                self.data[eid]['parents'] = list(self.data[eid]['parents'])
+            else:
+                eid = self.TABLE.DATA._get_next_id()
+                self.created["data"].add(eid)
+                self.data[eid] = Data(name, description, location).__serialize__()
+
+            self.seen[key] = eid
+
+        for path in paths:
+            tageid = self.tag(path)
+            if (tageid, eid) not in self.members:
+                self.members.add((tageid, eid))
+                if tageid not in self.data[eid]['parents']:
+                    self._tag(tageid)['datalist'].append(eid)
+                    self.data[eid]['parents'].append(tageid)
+
+    def cell(self, paths):
+        """
+        Creates the tablecell of the tags at paths and the table of their parents,
+        as TableCell.insert_cell() does.
+        """
+
+        complex = [self.tag(path) for path in paths]
+        combo = ComboIndex.canonical(complex)
+
+        if combo in self.cellcombos or self.TABLE.CELLS.combos.get(combo) is not None:
+            return
+
+        eid = self.TABLE.CELLS._get_next_id()
+        self.created["tablecells"].add(eid)
+        self.cellcombos[combo] = eid
+        self.cells[eid] = {'name': None, 'complex': complex, 'tags': [], 'type': None}
+
+        for tageid in complex:
+            self._tag(tageid)['tablecells'].append(eid)
+
+        parents = [self._tag(tageid)['parent'] for tageid in complex]
+        if None in parents:
+            return
+
+        tablecombo = ComboIndex.canonical(parents)
+        tableeid = self.tablecombos.get(tablecombo, self.TABLE.TABS.combos.get(tablecombo))
+
+        if tableeid is None:
+            tableeid = self.TABLE.TABS._get_next_id()
+            self.created["tables"].add(tableeid)
+            self.tablecombos[tablecombo] = tableeid
+            self.tables[tableeid] = {'name': " x ".join(self._tag(id)['name'] for id in parents),
+                                     'tags': parents,
+                                     'tablecells': [],
+                                     'type': None}
+            for parent in parents:
+                self._tag(parent)['tables'].append(tableeid)
+
+        elif tableeid not in self.tables:
+            self.tables[tableeid] = dict(self.TABLE.TABS.get(eid=tableeid))
+
+        self.tables[tableeid]['tablecells'].append(eid)
+
+    def write(self):
+        """
+        Sets the derived tagtype and tablecell fields and writes each table once.
+        """
+
+        for document in self.tags.values():
+            if document['taglist'] != [] and document['datalist'] != []:
+                document['tagtype'] = None
+            elif document['taglist'] != []:
+                document['tagtype'] = "taglist"
+            elif document['datalist'] != []:
+                document['tagtype'] = "datalist"
+            else:
+                document['tagtype'] = None
+
+        for document in self.cells.values():
+            types = [self._tag(id)['tagtype'] for id in document['complex']]
+            document['type'] = types[0] if all(x == types[0] for x in types) else "mix"
+
+            symbol = {"taglist": ".", "datalist": "#"}.get(document['type'], "")
+            names = [self._tag(id)['name'] for id in document['complex']]
+            document['name'] = names[0] + "".join(" {0}& {1}".format(symbol, name) for name in names[1:])
+
+        self.TABLE.TAGS.write_elements(self.tags)
+        self.TABLE.DATA.write_elements(self.data)
+        self.TABLE.CELLS.write_elements(self.cells)
+        self.TABLE.TABS.write_elements(self.tables)
+
+    def counts(self):
+
+        return dict((table, len(eids)) for table, eids in self.created.items())
+
+    @staticmethod
+    def read_json(file):
+        """
+        Reads a list of tag nodes, or {"tags": [nodes], "cells": [[path, path], ...]}.
+        A node is {"name": name, "tags": [nodes], "data": [{"name", "description", "location"}]}
+        and a path in cells is "supertag/tag".
+        """
+
+        document = json.load(file)
+        if isinstance(document, list):
+            document = {"tags": document}
+
+        stack = [((), node) for node in reversed(document.get("tags", []))]
+
+        while stack:
+            parent, node = stack.pop()
+            path = parent + (node['name'],)
+
+            yield ("tag", path)
+
+            for data in node.get("data", []):
+                yield ("data", [path], data.get("name"), data.get("description"), data.get("location"))
+
+            stack.extend((path, child) for child in reversed(node.get("tags", [])))
+
+        for cell in document.get("cells", []):
+            yield ("cell", [tuple(cellpath.split("/")) for cellpath in cell])
+
+    @staticmethod
+    def read_csv(file):
+        """
+        Reads rows with the columns name, description, location and tags,
+        where tags is a ";" separated list of "supertag/tag" paths.
+        Rows without tags are skipped with a warning.
+        """
+
+        for row in csv.DictReader(file):
+            paths = [tuple(name.strip() for name in path.split("/"))
+                     for path in (row.get("tags") or "").split(";") if path.strip()]
+
+            yield ("data", paths, row.get("name"), row.get("description"), row.get("location"))
+
+    @staticmethod
+    def read_html(file):
+        """
+        Reads a Netscape bookmark file. Folders become tags and links become data.
+        Links outside of any folder go into a tag named after the file's title.
+        """
+
+        parser = BookmarkParser()
+
+        for chunk in iter(lambda: file.read(65536), ""):
+            parser.feed(chunk)
+            for record in parser.records:
+                yield record
+            parser.records = []
+
+        parser.close()
+        parser.flush_link()
+        for record in parser.records:
+            yield record
+
+
+class BookmarkParser(HTMLParser):
+    """
+    Turns a Netscape bookmark file into BulkImport records as it is fed.
+    """
+
+    def __init__(self):
+        HTMLParser.__init__(self)
+
+        self.title = "Bookmarks"
+        self.stack = []
+        self.folder = None
+
+        # [path, name, description, location] of the link waiting for its <DD>
+        self.link = None
+
+        # Character data of the open <H1>, <H3>, <A> or <DD>
+        self.field = None
+        self.text = []
+
+        self.records = []
+
+    def path(self):
+
+        path = tuple(folder for folder in self.stack if folder is not None)
+        return path if path != () else (self.title,)
+
+    def flush_link(self):
+
+        if self.link is not None:
+            path, name, description, location = self.link
+            self.records.append(("data", [path], name, description, location))
+            self.link = None
+
+    def close_field(self):
+
+        text = "".join(self.text).strip()
+
+        if self.field == "h1":
+            self.title = text or self.title
+        elif self.field == "h3":
+            self.folder = text
+        elif self.field == "a" and self.link is not None:
+            self.link[1] = text
+        elif self.field == "dd" and self.link is not None:
+            self.link[2] = text
+
+        self.field = None
+        self.text = []
+
+    def handle_starttag(self, tag, attrs):
+
+        if self.field == "dd":
+            self.close_field()
+
+        if tag in ("h1", "h3", "a"):
+            self.flush_link()
+            self.field = tag
+            self.text = []
+            if tag == "a":
+                self.link = [self.path(), None, None, dict(attrs).get("href")]
+
+        elif tag == "dd":
+            self.field = tag
+            self.text = []
+
+        elif tag == "dl":
+            self.flush_link()
+            if self.folder is not None:
+                self.records.append(("tag", tuple(f for f in self.stack if f is not None) + (self.folder,)))
+            self.stack.append(self.folder)
+            self.folder = None
+
+    def handle_endtag(self, tag):
+
+        if self.field is not None and (tag == self.field or self.field == "dd"):
+            self.close_field()
+
+        if tag == "dl":
+            self.flush_link()
+            if self.stack:
+                self.stack.pop()
+
+    def handle_data(self, data):
+
+        if self.field is not None:
+            self.text.append(data)
+
+    def handle_entityref(self, name):
+
+        self.handle_data(self.unescape("&{0};".format(name)))
+
+    def handle_charref(self, name):
+
+        self.handle_data(self.unescape("&#{0};".format(name)))
+
+
+class GraphStream(object):
+    """
+    The NDJSON records of TinyTagsDB.export_stream() and import_stream().
+
+    The first line is {"format": "tinytags", "version": 1} and every other line
+    {"table": tablename, "eid": eid, "element": document}. Tags come first, then
+    data, tablecells and tables, each in eid order.
+    """
+
+    FORMAT = "tinytags"
+    VERSION = 1
+
+    TABLES = [("tags", "TAGS"), ("data", "DATA"), ("tablecells", "CELLS"), ("tables", "TABS")]
+
+    # The table that each id list field of an element refers to
+    REFERENCES = {"tags": {"taglist": "tags", "datalist": "data", "tables": "tables", "tablecells": "tablecells"},
+                  "data": {"parents": "tags"},
+                  "tablecells": {"complex": "tags", "tags": "tags"},
+                  "tables": {"tags": "tags", "tablecells": "tablecells"}}
+
+    # Fields that TagsTable derives again on every write
+    DERIVED = ["bitmaps", "version"]
+
+    @staticmethod
+    def open(path, mode, compress=None):
+        """
+        Opens path, gzipped if compress is set. Otherwise it is guessed from a .gz
+        path when writing, and from the gzip magic number when reading.
+        """
+
+        if compress is None:
+            if "r" in mode:
+                with open(path, "rb") as file:
+                    compress = file.read(2) == "\x1f\x8b"
+            else:
+                compress = path.endswith(".gz")
+
+        return gzip.open(path, mode) if compress else open(path, mode)
+
+    @classmethod
+    def header(cls):
 
-                self.append(tablecell)
-            
-        return self
-    
-    def select_cells(self, tag, childtagname):
+        return json.dumps({"format": cls.FORMAT, "version": cls.VERSION}, sort_keys=True) + "\n"
+
+    @classmethod
+    def line(cls, tablename, eid, element):
+
+        element = dict((key, value) for key, value in element.items() if key not in cls.DERIVED)
+
+        return json.dumps({"table": tablename, "eid": eid, "element": element}, sort_keys=True) + "\n"
+
+    @classmethod
+    def check(cls, header):
+
+        if header.get("format") != cls.FORMAT or header.get("version", 0) > cls.VERSION:
+            raise ValueError("Not a tinytags stream of version {0} or older: {1}".format(cls.VERSION, header))
+
+    @classmethod
+    def remap(cls, tablename, element, offsets):
         """
-        Return a row or column of cells.
-        
-        Input: Table.select_cells(int tag, string childtagname)
-        
-        If you have four cells
-        child1 and child2 are in tag number 1
-        child3 and child4 are in tag number 2
-            child1 & child3
-            child1 & child4
-            child2 & child3
-            child2 & child4
-        Table.select_cells(1, "child1")
-        This will return all cells from parent tag 1 with child, "child1"
-        So child1 & child3, and child1 & child4
+        Returns element with every eid it refers to moved by the offset of its table.
         """
-        
-        cells = []
-        
-        for element in self:
-            if childtagname == Tag(eid=element.complex[tag-1]).name:
-                cells.append(element)
-                
-        return cells
-    
-    def insert_table(self):
-        
-        if self.table == None:
-            
-            # Insert table into database.
-            eid = self.TABLE.TABS.insert(self.__serialize__())
-            self.eid = eid
 
-            for tag in self.tags:
-                # Insert this table eid into parent categories.
-                self.update_id(eid, self.TABLE.TAGS, tag, "tables")
+        element = dict(element)
 
-        # Insert new tablecell id into this table.
-        if self.tablecell != None and self.table != None:
-            self.update_id(self.tablecell, self.TABLE.TABS, self.table.eid, "tablecells", self)
-        elif self.tablecell != None and self.table == None:
-            self.update_id(self.tablecell, self.TABLE.TABS, eid, "tablecells")
+        for field, target in cls.REFERENCES[tablename].items():
+            if field in element:
+                element[field] = [id + offsets[target] for id in element[field]]
 
-        # If tablecell is in database, Update table to include all eids in tablecells
-        # If tablcell has no eid, then update_id will return None
-        tablecells = [tablecell.eid for tablecell in self[:]]
-        for id in tablecells:
-            self.update_id(id, self.TABLE.TABS, self.eid, "tablecells", self)
+        if tablename == "tags" and element.get('parenttype') in ["tag", "cell"]:
+            element['parent'] += offsets["tags" if element['parenttype'] == "tag" else "tablecells"]
 
-    def remove(self):
+        return element
 
-        for cell in self[:]:
-            try:
-                TableCell(eid=cell).remove()
-            except:
-                pass
 
-        if self.eid != None:
-            self.TABLE.TABS.remove(eids=[self.eid])
-    
-    def get(self, key):
-        
-        if key == "^":
-            # Returns the parent Tags that Table belongs to.
-            return TagList([Tag(eid=id) for id in self.tags])
-        
-        if key == "&":
-            # Returns the table cells.
-            if self.joined == True:
-                return self[:]
-            else:
-                return [TableCell(eid=id) for id in self[:]]
+class AsyncTinyTagsDB(object):
+    """
+    An asyncio front for a threadsafe TinyTagsDB. Every method returns a future:
+
+        db = AsyncTinyTagsDB("tags.json")
+        animals = await db.select("animals")            # asyncio
+        animals = yield From(db.select("animals"))      # trollius
+        yield From(db.insert(animals, Tag("cat")))
+
+    Reads run in parallel on a pool of threads, so they never block the loop.
+    Writes go into one queue. Each burst of queued writes is applied by a single
+    writer thread inside one db.batch(), and costs one storage flush. A write that
+    raises fails only its own future; like outside a batch, what it wrote before
+    raising stays.
+    """
+
+    def __init__(self, database=None, loop=None, readers=4, delay=0, **kwargs):
+        """
+        delay is how many seconds the queue waits for more writes before applying them.
+        Other keyword arguments are passed to TinyTagsDB.
+        """
 
+        if asyncio is None or ThreadPoolExecutor is None:
+            raise ImportError("AsyncTinyTagsDB needs asyncio, or trollius and futures on Python 2.")
 
-class TableCell(NamedComplex, Id):
+        kwargs["threadsafe"] = True
+        self.db = TinyTagsDB(database, **kwargs)
+        self.loop = loop if loop is not None else asyncio.get_event_loop()
 
-    def __init__(self, name=None, complex=None, eid=None):
-        
-        if eid != None:
-            self.eid = eid
-            self.sync()
+        self.readers = ThreadPoolExecutor(readers)
+        self.writer = ThreadPoolExecutor(1)
+        self.delay = delay
 
-        else:
-            NamedComplex.__init__(self, name, complex)
-            
-            self.tags = []
+        # (function, args, future) of writes not applied yet
+        self.queue = []
+        self.scheduled = False
+        self.applying = False
 
-            # if no complex, set type to None
-            # else, get all the types of the tags.
-            if complex == None:
-                self.type = None
-            else:
-                types = [tag.tagtype for tag in complex if not isinstance(tag, int)]
+    def read(self, function, *args):
+        """
+        Runs function(*args) on a reader thread.
+        """
 
-            # if all tag types are the same, set tablecell type to taglist or datalist,
-            # else set tablecell type to mix
-            if types != [] and all(x == types[0] for x in types):
-                self.type = types[0]
-            elif types == []:
-                self.type = None
-            else:
-                self.type = "mix"
-                
-            self.eid = None
+        return self.loop.run_in_executor(self.readers, function, *args)
 
-        if self.type == "taglist":
-            symbol = "." 
-        elif self.type == "datalist":
-            symbol = "#"
+    def write(self, function, *args):
+        """
+        Queues function(*args) for the writer thread.
+        """
+
+        future = asyncio.Future(loop=self.loop)
+        self.queue.append((function, args, future))
+        self._schedule()
+
+        return future
+
+    def _schedule(self):
+
+        if self.scheduled or self.applying or not self.queue:
+            return
+
+        self.scheduled = True
+        if self.delay:
+            self.loop.call_later(self.delay, self._apply)
         else:
-            symbol = ""
+            self.loop.call_soon(self._apply)
 
-        if self.name == None:
-            self.name = ""
-            tags = self.get("^")
-            for tag in tags:
-                if tag == tags[0]:
-                    self.name += tag.name    
-                else:
-                    self.name += " {0}& {1}".format(symbol, tag.name)
+    def _apply(self):
+
+        self.scheduled = False
+        self.applying = True
+
+        burst, self.queue = self.queue, []
+
+        applied = self.loop.run_in_executor(self.writer, self._commit, [(function, args) for function, args, future in burst])
+        applied.add_done_callback(lambda applied: self._applied(burst, applied))
+
+    def _commit(self, burst):
+        """
+        Applies a burst of writes in one batch and returns (result, error) for each.
+        """
+
+        outcomes = []
+
+        with self.db.batch():
+            for function, args in burst:
+                try:
+                    outcomes.append((function(*args), None))
+                except Exception as error:
+                    outcomes.append((None, error))
+
+        return outcomes
+
+    def _applied(self, burst, applied):
+
+        self.applying = False
+
+        if applied.exception() is not None:
+            # The batch itself failed, so none of the burst was written.
+            outcomes = [(None, applied.exception())] * len(burst)
         else:
-            self.name += "{0}&{1}".format(symbol, self.name)
-            
-        self.elementqueue = []
-            
-    def __repr__(self):
-        
-        return self.name
-        
-    def __serialize__(self):
-        
-        self.dict = {'name': self.name,
-                    'complex': self.complex,
-                    'tags': self.tags,
-                    'type': self.type}
-        
-        return self.dict
-    
-    def sync(self):
-        self.namedcomplex = self.TABLE.CELLS.get(eid=self.eid)
-        self.complex = TagList(self.namedcomplex['complex'])
+            outcomes = applied.result()
 
-        Id.__init__(self, self.namedcomplex)
-        self.name = self.namedcomplex['name']
-        self.tags = self.namedcomplex['tags']
-        self.type = self.namedcomplex['type']
-        
-    def show(self, tabs=0):
-        cellstring = ""
-        for num, cat in enumerate(self.get("^")):
-            if num == 0:
-                cellstring += "{}".format(cat)
+        for (function, args, future), (result, error) in zip(burst, outcomes):
+            if future.cancelled():
+                continue
+            if error is not None:
+                future.set_exception(error)
             else:
-                cellstring += " & {}".format(cat)
-        print " "*4*tabs + cellstring
-        for cat in self.get("^")[1:]:
-            print " "*4*(tabs+1) + "Parent: {}".format(cat)
-        for cat in self.get("and"):
-            print " "*4*(tabs+1) + "{}".format(cat)
-        for hash in self.get("dand"):
-            print " "*4*(tabs+1) + "{}".format(hash)
-        
-    def insert(self, element):
+                future.set_result(result)
+
+        self._schedule()
+
+    def select(self, string):
+
+        return self.read(self.db.select, string)
+
+    def select_data(self, dataname):
+
+        return self.read(self.db.select_data, dataname)
+
+    def roots(self):
+
+        return self.read(self.db.roots)
+
+    def search(self, query, within=None, tags=False, limit=None):
         """
-        If selected gets eid and inserts into complex. If made from Category(),
-        enters into database and then enters into complex.
+        A list of the (Data or Tag, score) of TinyTagsDB.search(), best first.
         """
-            
-        if element.eid is not None:
 
-            self.elementqueue.append(element)
-            
-        else:
-            raise LookupError("Must use TinyTagsDB.select() to insert Category or HashTag.")
+        return self.read(lambda: list(self.db.search(query, within, tags, limit)))
 
-    def insert_cell(self):
-        if self.eid == None:
-    
-            self.eid = self.TABLE.CELLS.insert(self.__serialize__())
-            self.elementqueue = TagList([Tag(eid=id) for id in self.complex])
+    def autocomplete(self, text, limit=10, fuzzy=True):
 
-        try:
-            for element in self.elementqueue:
-                
-                # Insert eid of element Tag into this table cell key complex
-                self.update_id(element.eid, self.TABLE.CELLS, self.eid, "complex", self)
+        return self.read(self.db.autocomplete, text, limit, fuzzy)
 
-                # Goto Tag and insert eid for this tablecell into Tag key tablecells.
-                self.update_id(self.eid, self.TABLE.TAGS, element.eid, "tablecells", element)
-                    
-            self.elementqueue = []
-            
-        except:
-            pass
-        
-        # Lookup Tags of this tablecells, and find tags parent categories.
-        tags = TagList([Tag(eid=id).get("^") for id in self.complex])
+    def get(self, element, key=None):
+        """
+        Tag.get(), TagList.get(), Table.get() or TableCell.get() of element.
+        """
 
-        # Insert Table
-        Table(tags=tags, tablecell=self.eid).insert_table()
+        return self.read(element.get, key)
 
-    def remove(self):
+    def descendants(self, tag):
 
-        if self.eid != None:
-            self.TABLE.CELLS.remove(eids=[self.eid])
-        
-    def get(self, key):
-        
-        try:
-            complex = self.namedcomplex['complex']
-        except:
-            complex = self.complex
-            
-        if key == "^":
-            # Returns the parent tags that TableCell belong to.
-            return TagList([Tag(eid=id) for id in complex])
-            
-        elif key == ".":
-            # To abstraction. Returns a list of categories that the tablecell belong to.
-            pass
+        return self.read(tag.descendants)
 
-        elif key == "and":
-            # Returns common child categories of tablecell categories.
-            if self.type == "taglist":
-                sets = [set(Tag(eid=id).taglist) for id in complex]
-                # Uses a set operation. Returns a list of data.
-                ids = reduce(lambda x, y: x & y, sets)
-                return [Tag(eid=id) for id in ids]
-            else:
-                return []
+    def all_data(self, tag):
 
-        elif key == "dand":
-            # Returns the data that is associated with this complex tag.
-            if self.type == "datalist":
-                sets = [set(Tag(eid=id).datalist) for id in complex]
-                # Uses a set operation. Returns a list of data.
-                dataids = reduce(lambda x, y: x & y, sets)
-                return [Data(eid=id) for id in dataids]
-            else:
-                return []
+        return self.read(tag.all_data)
 
-                            
+    def join(self, elements):
+        """
+        The cells of TagList.join() or Table.join() of elements as a list, all made
+        on a reader thread so iterating them doesn't block the loop.
+        """
 
-    
+        return self.read(lambda: list(elements.join()))
+
+    def page(self, table, number, size=50):
+
+        return self.read(table.page, number, size)
+
+    def insert(self, tag, *elements):
+
+        return self.write(tag.insert, *elements)
+
+    def insert_root(self, element):
+
+        return self.write(self.db.insert_root, element)
+
+    def insert_cell(self, cell):
+
+        return self.write(cell.insert_cell)
+
+    def rename(self, element, name):
+
+        return self.write(element.rename, name)
+
+    def remove(self, element):
+
+        return self.write(element.remove)
+
+    def import_bulk(self, source, format=None):
+
+        return self.write(self.db.import_bulk, source, format)
+
+    def import_stream(self, source, compress=None, remap=True):
+
+        return self.write(self.db.import_stream, source, compress, remap)
+
+    def export_stream(self, destination, compress=None):
+        """
+        TinyTagsDB.export_stream() to destination, a path or file.
+        """
+
+        return self.read(self.db.export_stream, destination, compress)
+
+    def flush(self):
+        """
+        Returns a future that is done once every write queued so far is applied.
+        """
+
+        return self.write(lambda: None)
+
+    def close(self):
+        """
+        Applies the queued writes and closes the database.
+        """
+
+        closed = asyncio.Future(loop=self.loop)
+
+        def close(flushed):
+            closing = self.loop.run_in_executor(self.writer, self.db.close)
+            closing.add_done_callback(lambda closing: finish(closing))
+
+        def finish(closing):
+            self.readers.shutdown(wait=False)
+            self.writer.shutdown(wait=False)
+
+            if closing.exception() is not None:
+                closed.set_exception(closing.exception())
+            else:
+                closed.set_result(None)
 
+        self.flush().add_done_callback(close)
 
+        return closed